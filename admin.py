@@ -1,6 +1,14 @@
 import streamlit as st
 import pandas as pd
 import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from token_usage import get_usage_summary
+from catalog import get_catalog
+from perf_metrics import get_last_profile, get_memory_stats, get_stage_stats, is_profile_requested, request_profile
+from receipt_cache import clear_recorded, get_cache_stats
+from job_queue import clear_jobs, get_queue_metrics
 
 # Admin credentials (should be kept secure)
 admin_username = "admin"
@@ -9,31 +17,24 @@ admin_password = "admin_password"  # Change this to a more secure password
 # Base directory to store user folders
 BASE_DIR = 'user_folders'
 
+# Folders of deleted users are moved here when they are archived
+ARCHIVE_DIR = os.path.join('.app_data', 'archived_users')
+
+# Columns expected in an uploaded users CSV
+IMPORT_COLUMNS = ['username', 'password']
+
+# Page sizes offered for the user list
+USER_PAGE_SIZES = [25, 50, 100]
+
 # Function to save user credentials to CSV file
 def save_credentials_to_csv(username, password):
     # Validate the username
     if not username.islower() or " " in username:
         return False  # Invalid username
 
-    # Load existing credentials
-    credentials_file = 'user_credentials.csv'
-    if os.path.exists(credentials_file):
-        df = pd.read_csv(credentials_file)
-
-        # Check if the username already exists
-        if username in df['username'].values:
-            return False  # Username already exists
-    else:
-        df = pd.DataFrame(columns=['username', 'password'])
-
-    # Create a new DataFrame for the new user
-    new_user_df = pd.DataFrame({'username': [username], 'password': [password]})
-
-    # Concatenate the existing DataFrame with the new user DataFrame
-    df = pd.concat([df, new_user_df], ignore_index=True)
-
-    # Save to CSV
-    df.to_csv(credentials_file, index=False)
+    # Add the user through the catalog (locked atomic rewrite, returns False if the username exists)
+    if not get_catalog().add_user(username, password):
+        return False  # Username already exists
 
     # Create a new folder for the user
     user_folder = os.path.join(BASE_DIR, username)
@@ -42,24 +43,70 @@ def save_credentials_to_csv(username, password):
 
     return True  # User added successfully
 
-# Function to load user credentials from CSV
-def load_credentials_from_csv():
-    credentials_file = 'user_credentials.csv'
-    if os.path.exists(credentials_file):
-        return pd.read_csv(credentials_file)
-    return pd.DataFrame(columns=['username', 'password'])
-
-# Function to delete user credentials and their folder
-def delete_user_credentials(username):
-    # Load existing credentials
-    df = load_credentials_from_csv()
-    df = df[df['username'] != username]  # Keep only users that do not match the username
-    df.to_csv('user_credentials.csv', index=False)  # Save the updated DataFrame
-
-    # Delete the user's folder
+# Function to check an uploaded users table, one vectorized check per rule
+def validate_user_import(df):
+    """Split `df` into (rows to import, rejected rows with a 'reason' column)."""
+    df = df.reindex(columns=IMPORT_COLUMNS).fillna('').astype(str)
+    df['username'] = df['username'].str.strip()
+    usernames = df['username']
+
+    # Earlier rules win, so apply them in reverse
+    rules = [
+        (usernames.eq(''), 'missing username'),
+        (df['password'].eq(''), 'missing password'),
+        (~usernames.str.islower() | usernames.str.contains(' ', regex=False), 'username must be lowercase with no spaces'),
+        (usernames.duplicated(keep='first'), 'duplicate username in file'),
+        (usernames.isin(get_catalog().get_users().keys()), 'username already exists'),
+    ]
+    reason = pd.Series('', index=df.index)
+    for mask, message in reversed(rules):
+        reason = reason.mask(mask, message)
+
+    rejected = df.loc[reason.ne(''), ['username']].assign(reason=reason[reason.ne('')])
+    return df[reason.eq('')], rejected
+
+# Function to add the users of an uploaded CSV with a single write
+def import_users_from_csv(uploaded_file):
+    """Return (added usernames, rejected rows). Raises ValueError if the CSV lacks the columns."""
+    df = pd.read_csv(uploaded_file, dtype=str, keep_default_na=False)
+    df.columns = [str(column).strip().lower() for column in df.columns]
+    missing = [column for column in IMPORT_COLUMNS if column not in df.columns]
+    if missing:
+        raise ValueError(f"The CSV is missing the column(s): {', '.join(missing)}")
+
+    valid, rejected = validate_user_import(df)
+    added = get_catalog().add_users(zip(valid['username'], valid['password']))
+    for username in added:
+        os.makedirs(os.path.join(BASE_DIR, username), exist_ok=True)
+    return added, rejected
+
+# Function to get the worker that removes deleted users' data off the request path
+@st.cache_resource
+def get_removal_executor():
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="user-removal")
+
+# Function to archive or delete a user's folder and forget their cached receipts and jobs
+def remove_user_data(username, archive=True):
     user_folder = os.path.join(BASE_DIR, username)
-    if os.path.exists(user_folder):
-        os.rmdir(user_folder)  # Remove the directory (make sure it's empty)
+    # Never touch anything that is not a direct child of the user folders directory
+    if os.path.dirname(os.path.abspath(user_folder)) == os.path.abspath(BASE_DIR) and os.path.isdir(user_folder):
+        if archive:
+            os.makedirs(ARCHIVE_DIR, exist_ok=True)
+            shutil.move(user_folder, os.path.join(ARCHIVE_DIR, f"{username}-{time.strftime('%Y%m%d-%H%M%S')}"))
+        else:
+            shutil.rmtree(user_folder)
+    clear_recorded(username)
+    clear_jobs(username)
+
+# Function to delete users and remove their data in the background
+def delete_users(usernames, archive=True):
+    """Remove the users from user_credentials.csv in one rewrite, then queue their data removal.
+
+    Returns the future of the background removal.
+    """
+    usernames = list(usernames)
+    get_catalog().delete_users(usernames)
+    return get_removal_executor().submit(lambda: [remove_user_data(username, archive) for username in usernames])
 
 # Function to display the admin panel
 def display_admin_panel():
@@ -109,22 +156,124 @@ def display_admin_panel():
             else:
                 st.error("Please provide both username and password.")
 
-        # Load and display existing users
-        st.write("Existing Users:")
-        df = load_credentials_from_csv()
-
-        if not df.empty:
-            for index, row in df.iterrows():
-                col1, col2 = st.columns([1, 1])  # Create two columns for layout
-                with col1:
-                    st.write(row['username'])  # Display username
-                with col2:
-                    if st.button("Delete", key=row['username']):  # Create a delete button for each user
-                        delete_user_credentials(row['username'])
-                        st.success(f"User '{row['username']}' deleted successfully!")
-                        st.rerun()  # Rerun to refresh the session
+        display_user_import()
+        display_user_list()
+
+        # Token usage this month, read from the pre-aggregated usage ledger
+        st.subheader("Token Usage (this month)")
+        usage = get_usage_summary()
+        if usage:
+            st.dataframe(pd.DataFrame(usage))
+            if st.checkbox("Break down by profile"):
+                st.dataframe(pd.DataFrame(get_usage_summary(by_profile=True)))
         else:
-            st.write("No users found.")
+            st.write("No GPT requests recorded this month.")
+
+        display_performance_dashboard()
+
+# Function to display the bulk user import
+def display_user_import():
+    st.subheader("Import Users")
+    uploaded_file = st.file_uploader("CSV with 'username' and 'password' columns", type="csv", key="user_import")
+    if uploaded_file is not None and st.button("Import Users"):
+        try:
+            added, rejected = import_users_from_csv(uploaded_file)
+        except (ValueError, pd.errors.ParserError) as e:
+            st.error(f"Could not import users: {e}")
+            return
+        st.success(f"Imported {len(added)} users.")
+        if not rejected.empty:
+            st.warning(f"{len(rejected)} rows were skipped:")
+            st.dataframe(rejected, hide_index=True)
+
+# Function to reset the user list to its first page (e.g. when the search changes)
+def reset_user_page():
+    st.session_state['user_page'] = 1
+
+# Function to display one page of the user list with bulk delete
+def display_user_list():
+    st.subheader("Existing Users")
+    catalog = get_catalog()
+
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        query = st.text_input("Search users", key="user_query", on_change=reset_user_page)
+    with col2:
+        page_size = st.selectbox("Users per page", USER_PAGE_SIZES, key="user_page_size", on_change=reset_user_page)
+
+    page = st.session_state.get('user_page', 1)
+    usernames, total = catalog.search_users(query, (page - 1) * page_size, page_size)
+    page_count = max(1, -(-total // page_size))
+    if page > page_count:
+        page = st.session_state['user_page'] = page_count
+        usernames, total = catalog.search_users(query, (page - 1) * page_size, page_size)
+
+    if not usernames:
+        st.write("No users found.")
+    else:
+        st.dataframe(pd.DataFrame({'username': usernames}), hide_index=True, use_container_width=True)
+    st.number_input(f"Page (of {page_count}, {total} users)", min_value=1, max_value=page_count, step=1, key="user_page")
+
+    # Bulk delete from the current page
+    selected = st.multiselect("Select users to delete", usernames, key="users_to_delete")
+    if selected:
+        keep_data = st.radio("User folders", ["Archive", "Delete permanently"], horizontal=True) == "Archive"
+        if st.button(f"Delete {len(selected)} selected users"):
+            future = delete_users(selected, archive=keep_data)
+            st.session_state.setdefault('user_removals', []).append((selected, future))
+            del st.session_state['users_to_delete']
+            st.rerun()
+
+    # Progress of the background folder removal
+    removals = st.session_state.get('user_removals', [])
+    for removed, future in removals:
+        if not future.done():
+            st.info(f"Removing the data of {len(removed)} deleted users in the background...")
+        elif future.exception() is not None:
+            st.error(f"Removing the data of {', '.join(removed)} failed: {future.exception()}")
+    st.session_state['user_removals'] = [(removed, future) for removed, future in removals if not future.done()]
+
+# Function to display stage latencies, throughput, cache hit rates and errors
+def display_performance_dashboard():
+    st.subheader("Performance")
+
+    horizon_minutes = st.selectbox("Time window", [5, 15, 60], index=1, format_func=lambda m: f"Last {m} minutes")
+    stage_stats = get_stage_stats(horizon_minutes * 60)
+    if stage_stats:
+        df = pd.DataFrame.from_dict(stage_stats, orient="index")
+        df.index.name = "stage"
+        st.dataframe(df.round(1))
+    else:
+        st.write("No receipts processed by this server process yet.")
+
+    # Pixel memory per decoded and preprocessed image, next to what a full-resolution decode would have needed
+    memory_stats = get_memory_stats(horizon_minutes * 60)
+    if memory_stats:
+        st.write("Memory per image (MB)")
+        df = pd.DataFrame.from_dict(memory_stats, orient="index")
+        df.index.name = "metric"
+        st.dataframe(df.round(1))
+
+    # Cache hit rate and job queue health
+    cache_stats = get_cache_stats()
+    queue_metrics = get_queue_metrics()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Cache hit rate", f"{cache_stats['hit_rate']:.0%}", f"{cache_stats['hits']} hits / {cache_stats['misses']} misses", delta_color="off")
+    col2.metric("Queued jobs", queue_metrics["queued"], f"{queue_metrics['running']} running", delta_color="off")
+    col3.metric("Job latency p95", f"{queue_metrics['latency_p95']:.1f}s", f"p50 {queue_metrics['latency_p50']:.1f}s", delta_color="off")
+    col4.metric("Failed jobs", queue_metrics["failed"])
+
+    # Optional cProfile capture of a single receipt job
+    if is_profile_requested():
+        st.info("The next receipt upload will be profiled.")
+    elif st.button("Profile the next receipt upload"):
+        request_profile()
+        st.rerun()
+
+    last_profile = get_last_profile()
+    if last_profile:
+        with st.expander(f"Last profile: {last_profile['label']}"):
+            st.code(last_profile["report"])
 
 # Run the admin panel function
 if __name__ == "__main__":
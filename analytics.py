@@ -0,0 +1,133 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import streamlit as st
+from receipt_store import get_data_version, get_spending_totals, load_line_items
+
+# Users whose typed line items are kept in memory for ad-hoc filtering
+LINE_ITEM_CACHE_USERS = 8
+# Rows of the filtered line items shown in the explorer
+MAX_ROWS_SHOWN = 200
+TOP_N = 10
+
+_line_items = OrderedDict()  # username -> (data version, DataFrame)
+_line_items_lock = threading.Lock()
+
+
+# Function to get a user's typed line items, re-reading them only after the receipts changed
+def get_line_items(username):
+    version = get_data_version(username)
+    with _line_items_lock:
+        cached = _line_items.get(username)
+        if cached is not None and cached[0] == version:
+            _line_items.move_to_end(username)
+            return cached[1]
+    df = load_line_items(username)
+    with _line_items_lock:
+        _line_items[username] = (version, df)
+        _line_items.move_to_end(username)
+        while len(_line_items) > LINE_ITEM_CACHE_USERS:
+            _line_items.popitem(last=False)
+    return df
+
+
+# Function to filter line items with vectorized masks (None means no filter)
+def filter_line_items(df, profiles=None, stores=None, start=None, end=None, min_amount=None, max_amount=None, text=None):
+    mask = np.ones(len(df), dtype=bool)
+    if profiles:
+        mask &= df["profile"].isin(profiles).to_numpy()
+    if stores:
+        mask &= df["store_name"].isin(stores).to_numpy()
+    if start is not None:
+        mask &= (df["purchased_on"] >= pd.Timestamp(start)).to_numpy()
+    if end is not None:
+        mask &= (df["purchased_on"] <= pd.Timestamp(end)).to_numpy()
+    if min_amount is not None:
+        mask &= (df["amount"] >= min_amount).to_numpy()
+    if max_amount is not None:
+        mask &= (df["amount"] <= max_amount).to_numpy()
+    if text:
+        mask &= df["item"].str.contains(text, case=False, regex=False, na=False).to_numpy()
+    return df[mask]
+
+
+# Function to display spending totals across all of a user's profiles
+def display_spending_analytics(username, profiles):
+    if not profiles:
+        return
+    overview_tab, explore_tab = st.tabs(["Overview", "Explore"])
+
+    with overview_tab:
+        selected = st.multiselect("Profiles", profiles, default=profiles, key="analytics_profiles")
+        if not selected:
+            st.write("Select at least one profile.")
+        else:
+            by_profile = get_spending_totals(username, "profile", selected)
+            if by_profile.empty:
+                st.write("No receipts recorded yet.")
+            else:
+                col1, col2 = st.columns(2)
+                col1.metric("Total spent", f"{by_profile['amount'].sum():,.2f}")
+                col2.metric("Items purchased", f"{int(by_profile['items'].sum()):,}")
+
+                st.write("Spending by month")
+                st.bar_chart(get_spending_totals(username, "month", selected).set_index("key")["amount"])
+                if len(selected) > 1:
+                    st.write("Spending by profile")
+                    st.bar_chart(by_profile.set_index("key")["amount"])
+
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.write(f"Top {TOP_N} stores")
+                    st.dataframe(_format_totals(get_spending_totals(username, "store", selected, TOP_N), "Store"), hide_index=True)
+                with col2:
+                    st.write(f"Top {TOP_N} items")
+                    st.dataframe(_format_totals(get_spending_totals(username, "item", selected, TOP_N), "Item"), hide_index=True)
+
+    with explore_tab:
+        display_line_item_explorer(username, profiles)
+
+
+# Function to display ad-hoc filters over the user's line items
+def display_line_item_explorer(username, profiles):
+    df = get_line_items(username)
+    if df.empty:
+        st.write("No receipts recorded yet.")
+        return
+
+    col1, col2 = st.columns(2)
+    with col1:
+        selected_profiles = st.multiselect("Profiles", profiles, key="explore_profiles")
+        # Options come from the same column the filter is applied to, so every choice matches rows
+        stores = st.multiselect("Stores", df["store_name"].cat.categories.tolist(), key="explore_stores")
+        text = st.text_input("Item contains", key="explore_text")
+    with col2:
+        dates = df["purchased_on"].dropna()
+        full_range = date_range = ()
+        if not dates.empty:
+            full_range = (dates.min().date(), dates.max().date())
+            date_range = st.date_input("Purchase dates", full_range, key="explore_dates")
+        min_amount = st.number_input("Minimum price", value=None, key="explore_min")
+        max_amount = st.number_input("Maximum price", value=None, key="explore_max")
+
+    # Items without a readable date only drop out once the user narrows the date range
+    start, end = None, None
+    if date_range != full_range:
+        start, end = (date_range + (None, None))[:2] if isinstance(date_range, tuple) else (date_range, None)
+    filtered = filter_line_items(df, selected_profiles, stores, start, end, min_amount, max_amount, text)
+
+    col1, col2 = st.columns(2)
+    col1.metric("Matching items", f"{len(filtered):,}")
+    col2.metric("Total", f"{filtered['amount'].sum():,.2f}")
+    if filtered.empty:
+        return
+
+    by_store = filtered.groupby("store_name", observed=True)["amount"].agg(["sum", "count"])
+    st.dataframe(by_store.sort_values("sum", ascending=False).head(TOP_N).rename(columns={"sum": "Amount", "count": "Items"}))
+    st.dataframe(filtered.sort_values("purchased_on", ascending=False).head(MAX_ROWS_SHOWN), hide_index=True)
+
+
+# Function to rename a totals DataFrame for display
+def _format_totals(df, label):
+    return df.rename(columns={"key": label, "amount": "Amount", "items": "Items"}).round({"Amount": 2})
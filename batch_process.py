@@ -0,0 +1,119 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from image_ingest import open_image, prepare_image, record_decode_stats
+from ocr_engine import image_to_text
+from perf_metrics import record_duration
+from receipt_cache import make_cache_key, get_cached_result, store_result
+
+# Tesseract is CPU-bound, so OCR runs on a process pool sized by the CPU count
+OCR_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+# GPT calls are I/O-bound; bound the number of requests in flight at once
+GPT_CONCURRENCY = 4
+
+_pool_lock = threading.Lock()
+_ocr_pool = None
+_gpt_pool = None
+
+
+# Function to get the shared worker pools (created once per server process)
+def _get_pools():
+    global _ocr_pool, _gpt_pool
+    with _pool_lock:
+        if _ocr_pool is None:
+            # Spawned workers don't inherit the server's threads or open sockets
+            _ocr_pool = ProcessPoolExecutor(max_workers=OCR_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        if _gpt_pool is None:
+            _gpt_pool = ThreadPoolExecutor(max_workers=GPT_CONCURRENCY, thread_name_prefix="gpt")
+    return _ocr_pool, _gpt_pool
+
+
+# Function to decode, preprocess and OCR one image (runs in a worker process)
+def ocr_image_bytes(image_bytes, preset):
+    """Return (OCR text, decode stats); the stats are recorded by the server process."""
+    image, decode_stats = open_image(image_bytes, preset)
+    image = prepare_image(image, preset, decode_stats)
+    return image_to_text(image), decode_stats
+
+
+# Function to run a batch of uploads through the OCR -> GPT pipeline
+def process_batch(uploads, settings, gpt_fn, on_progress=None):
+    """Process [(name, image_bytes), ...] and return one result dict per upload.
+
+    OCR jobs go to the process pool; as each one finishes, its GPT call is handed to
+    the I/O pool, so the two stages overlap. Cached receipts skip both stages.
+    `gpt_fn(text)` returns (response_text, usage). `on_progress(index, result)` is called
+    on the calling thread as each file finishes.
+    """
+    ocr_pool, gpt_pool = _get_pools()
+    results = [
+        {"name": name, "cache_key": make_cache_key(image_bytes, settings), "status": "queued",
+         "ocr_text": None, "gpt_response": None, "usage": None, "error": None, "cached": False}
+        for name, image_bytes in uploads
+    ]
+
+    pending = {}
+    for index, (name, image_bytes) in enumerate(uploads):
+        result = results[index]
+        cached = get_cached_result(result["cache_key"])
+        if cached is not None:
+            result.update(cached, status="done", cached=True)
+            if on_progress:
+                on_progress(index, result)
+            continue
+        result["status"] = "ocr"
+        future = ocr_pool.submit(ocr_image_bytes, image_bytes, settings["preset"])
+        pending[future] = ("ocr", index, time.perf_counter())
+
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            stage, index, submitted_at = pending.pop(future)
+            result = results[index]
+            try:
+                output = future.result()
+            except Exception as e:
+                record_duration(f"batch.{stage}", time.perf_counter() - submitted_at, error=True)
+                result.update(status="failed", error=f"{stage.upper()} failed: {e}")
+                if on_progress:
+                    on_progress(index, result)
+                continue
+
+            record_duration(f"batch.{stage}", time.perf_counter() - submitted_at)
+            if stage == "ocr":
+                # Hand the extracted text to the GPT stage
+                output, decode_stats = output
+                record_decode_stats(decode_stats)
+                result.update(ocr_text=output, status="gpt")
+                pending[gpt_pool.submit(gpt_fn, output)] = ("gpt", index, time.perf_counter())
+                if on_progress:
+                    on_progress(index, result)
+            else:
+                result["gpt_response"], result["usage"] = output
+                if not result["gpt_response"]:
+                    result.update(status="failed", error="Empty GPT response")
+                else:
+                    result["status"] = "done"
+                    store_result(result["cache_key"], result["ocr_text"], result["gpt_response"])
+                if on_progress:
+                    on_progress(index, result)
+
+    return results
+
+
+# Function to summarise the throughput of a finished batch
+def summarize_batch(results, started_at, recorded_items):
+    elapsed = max(time.perf_counter() - started_at, 1e-9)
+    processed = sum(1 for result in results if result["status"] == "done")
+    return {
+        "files": len(results),
+        "processed": processed,
+        "failed": sum(1 for result in results if result["status"] == "failed"),
+        "cache_hits": sum(1 for result in results if result["cached"]),
+        "recorded_items": recorded_items,
+        "total_tokens": sum(result["usage"]["total_tokens"] for result in results if result["usage"]),
+        "elapsed_seconds": elapsed,
+        "files_per_second": len(results) / elapsed,
+    }
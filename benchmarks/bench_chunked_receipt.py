@@ -0,0 +1,100 @@
+"""Check and time the chunked extraction of a long receipt.
+
+Builds the OCR text of a receipt with --items item lines (well over LONG_RECEIPT_TOKENS),
+runs it through get_gpt_response against the local stub in stub_openai.py, and checks
+that the merged receipt has exactly the receipt's store, date, items and total. The stub
+reads each chunk with the local extractor, so every chunk gets a real reply for its own
+lines. Exits with status 1 if the merged receipt is wrong. Needs the tiktoken encoding
+for the model. Run from the repository root:
+
+    python benchmarks/bench_chunked_receipt.py --items 300 --latency 0.5
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from receipt_extractor import extract_receipt  # noqa: E402
+from stub_openai import start_stub_server  # noqa: E402
+
+
+# Function to build the OCR text and ground truth of a long receipt
+def make_long_receipt(items, rng):
+    lines = ["FRESH MART", "RECEIPT NO 000001", "DATE 03/04/2025", ""]
+    truth_items = []
+    for number in range(1, items + 1):
+        item = {"name": f"ITEM {number:04d} {rng.choice(['MILK', 'BREAD', 'RICE', 'SOAP', 'TEA'])}",
+                "price": round(rng.uniform(0.5, 60), 2)}
+        truth_items.append(item)
+        lines.append(f"{item['name']:<24}{item['price']:>9.2f}")
+    total = round(sum(item["price"] for item in truth_items), 2)
+    lines += ["", f"{'TOTAL':<24}{total:>9.2f}", "THANK YOU"]
+    truth = {"store": "FRESH MART", "date": "2025-04-03", "items": truth_items, "total": total}
+    return "\n".join(lines), truth
+
+
+# Function to answer each chunk with what the local extractor reads from it
+def respond(messages):
+    receipt = extract_receipt(messages[-1]["content"])
+    return json.dumps({key: receipt[key] for key in ("store", "date", "items", "total")})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.5, help="Stub chat completion latency in seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    text, truth = make_long_receipt(args.items, random.Random(args.seed))
+    with tempfile.TemporaryDirectory() as data_dir:
+        os.chdir(data_dir)  # Keep the usage ledger and caches out of the repository
+        stub = start_stub_server(latency=args.latency, jitter=0, responder=respond)
+        os.makedirs(".streamlit")
+        with open(os.path.join(".streamlit", "secrets.toml"), "w", encoding="utf-8") as f:
+            f.write(f'[openai]\napi_key = "stub"\napi_base = "{stub.base_url}"\n\n[budgets]\nmonthly_tokens = 10000000\n')
+
+        import file_process
+        from token_usage import count_text_tokens
+
+        tokens = count_text_tokens(text, file_process.GPT_MODEL)
+        chunks = len(file_process.split_receipt_text(text, file_process.GPT_MODEL))
+        started = time.perf_counter()
+        content, usage = file_process.get_gpt_response(text, "bench", "bench")
+        elapsed = time.perf_counter() - started
+        requests = stub.stats["requests"]
+        stub.shutdown()
+
+    receipt = json.loads(content)
+    problems = []
+    for key in ("store", "date", "total"):
+        if receipt[key] != truth[key]:
+            problems.append(f"{key} is {receipt[key]!r}, expected {truth[key]!r}")
+    expected = [(item["name"], item["price"]) for item in truth["items"]]
+    found = [(item["name"], item["price"]) for item in receipt["items"]]
+    if found != expected:
+        missing, extra = set(expected) - set(found), len(found) - len(set(found))
+        problems.append(f"{len(found)} items for {len(expected)} expected "
+                        f"({len(missing)} missing, {extra} read twice)")
+
+    results = {"items": args.items, "text_tokens": tokens, "long_receipt_tokens": file_process.LONG_RECEIPT_TOKENS,
+               "chunks": chunks, "requests": requests, "elapsed_s": elapsed, "stub_latency_s": args.latency,
+               "usage": usage, "problems": problems}
+    print(f"{args.items} items, {tokens} tokens -> {chunks} chunks, {requests} requests in {elapsed:.2f}s "
+          f"(stub latency {args.latency}s), {usage['total_tokens']} tokens used")
+    print("Merged receipt matches the ground truth" if not problems else "\n".join(problems))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Measure near-duplicate lookup latency of the perceptual-hash index.
+
+Builds the multi-index hash table over N random 64-bit hashes, then times lookups for
+near-duplicates of stored hashes (a few bits flipped) and for unrelated hashes, next to a
+NumPy linear scan for reference. With --store it also times loading the hashes from a user's SQLite store.
+Run from the repository root:
+
+    python benchmarks/bench_dup_index.py --hashes 100000 --queries 1000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import receipt_store  # noqa: E402
+from duplicate_index import DUPLICATE_MAX_DISTANCE, DuplicateIndex, MultiIndexHash  # noqa: E402
+
+
+# Function to flip `bits` random bits of a 64-bit hash
+def flip_bits(value, bits, rng):
+    for bit in rng.sample(range(64), bits):
+        value ^= 1 << bit
+    return value
+
+
+# Function to count the set bits of every uint64 in an array
+def popcount64(values):
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+# Function to summarise latencies in milliseconds
+def latency_stats(seconds):
+    ordered = sorted(seconds)
+    return {
+        "mean_ms": 1000 * statistics.mean(ordered),
+        "p50_ms": 1000 * ordered[len(ordered) // 2],
+        "p95_ms": 1000 * ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+    }
+
+
+# Function to time lookups of each query
+def time_lookups(search, queries):
+    timings, matches = [], 0
+    for query in queries:
+        started = time.perf_counter()
+        matches += len(search(query))
+        timings.append(time.perf_counter() - started)
+    return dict(latency_stats(timings), matches=matches)
+
+
+# Function to time filling a DuplicateIndex from a user's store
+def time_store_load(hashes):
+    with tempfile.TemporaryDirectory() as base_dir:
+        receipt_store.BASE_DIR = base_dir
+        conn = receipt_store._connect("bench")
+        with conn:
+            conn.executemany(
+                "INSERT INTO image_hashes (profile, dhash, cache_key, file_name, created_at) VALUES (?, ?, ?, ?, ?)",
+                [("bench", value - (1 << 64) if value >= (1 << 63) else value, f"key{i}", None, 0.0)
+                 for i, value in enumerate(hashes)],
+            )
+        conn.close()
+        index = DuplicateIndex("bench")
+        started = time.perf_counter()
+        index.refresh()
+        loaded = time.perf_counter() - started
+        started = time.perf_counter()
+        index.refresh()  # Nothing new: one query for new rows and the count
+        return {"load_s": loaded, "refresh_ms": 1000 * (time.perf_counter() - started)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hashes", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--distance", type=int, default=DUPLICATE_MAX_DISTANCE)
+    parser.add_argument("--store", action="store_true", help="Also time loading the hashes from SQLite")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    hashes = [rng.getrandbits(64) for _ in range(args.hashes)]
+
+    started = time.perf_counter()
+    index = MultiIndexHash()
+    for i, value in enumerate(hashes):
+        index.add(value, i)
+    build_seconds = time.perf_counter() - started
+
+    # Half the queries are re-photographed receipts (a few bits off), half are new receipts
+    near = [flip_bits(rng.choice(hashes), rng.randint(0, args.distance), rng) for _ in range(args.queries // 2)]
+    unrelated = [rng.getrandbits(64) for _ in range(args.queries - len(near))]
+
+    array = np.array(hashes, dtype=np.uint64)
+
+    def linear_scan(query):
+        return np.flatnonzero(popcount64(array ^ np.uint64(query)) <= args.distance)
+
+    results = {
+        "hashes": args.hashes,
+        "distance": args.distance,
+        "build_s": build_seconds,
+        "index_near": time_lookups(lambda q: index.search(q, args.distance), near),
+        "index_unrelated": time_lookups(lambda q: index.search(q, args.distance), unrelated),
+        "numpy_scan": time_lookups(linear_scan, near[:100] + unrelated[:100]),
+    }
+    if args.store:
+        results["store"] = time_store_load(hashes)
+
+    print(f"{args.hashes} hashes, max distance {args.distance}, index built in {build_seconds:.2f}s")
+    print(f"{'lookup':<18} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'matches':>8}")
+    for name in ("index_near", "index_unrelated", "numpy_scan"):
+        stats = results[name]
+        print(f"{name:<18} {stats['mean_ms']:>9.3f} {stats['p50_ms']:>9.3f} {stats['p95_ms']:>9.3f} {stats['matches']:>8}")
+    if args.store:
+        print(f"Loading from SQLite: {results['store']['load_s']:.2f}s, refresh with no changes: "
+              f"{results['store']['refresh_ms']:.1f} ms")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
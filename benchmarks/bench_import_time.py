@@ -0,0 +1,113 @@
+"""Measure the import cost of the app's modules and the time to first render of the login page.
+
+Each module is imported after streamlit in a fresh interpreter with `python -X importtime`,
+so the reported time is what the module adds on top of streamlit itself. The heaviest
+packages it pulls in are listed per module. With --render it also times a fresh
+interpreter running main.py to the login page through streamlit's AppTest.
+Run from the repository root:
+
+    python benchmarks/bench_import_time.py --repeat 5 --render
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What the login page imports, then the modules main.py loads once a user is logged in
+LOGIN_MODULES = ["catalog"]
+DEFERRED_MODULES = ["m_profile", "file_process", "analytics", "admin", "profile_export", "token_usage"]
+
+# Lines of -X importtime output: "import time: <self us> | <cumulative us> | <indented name>"
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+_RENDER_SCRIPT = """
+import time
+started = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file("main.py", default_timeout=60).run()
+assert not app.exception, app.exception
+print(time.perf_counter() - started)
+"""
+
+
+# Function to import modules after streamlit in a fresh interpreter and parse -X importtime
+def measure_imports(modules):
+    """Return (seconds added on top of streamlit, {top-level package: cumulative seconds})."""
+    code = "import streamlit; " + "; ".join(f"import {module}" for module in modules)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {modules} failed:\n{result.stderr[-2000:]}")
+
+    packages, seen_streamlit, added = {}, False, 0
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        cumulative, indent, name = int(match.group(2)), len(match.group(3)), match.group(4)
+        if name == "streamlit" and indent == 1:
+            seen_streamlit = True
+        elif seen_streamlit:
+            # Everything imported at the top level after streamlit is loaded on behalf of our modules
+            if indent == 1:
+                added += cumulative
+            # A package's own line holds everything it imported (nested packages overlap their parents)
+            if "." not in name and name not in modules:
+                packages[name] = cumulative / 1e6
+    return added / 1e6, packages
+
+
+# Function to time a fresh interpreter rendering the login page
+def measure_render():
+    result = subprocess.run([sys.executable, "-c", _RENDER_SCRIPT], cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"rendering main.py failed:\n{result.stderr[-2000:]}")
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="*", default=DEFERRED_MODULES)
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh interpreters per measurement (median is kept)")
+    parser.add_argument("--top", type=int, default=3, help="Heaviest packages listed per module")
+    parser.add_argument("--render", action="store_true", help="Also time main.py to the login page with AppTest")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    results = {"imports": []}
+    for name, modules in [("login page", LOGIN_MODULES)] + [(module, [module]) for module in args.modules]:
+        runs = [measure_imports(modules) for _ in range(args.repeat)]
+        seconds = statistics.median(run[0] for run in runs)
+        packages = runs[-1][1]
+        top = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]
+        results["imports"].append({"name": name, "modules": modules, "import_s": seconds,
+                                   "top_packages": dict(top)})
+
+    if args.render:
+        started = time.perf_counter()
+        renders = [measure_render() for _ in range(args.repeat)]
+        results["login_render_s"] = statistics.median(renders)
+        results["login_process_s"] = (time.perf_counter() - started) / args.repeat
+
+    print(f"Import time on top of streamlit (median of {args.repeat} fresh interpreters)")
+    print(f"{'module':<16} {'import ms':>10}  heaviest packages")
+    for entry in results["imports"]:
+        top = ", ".join(f"{package} {1000 * seconds:.0f}ms" for package, seconds in entry["top_packages"].items())
+        print(f"{entry['name']:<16} {1000 * entry['import_s']:>10.1f}  {top}")
+    if args.render:
+        print(f"Login page first render: {results['login_render_s']:.2f}s "
+              f"(whole interpreter: {results['login_process_s']:.2f}s)")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Compare decode latency and peak memory of a full decode against the bounded ingest path.
+
+Each variant runs in a fresh process, so its peak RSS (ru_maxrss) only covers that
+variant. Images come from --images, or a synthetic phone-sized JPEG is generated.
+Run from the repository root:
+
+    python benchmarks/bench_ingest.py --megapixels 12 --repeat 5
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw  # noqa: E402
+from image_ingest import open_image  # noqa: E402
+from preprocess import PRESETS, preprocess_image  # noqa: E402
+
+
+# Function to draw a receipt-like JPEG of about `megapixels` (3:4 portrait)
+def make_photo(megapixels):
+    width = int((megapixels * 1_000_000 * 3 / 4) ** 0.5)
+    height = int(width * 4 / 3)
+    image = Image.new("RGB", (width, height), (90, 80, 70))
+    draw = ImageDraw.Draw(image)
+    margin = width // 5
+    draw.rectangle((margin, 0, width - margin, height), fill=(245, 245, 240))
+    line_height = max(12, height // 120)
+    for row in range(2, 110):
+        draw.text((margin + 20, row * line_height), f"ITEM {row:03d} ........ {row * 1.25:.2f}", fill="black")
+    output = io.BytesIO()
+    image.save(output, "JPEG", quality=90)
+    return output.getvalue()
+
+
+# Function to time one variant and report the peak RSS of its process (runs in a child process)
+def run_variant(variant, images, preset, repeat, queue):
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    decode_times, total_times = [], []
+    for image_bytes in images:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            if variant == "full":
+                image = Image.open(io.BytesIO(image_bytes))
+                image.load()
+            else:
+                image, _ = open_image(image_bytes, preset)
+            decoded = time.perf_counter()
+            preprocess_image(image, preset)
+            finished = time.perf_counter()
+            decode_times.append(decoded - started)
+            total_times.append(finished - started)
+            del image
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put({
+        "variant": variant,
+        "preset": preset,
+        "decode_ms_mean": 1000 * statistics.mean(decode_times),
+        "total_ms_mean": 1000 * statistics.mean(total_times),
+        "peak_rss_growth_mb": (peak - baseline) / 1024,  # ru_maxrss is in KB on Linux
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", nargs="*", help="JPEG/PNG files to use instead of a synthetic photo")
+    parser.add_argument("--megapixels", type=float, default=12)
+    parser.add_argument("--presets", nargs="*", default=list(PRESETS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    if args.images:
+        images = []
+        for path in args.images:
+            with open(path, "rb") as f:
+                images.append(f.read())
+    else:
+        images = [make_photo(args.megapixels)]
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for preset in args.presets:
+        for variant in ("full", "bounded"):
+            queue = context.Queue()
+            process = context.Process(target=run_variant, args=(variant, images, preset, args.repeat, queue))
+            process.start()
+            results.append(queue.get())
+            process.join()
+
+    print(f"{len(images)} images, {args.repeat} repetitions each")
+    print(f"{'preset':<10} {'variant':<8} {'decode ms':>10} {'total ms':>10} {'peak MB':>9}")
+    for result in results:
+        print(f"{result['preset']:<10} {result['variant']:<8} {result['decode_ms_mean']:>10.1f} "
+              f"{result['total_ms_mean']:>10.1f} {result['peak_rss_growth_mb']:>9.1f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+"""End-to-end benchmark of the receipt pipeline on synthetic receipts.
+
+Receipts are drawn with PIL (varying item counts, fonts, noise and rotation) with their
+ground truth kept alongside. They are pushed through the real upload path (job queue,
+workers, decode, preprocessing, OCR, local extraction or GPT, receipt store) by N
+concurrent simulated sessions, with the GPT calls answered by the local stub in
+stub_openai.py at a configurable latency. Each concurrency level runs in a fresh
+process with its own data directory, so caches, learned store templates and peak RSS
+(ru_maxrss) do not carry over. Reported per level: throughput, upload-to-result
+latency, per-stage latency (perf_metrics), peak memory of the server process and of the
+largest OCR subprocess (pytesseract runs the tesseract binary once per image), and item
+accuracy against the ground truth, also for the long receipts (--long-receipts) that
+are extracted in chunks whenever they go to GPT (always with --always-gpt). The storage
+pass times appends and the first history page as a profile grows (--rows). Needs
+Tesseract and the tiktoken encoding for the model. Run from the repository root:
+
+    python benchmarks/bench_pipeline.py --receipts 40 --sessions 1 4 8 --latency 0.5 --json pipeline.json
+"""
+import argparse
+import glob
+import io
+import json
+import multiprocessing
+import os
+import random
+import re
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont  # noqa: E402
+from preprocess import DEFAULT_PRESET, PRESETS  # noqa: E402
+from stub_openai import start_stub_server  # noqa: E402
+
+# Fonts tried for the synthetic receipts (PIL's built-in font is used if none are installed)
+FONT_PATTERNS = ["/usr/share/fonts/**/*Mono*.ttf", "/usr/share/fonts/**/DejaVuSans*.ttf",
+                 "/usr/share/fonts/**/Liberation*.ttf", "/Library/Fonts/*.ttf", "C:/Windows/Fonts/cour*.ttf"]
+STORES = ["FRESH MART", "KEDAI RUNCIT AMAN", "CITY GROCER", "PASAR SEGAR", "CORNER BAKERY", "MEGA HARDWARE"]
+ITEMS = ["MILK 1L", "BREAD WHITE", "EGGS 10PCS", "RICE 5KG", "SUGAR 1KG", "COOKING OIL", "TEA BAGS", "COFFEE",
+         "APPLES", "BANANAS", "ONIONS", "GARLIC", "CHICKEN", "BEEF MINCE", "FISH BALLS", "NOODLES", "BUTTER",
+         "CHEESE SLICES", "YOGURT", "ORANGE JUICE", "MINERAL WATER", "SOAP BAR", "SHAMPOO", "TOOTHPASTE",
+         "DETERGENT", "TISSUE BOX", "BATTERIES AA", "LIGHT BULB", "SCREWS 50PCS", "PAINT BRUSH"]
+# Line of the receipt carrying its ID, so the stub can tell receipts apart
+RECEIPT_ID_PATTERN = re.compile(r"RECEIPT\s*NO\W*(\d{6})", re.IGNORECASE)
+BENCH_PROFILE = "bench"
+
+
+# Function to list the TrueType fonts available for drawing receipts
+def find_fonts():
+    fonts = []
+    for pattern in FONT_PATTERNS:
+        fonts.extend(path for path in sorted(glob.glob(pattern, recursive=True)) if path not in fonts)
+    return fonts
+
+
+# Function to draw one receipt photo and return (JPEG bytes, ground truth)
+def make_receipt(receipt_id, rng, fonts, min_items, max_items, noise, max_rotation):
+    font_size = rng.randint(22, 30)
+    font = ImageFont.truetype(rng.choice(fonts), font_size) if fonts else ImageFont.load_default(font_size)
+    store = rng.choice(STORES)
+    date = f"{rng.randint(2024, 2026)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+    count = rng.randint(min_items, max_items)
+    if count <= len(ITEMS):
+        names = rng.sample(ITEMS, count)
+    else:
+        # Long receipts number their lines so every item name is still unique
+        names = [f"ITEM {number:04d} {rng.choice(ITEMS)}" for number in range(1, count + 1)]
+    items = [{"name": name, "price": round(rng.uniform(0.5, 60), 2)} for name in names]
+    total = round(sum(item["price"] for item in items), 2)
+
+    year, month, day = date.split("-")
+    name_width = max(20, max(len(name) for name in names) + 2)
+    lines = [store, f"RECEIPT NO {receipt_id:06d}", f"DATE {day}/{month}/{year}", ""]
+    lines += [f"{item['name']:<{name_width}}{item['price']:>9.2f}" for item in items]
+    lines += ["", f"{'TOTAL':<{name_width}}{total:>9.2f}", "THANK YOU"]
+
+    line_height = int(font_size * 1.4)
+    width, height = (name_width + 12) * font_size * 2 // 3, line_height * (len(lines) + 4)
+    image = Image.new("L", (width, height), 248)
+    draw = ImageDraw.Draw(image)
+    for row, line in enumerate(lines, 2):
+        draw.text((font_size, row * line_height), line, fill=20, font=font)
+
+    # Sensor noise, a slight blur and a tilted shot on a darker table
+    if noise:
+        image = Image.blend(image, Image.effect_noise(image.size, 64).convert("L"), noise)
+        image = image.filter(ImageFilter.GaussianBlur(0.6))
+    image = image.rotate(rng.uniform(-max_rotation, max_rotation), expand=True, fillcolor=90, resample=Image.BICUBIC)
+
+    output = io.BytesIO()
+    image.convert("RGB").save(output, "JPEG", quality=85)
+    truth = {"id": receipt_id, "store": store, "date": date, "items": items, "total": total, "text": "\n".join(lines)}
+    return output.getvalue(), truth
+
+
+# Function to build a stub responder that answers like the model would for these receipts
+def make_responder(truths):
+    """Reply with the JSON the model is asked for, taken from the ground truth.
+
+    The receipt is found from its ID line, or else from the item names in the text. Only
+    items whose names appear in the OCR text are returned, so OCR errors still show up
+    in the accuracy, and chunks of a long receipt only get their own items.
+    """
+    by_id = {truth["id"]: truth for truth in truths}
+
+    def respond(messages):
+        text = messages[-1]["content"].upper()
+        match = RECEIPT_ID_PATTERN.search(text)
+        truth = by_id.get(int(match.group(1))) if match else None
+        if truth is None:
+            truth = max(truths, key=lambda t: sum(item["name"] in text for item in t["items"]))
+        header = truth["store"] in text or match is not None
+        return json.dumps({
+            "store": truth["store"] if header else None,
+            "date": truth["date"] if header else None,
+            "items": [item for item in truth["items"] if item["name"] in text],
+            "total": truth["total"] if "TOTAL" in text else None,
+        })
+
+    return respond
+
+
+# Function to score an extracted receipt against its ground truth
+def score_receipt(receipt, truth):
+    found = {(item["name"].upper().strip(), round(item["price"], 2)) for item in receipt["items"]}
+    expected = {(item["name"], item["price"]) for item in truth["items"]}
+    return {
+        "items_found": len(found & expected),
+        "items_expected": len(expected),
+        "extra_items": len(found - expected),
+        "store_ok": (receipt["store"] or "").upper().strip() == truth["store"],
+        "date_ok": receipt["date"] == truth["date"],
+    }
+
+
+# Function to summarise durations in milliseconds
+def latency_stats(seconds):
+    if not seconds:
+        return {"mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0}
+    ordered = sorted(seconds)
+    return {
+        "mean_ms": 1000 * statistics.mean(ordered),
+        "p50_ms": 1000 * ordered[len(ordered) // 2],
+        "p95_ms": 1000 * ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+    }
+
+
+# Function to write the secrets the app reads, pointing it at the stub server
+def write_secrets(api_base, workers):
+    os.makedirs(".streamlit", exist_ok=True)
+    with open(os.path.join(".streamlit", "secrets.toml"), "w", encoding="utf-8") as f:
+        f.write(f'[openai]\napi_key = "stub"\napi_base = "{api_base}"\n\n'
+                f"[jobs]\nworkers = {workers}\n\n[budgets]\nmonthly_tokens = 0\n")
+
+
+# Function to run one concurrency level in a fresh process and data directory (runs in a child process)
+def run_sessions(sessions, uploads, truths, args, result_queue):
+    with tempfile.TemporaryDirectory() as data_dir:
+        os.chdir(data_dir)
+        stub = start_stub_server(latency=args.latency, jitter=args.jitter, responder=make_responder(truths))
+        write_secrets(stub.base_url, args.workers or sessions)
+
+        import file_process
+        import job_queue
+        import perf_metrics
+        from receipt_cache import make_cache_key
+
+        if args.always_gpt:
+            file_process.LOCAL_CONFIDENCE_THRESHOLD = 2.0  # Nothing scores above 1.0
+        file_process.configure_services()
+        job_queue.start_workers(file_process.process_receipt_job, file_process.JOB_WORKERS)
+        settings = file_process.get_pipeline_settings(args.preset)
+        baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        # Each session uploads its share of the receipts one after the other, like a user would
+        outcomes, outcomes_lock = [], threading.Lock()
+
+        def session(index):
+            for position in range(index, len(uploads), sessions):
+                image_bytes, truth = uploads[position], truths[position]
+                started = time.perf_counter()
+                job_id = job_queue.enqueue_job(make_cache_key(image_bytes, settings), image_bytes,
+                                               f"user{index}", BENCH_PROFILE, f"receipt{truth['id']}.jpg",
+                                               options={"preset": args.preset})
+                while True:
+                    job = job_queue.get_jobs([job_id])[0]
+                    if job["status"] in ("done", "failed"):
+                        break
+                    time.sleep(args.poll)
+                with outcomes_lock:
+                    outcomes.append((time.perf_counter() - started, job, truth))
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=session, args=(index,)) for index in range(sessions)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        done = [(seconds, job, truth) for seconds, job, truth in outcomes if job["status"] == "done"]
+        scores = [score_receipt(job["result"]["receipt"], truth) for _, job, truth in done]
+        items_expected = sum(score["items_expected"] for score in scores)
+        long_scores = [score for score in scores if score["items_expected"] > len(ITEMS)]
+        long_expected = sum(score["items_expected"] for score in long_scores)
+        stages = perf_metrics.get_stage_stats()
+        result_queue.put({
+            "sessions": sessions,
+            "workers": file_process.JOB_WORKERS,
+            "receipts": len(uploads),
+            "failed": len(outcomes) - len(done),
+            "errors": sorted({job["error"] for _, job, _ in outcomes if job["status"] == "failed"})[:5],
+            "elapsed_s": elapsed,
+            "throughput_per_min": 60 * len(done) / elapsed,
+            "latency": latency_stats([seconds for seconds, _, _ in done]),
+            "gpt_requests": stub.stats["requests"],
+            "local_extractions": sum(job["result"]["receipt"]["source"] == "local" for _, job, _ in done),
+            "item_recall": sum(score["items_found"] for score in scores) / items_expected if items_expected else 0.0,
+            "long_receipts": sum(len(truth["items"]) > len(ITEMS) for truth in truths),
+            "chunked_extractions": stages.get("gpt.chunked", {}).get("count", 0),
+            "long_item_recall": sum(score["items_found"] for score in long_scores) / long_expected if long_expected else 0.0,
+            "extra_items": sum(score["extra_items"] for score in scores),
+            "store_accuracy": statistics.mean(score["store_ok"] for score in scores) if scores else 0.0,
+            "date_accuracy": statistics.mean(score["date_ok"] for score in scores) if scores else 0.0,
+            "stages": stages,
+            "memory": perf_metrics.get_memory_stats(),
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,  # KB on Linux
+            "peak_rss_growth_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss) / 1024,
+            # Largest finished subprocess (tesseract via pytesseract); 0 when OCR runs in-process
+            "peak_ocr_child_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        })
+        stub.shutdown()
+
+
+# Function to time appends and the first history page as one profile grows (runs in a child process)
+def run_storage(sizes, receipt_items, appends, result_queue):
+    with tempfile.TemporaryDirectory() as data_dir:
+        os.chdir(data_dir)
+        from receipt_store import append_receipt_items, create_profile_store, fetch_page, get_store_path
+
+        rng = random.Random(0)
+
+        def make_items(count):
+            store, day = rng.choice(STORES), f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+            return [{"Store Name": store, "Date": day, "Item Purchased": rng.choice(ITEMS),
+                     "Price": f"{rng.uniform(0.5, 60):.2f}"} for _ in range(count)]
+
+        create_profile_store(BENCH_PROFILE, "bench")
+        rows, results = 0, []
+        for size in sorted(sizes):
+            # Grow the profile to `size` rows in large appends, then time receipt-sized ones
+            while rows < size:
+                batch = min(5000, size - rows)
+                rows += append_receipt_items("bench", BENCH_PROFILE, make_items(batch))
+            append_times, page_times = [], []
+            for _ in range(appends):
+                started = time.perf_counter()
+                rows += append_receipt_items("bench", BENCH_PROFILE, make_items(receipt_items))
+                append_times.append(time.perf_counter() - started)
+                started = time.perf_counter()
+                fetch_page("bench", BENCH_PROFILE)  # The history shown under the upload form (not cached: it changed)
+                page_times.append(time.perf_counter() - started)
+            results.append({
+                "rows": size,
+                "append": latency_stats(append_times),
+                "history_page": latency_stats(page_times),
+                "store_mb": os.path.getsize(get_store_path("bench")) / (1024 * 1024),
+            })
+        result_queue.put(results)
+
+
+# Function to run a target in a spawned process and return what it put on its queue
+def run_in_child(target, *args):
+    context = multiprocessing.get_context("spawn")
+    result_queue = context.Queue()
+    process = context.Process(target=target, args=args + (result_queue,))
+    process.start()
+    result = result_queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", type=int, default=24, help="Receipts uploaded per concurrency level")
+    parser.add_argument("--sessions", type=int, nargs="*", default=[1, 4, 8], help="Concurrent sessions to simulate")
+    parser.add_argument("--workers", type=int, default=0, help="Job workers (default: one per session)")
+    parser.add_argument("--latency", type=float, default=0.5, help="Stub chat completion latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--preset", default=DEFAULT_PRESET, choices=list(PRESETS))
+    parser.add_argument("--min-items", type=int, default=3)
+    parser.add_argument("--max-items", type=int, default=25)
+    parser.add_argument("--long-receipts", type=int, default=2,
+                        help="Extra receipts per level long enough to be extracted in chunks when sent to GPT")
+    parser.add_argument("--long-items", type=int, default=300, help="Item lines of a long receipt")
+    parser.add_argument("--noise", type=float, default=0.15, help="Noise blended into the photo (0 disables)")
+    parser.add_argument("--rotation", type=float, default=3.0, help="Largest tilt in degrees")
+    parser.add_argument("--always-gpt", action="store_true", help="Send every receipt to the stub, never read locally")
+    parser.add_argument("--poll", type=float, default=0.05, help="Job status poll interval of a session")
+    parser.add_argument("--rows", type=int, nargs="*", default=[1000, 10_000, 100_000],
+                        help="Profile sizes for the storage pass (none skips it)")
+    parser.add_argument("--appends", type=int, default=20, help="Timed receipt appends per profile size")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    fonts = find_fonts()
+    results = {"args": vars(args), "fonts": len(fonts), "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "levels": [], "storage": []}
+
+    for level, sessions in enumerate(args.sessions):
+        # New receipt IDs per level, so no level is served from another's cache
+        first_id = level * (args.receipts + args.long_receipts)
+        receipts = [make_receipt(first_id + i, rng, fonts, args.min_items, args.max_items,
+                                 args.noise, args.rotation) for i in range(args.receipts)]
+        receipts += [make_receipt(first_id + args.receipts + i, rng, fonts, args.long_items, args.long_items,
+                                  args.noise, args.rotation) for i in range(args.long_receipts)]
+        uploads, truths = [image for image, _ in receipts], [truth for _, truth in receipts]
+        results["levels"].append(run_in_child(run_sessions, sessions, uploads, truths, args))
+
+    if args.rows:
+        results["storage"] = run_in_child(run_storage, args.rows, 10, args.appends)
+
+    print(f"{args.receipts} + {args.long_receipts} long receipts per level, stub latency {args.latency}s, {len(fonts) or 'default'} fonts")
+    print(f"{'sessions':>8} {'workers':>7} {'per min':>8} {'p50 s':>7} {'p95 s':>7} {'failed':>6} "
+          f"{'gpt':>5} {'chunked':>7} {'recall':>7} {'long':>6} {'server MB':>9} {'ocr MB':>7}")
+    for level in results["levels"]:
+        print(f"{level['sessions']:>8} {level['workers']:>7} {level['throughput_per_min']:>8.1f} "
+              f"{level['latency']['p50_ms'] / 1000:>7.2f} {level['latency']['p95_ms'] / 1000:>7.2f} "
+              f"{level['failed']:>6} {level['gpt_requests']:>5} {level['chunked_extractions']:>7} "
+              f"{level['item_recall']:>7.2f} {level['long_item_recall']:>6.2f} {level['peak_rss_mb']:>9.0f} "
+              f"{level['peak_ocr_child_rss_mb']:>7.0f}")
+        for error in level["errors"]:
+            print(f"         failed: {error}")
+    if results["levels"]:
+        print(f"\nStage latency at {results['levels'][-1]['sessions']} sessions")
+        print(f"{'stage':<18} {'count':>6} {'p50 ms':>9} {'p95 ms':>9}")
+        for stage, stats in results["levels"][-1]["stages"].items():
+            print(f"{stage:<18} {stats['count']:>6} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f}")
+    if results["storage"]:
+        print(f"\n{'rows':>8} {'append p50 ms':>14} {'append p95 ms':>14} {'history p50 ms':>15} {'store MB':>9}")
+        for entry in results["storage"]:
+            print(f"{entry['rows']:>8} {entry['append']['p50_ms']:>14.2f} {entry['append']['p95_ms']:>14.2f} "
+                  f"{entry['history_page']['p50_ms']:>15.2f} {entry['store_mb']:>9.1f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Compare OCR latency and character accuracy of the preprocessing presets.
+
+The corpus is a directory of receipt images, each with a ground-truth transcription
+next to it (receipt01.jpg + receipt01.txt). Without --corpus, a seeded synthetic corpus
+of --receipts noisy, tilted receipt photos is drawn with bench_pipeline's generator
+(--save-corpus keeps it). Run from the repository root:
+
+    python benchmarks/bench_preprocess.py --receipts 20 --repeat 3
+    python benchmarks/bench_preprocess.py --corpus path/to/receipts
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+from bench_pipeline import find_fonts, make_receipt  # noqa: E402
+from ocr_engine import get_ocr_engine  # noqa: E402
+from preprocess import PRESETS, preprocess_image  # noqa: E402
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+# Function to load the (image path, ground truth) pairs of the corpus
+def load_corpus(corpus_dir):
+    pairs = []
+    for filename in sorted(os.listdir(corpus_dir)):
+        stem, extension = os.path.splitext(filename)
+        truth_path = os.path.join(corpus_dir, stem + ".txt")
+        if extension.lower() in IMAGE_EXTENSIONS and os.path.exists(truth_path):
+            with open(truth_path, encoding="utf-8") as f:
+                pairs.append((os.path.join(corpus_dir, filename), f.read()))
+    return pairs
+
+
+# Function to draw a seeded synthetic corpus of receipt photos and their transcriptions
+def write_synthetic_corpus(corpus_dir, receipts, seed):
+    os.makedirs(corpus_dir, exist_ok=True)
+    rng, fonts = random.Random(seed), find_fonts()
+    for number in range(1, receipts + 1):
+        image_bytes, truth = make_receipt(number, rng, fonts, 5, 15, noise=0.25, max_rotation=2.0)
+        with open(os.path.join(corpus_dir, f"receipt{number:02d}.jpg"), "wb") as f:
+            f.write(image_bytes)
+        with open(os.path.join(corpus_dir, f"receipt{number:02d}.txt"), "w", encoding="utf-8") as f:
+            f.write(truth["text"])
+
+
+# Function to normalise whitespace so layout differences don't count as errors
+def normalize(text):
+    return " ".join(text.split()).lower()
+
+
+# Function to compute the edit distance between two strings
+def levenshtein(a, b):
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+# Function to score OCR output against the ground truth (1.0 is a perfect match)
+def character_accuracy(ocr_text, truth):
+    ocr_text, truth = normalize(ocr_text), normalize(truth)
+    if not truth:
+        return 1.0 if not ocr_text else 0.0
+    return max(0.0, 1.0 - levenshtein(ocr_text, truth) / len(truth))
+
+
+# Function to benchmark one preset over the corpus
+def run_preset(preset, corpus, repeat):
+    engine = get_ocr_engine()
+    preprocess_times, ocr_times, accuracies = [], [], []
+    for image_path, truth in corpus:
+        for _ in range(repeat):
+            with Image.open(image_path) as image:
+                image.load()
+                started = time.perf_counter()
+                prepared = preprocess_image(image, preset)
+                preprocessed = time.perf_counter()
+                ocr_text = engine.image_to_string(prepared)
+                finished = time.perf_counter()
+            preprocess_times.append(preprocessed - started)
+            ocr_times.append(finished - preprocessed)
+        accuracies.append(character_accuracy(ocr_text, truth))
+
+    totals = sorted(p + o for p, o in zip(preprocess_times, ocr_times))
+    return {
+        "preset": preset,
+        "images": len(corpus),
+        "preprocess_ms_mean": 1000 * statistics.mean(preprocess_times),
+        "ocr_ms_mean": 1000 * statistics.mean(ocr_times),
+        "total_ms_p50": 1000 * totals[len(totals) // 2],
+        "total_ms_p95": 1000 * totals[min(len(totals) - 1, int(0.95 * len(totals)))],
+        "char_accuracy_mean": statistics.mean(accuracies),
+        "char_accuracy_min": min(accuracies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="Directory of image/.txt pairs (default: a synthetic corpus)")
+    parser.add_argument("--receipts", type=int, default=20, help="Receipts in the synthetic corpus")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save-corpus", help="Write the synthetic corpus to this directory and keep it")
+    parser.add_argument("--presets", nargs="*", default=list(PRESETS))
+    parser.add_argument("--repeat", type=int, default=1, help="Timing repetitions per image")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    if args.corpus and not os.path.isdir(args.corpus):
+        parser.error(f"{args.corpus} is not a directory")
+
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        corpus_dir = args.corpus
+        if not corpus_dir:
+            corpus_dir = args.save_corpus or scratch_dir
+            write_synthetic_corpus(corpus_dir, args.receipts, args.seed)
+            print(f"Synthetic corpus of {args.receipts} receipts (seed {args.seed})"
+                  + (f" saved to {corpus_dir}" if args.save_corpus else ""))
+        corpus = load_corpus(corpus_dir)
+        if not corpus:
+            parser.error(f"No image/.txt pairs found in {corpus_dir}")
+
+        print(f"OCR engine: {get_ocr_engine().name}")
+        results = [run_preset(preset, corpus, args.repeat) for preset in args.presets]
+
+    print(f"{'preset':<10} {'prep ms':>9} {'ocr ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'accuracy':>9} {'worst':>7}")
+    for result in results:
+        print(
+            f"{result['preset']:<10} {result['preprocess_ms_mean']:>9.1f} {result['ocr_ms_mean']:>9.1f} "
+            f"{result['total_ms_p50']:>9.1f} {result['total_ms_p95']:>9.1f} "
+            f"{result['char_accuracy_mean']:>9.3f} {result['char_accuracy_min']:>7.3f}"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Local stand-in for the OpenAI chat completions endpoint.
+
+Point the app at it with `api_base = "http://127.0.0.1:8765/v1"` in the [openai] section of
+.streamlit/secrets.toml, or use `start_stub_server()` from benchmark scripts.
+
+    python benchmarks/stub_openai.py --port 8765 --latency 0.8 --error-rate 0.05
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Reply used when no custom responder is given (in the JSON form the receipt prompt asks for)
+DEFAULT_REPLY = json.dumps({"store": "Stub Mart", "date": "2024-01-31",
+                            "items": [{"name": "Bread", "price": 3.50}, {"name": "Milk", "price": 6.20}],
+                            "total": 9.70})
+
+
+# Request handler that answers /v1/chat/completions like the real API
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real endpoint
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+
+        with server.stats_lock:
+            server.stats["requests"] += 1
+
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send(404, {"error": {"message": "Not found"}})
+            return
+
+        # Simulated latency: fixed part plus a random jitter
+        time.sleep(server.latency + random.uniform(0, server.jitter))
+
+        if random.random() < server.error_rate:
+            with server.stats_lock:
+                server.stats["errors"] += 1
+            self._send(429, {"error": {"message": "Rate limit reached (stub)"}}, {"Retry-After": "0.1"})
+            return
+
+        messages = payload.get("messages", [])
+        content = server.responder(messages) if server.responder else DEFAULT_REPLY
+        prompt_tokens = sum(len(message.get("content", "")) for message in messages) // 4
+        completion_tokens = len(content) // 4
+        self._send(200, {
+            "id": f"chatcmpl-stub-{server.stats['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "stub"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+    def _send(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output clean
+
+
+# Function to start the stub server on a background thread
+def start_stub_server(port=0, latency=0.5, jitter=0.1, error_rate=0.0, responder=None):
+    """Start the server and return it; `server.base_url` is the value to use as api_base.
+
+    `responder(messages)` can return the reply text, e.g. the ground truth of a synthetic receipt
+    (see bench_pipeline.py).
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.jitter = jitter
+    server.error_rate = error_rate
+    server.responder = responder
+    server.stats = {"requests": 0, "errors": 0}
+    server.stats_lock = threading.Lock()
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    threading.Thread(target=server.serve_forever, name="stub-openai", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="Fixed response latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Random extra latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 429")
+    args = parser.parse_args()
+
+    stub = start_stub_server(args.port, args.latency, args.jitter, args.error_rate)
+    print(f"Stub chat completions endpoint listening on {stub.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.shutdown()
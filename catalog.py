@@ -0,0 +1,200 @@
+import csv
+import os
+import threading
+import streamlit as st
+from safe_write import atomic_write, file_lock
+
+# Files backing the catalog
+CREDENTIALS_FILE = 'user_credentials.csv'
+BASE_DIR = 'user_folders'
+
+
+# Function to get a cheap signature of a file that changes whenever it is rewritten or appended to
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+# In-memory index of users and their profiles, shared by every session of the server process
+class Catalog:
+    """Hash-indexed users and per-user profiles backed by the CSV files.
+
+    Every lookup first compares the backing file's signature (one stat call) and only
+    re-reads the file when it changed, so writes from other processes are picked up.
+    Writes hold the file lock and replace the file atomically (so readers never see a
+    half-written row), then update the index in place.
+    """
+
+    def __init__(self, credentials_file=CREDENTIALS_FILE, base_dir=BASE_DIR):
+        self.credentials_file = credentials_file
+        self.base_dir = base_dir
+        self._lock = threading.RLock()
+        self._users = {}
+        self._users_signature = None
+        self._sorted_users = None  # Sorted usernames for search, rebuilt when the users change
+        self._profiles = {}  # username -> (signature, [profiles in order], {profiles})
+
+    # Function to reload the users if user_credentials.csv changed
+    def _refresh_users(self):
+        signature = _file_signature(self.credentials_file)
+        if signature == self._users_signature:
+            return
+        if signature is None:
+            self._users = {}
+        else:
+            # The csv module keeps everything as text, so numeric passwords still match what users type
+            self._users = {row['username']: row['password'] for row in _read_csv_rows(self.credentials_file)}
+        self._users_signature = signature
+        self._sorted_users = None
+
+    # Function to get the username -> password map (do not modify it)
+    def get_users(self):
+        with self._lock:
+            self._refresh_users()
+            return self._users
+
+    # Function to check login credentials
+    def check_login(self, username, password):
+        return self.get_users().get(username) == password
+
+    # Function to check whether a user exists
+    def has_user(self, username):
+        return username in self.get_users()
+
+    # Function to add a user (returns False if the username is taken)
+    def add_user(self, username, password):
+        with self._lock, file_lock(self.credentials_file):
+            self._refresh_users()
+            if username in self._users:
+                return False
+            users = {**self._users, username: password}
+            _write_csv_rows(self.credentials_file, ['username', 'password'], users.items())
+            self._users = users
+            self._users_signature = _file_signature(self.credentials_file)
+            self._sorted_users = None
+            return True
+
+    # Function to add many users with a single rewrite (skips usernames that are taken)
+    def add_users(self, users):
+        """Add (username, password) pairs and return the usernames that were added."""
+        with self._lock, file_lock(self.credentials_file):
+            self._refresh_users()
+            new_users = {}
+            for username, password in users:
+                if username not in self._users and username not in new_users:
+                    new_users[username] = password
+            if not new_users:
+                return []
+            users = {**self._users, **new_users}
+            _write_csv_rows(self.credentials_file, ['username', 'password'], users.items())
+            self._users = users
+            self._users_signature = _file_signature(self.credentials_file)
+            self._sorted_users = None
+            return list(new_users)
+
+    # Function to get one page of the usernames containing `query`
+    def search_users(self, query='', offset=0, limit=50):
+        """Return (usernames on the page, number of matching usernames), sorted by name."""
+        with self._lock:
+            self._refresh_users()
+            if self._sorted_users is None:
+                self._sorted_users = sorted(self._users)
+            usernames = self._sorted_users
+        query = query.strip().lower()
+        if query:
+            usernames = [name for name in usernames if query in name]
+        return usernames[offset:offset + limit], len(usernames)
+
+    # Function to delete users (rewrites the file once for all of them)
+    def delete_users(self, usernames):
+        usernames = set(usernames)
+        with self._lock, file_lock(self.credentials_file):
+            self._refresh_users()
+            if not usernames & self._users.keys():
+                return 0
+            remaining = {name: password for name, password in self._users.items() if name not in usernames}
+            _write_csv_rows(self.credentials_file, ['username', 'password'], remaining.items())
+            deleted = len(self._users) - len(remaining)
+            self._users = remaining
+            self._users_signature = _file_signature(self.credentials_file)
+            self._sorted_users = None
+            for username in usernames:
+                self._profiles.pop(username, None)
+            return deleted
+
+    # Function to get the path of a user's profiles file
+    def _profiles_file(self, username):
+        return os.path.join(self.base_dir, username, 'profiles.csv')
+
+    # Function to reload a user's profiles if their profiles.csv changed
+    def _refresh_profiles(self, username):
+        path = self._profiles_file(username)
+        signature = _file_signature(path)
+        cached = self._profiles.get(username)
+        if cached is not None and cached[0] == signature:
+            return cached
+        if signature is None:
+            names = []
+        else:
+            names = [row['Profile'] for row in _read_csv_rows(path)]
+        cached = (signature, names, set(names))
+        self._profiles[username] = cached
+        return cached
+
+    # Function to get a user's profiles in creation order (do not modify the list)
+    def get_profiles(self, username):
+        with self._lock:
+            return self._refresh_profiles(username)[1]
+
+    # Function to check whether a user has a profile
+    def has_profile(self, username, profile_name):
+        with self._lock:
+            return profile_name in self._refresh_profiles(username)[2]
+
+    # Function to add a profile (returns False if it already exists)
+    def add_profile(self, username, profile_name):
+        path = self._profiles_file(username)
+        with self._lock, file_lock(path):
+            _, names, name_set = self._refresh_profiles(username)
+            if profile_name in name_set:
+                return False
+            names, name_set = names + [profile_name], name_set | {profile_name}
+            _write_csv_rows(path, ['Profile'], [(name,) for name in names])
+            self._profiles[username] = (_file_signature(path), names, name_set)
+            return True
+
+    # Function to remove a profile
+    def remove_profile(self, username, profile_name):
+        path = self._profiles_file(username)
+        with self._lock, file_lock(path):
+            _, names, name_set = self._refresh_profiles(username)
+            if profile_name not in name_set:
+                return False
+            names = [name for name in names if name != profile_name]
+            _write_csv_rows(path, ['Profile'], [(name,) for name in names])
+            self._profiles[username] = (_file_signature(path), names, set(names))
+            return True
+
+
+# Function to read the rows of a CSV file as dicts keyed by its header (empty cells are '')
+def _read_csv_rows(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return [{key: value or '' for key, value in row.items()} for row in csv.DictReader(f)]
+
+
+# Function to replace a CSV file with the given rows
+def _write_csv_rows(path, header, rows):
+    def write(f):
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    atomic_write(path, write)
+
+
+# Function to get the catalog shared by every session of this server process
+@st.cache_resource
+def get_catalog():
+    return Catalog()
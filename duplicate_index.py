@@ -0,0 +1,139 @@
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from itertools import combinations
+import numpy as np
+from PIL import Image, ImageOps
+from image_ingest import open_header
+from receipt_store import add_image_hash, load_image_hashes
+
+# dHash compares neighbouring pixels of a HASH_SIZE x HASH_SIZE grid, giving a 64-bit hash
+HASH_SIZE = 8
+# The hash is indexed as CHUNKS substrings of CHUNK_BITS bits
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+# Images whose hashes differ in at most this many bits are treated as the same receipt
+DUPLICATE_MAX_DISTANCE = 6
+# Users whose index is kept in memory
+INDEX_CACHE_USERS = 16
+
+_indexes = OrderedDict()  # username -> DuplicateIndex
+_indexes_lock = threading.Lock()
+
+
+# Function to count the bits that differ between two hashes
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+# Function to compute the difference hash of an image from a small thumbnail
+def compute_dhash(image_bytes):
+    image = open_header(image_bytes)
+    image.draft("L", (HASH_SIZE * 16, HASH_SIZE * 16))  # Let JPEG decode at a fraction of full size
+    image = ImageOps.exif_transpose(image).convert("L")
+    pixels = np.asarray(image.resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS), dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+# Function to get every mask of up to `flips` set bits within one chunk
+@lru_cache(maxsize=None)
+def _chunk_masks(flips):
+    return [sum(1 << bit for bit in bits)
+            for count in range(flips + 1) for bits in combinations(range(CHUNK_BITS), count)]
+
+
+# Multi-index hash table: finds every hash within a Hamming distance without scanning them all
+class MultiIndexHash:
+    """Splits each 64-bit hash into CHUNKS substrings of CHUNK_BITS bits, with one table per substring.
+
+    Two hashes within distance r differ in at most r // CHUNKS bits of at least one substring
+    (pigeonhole), so a search only checks entries that share a near-identical substring.
+    """
+
+    def __init__(self):
+        self._tables = [{} for _ in range(CHUNKS)]
+        self._values = []
+        self._items = []
+        self.size = 0
+
+    # Function to add an item under its hash
+    def add(self, value, item):
+        position = len(self._values)
+        self._values.append(value)
+        self._items.append(item)
+        for chunk, table in enumerate(self._tables):
+            table.setdefault((value >> (chunk * CHUNK_BITS)) & CHUNK_MASK, []).append(position)
+        self.size += 1
+
+    # Function to find the items whose hash is within max_distance, as (distance, item) pairs
+    def search(self, value, max_distance):
+        masks = _chunk_masks(max_distance // CHUNKS)
+        candidates = set()
+        for chunk, table in enumerate(self._tables):
+            key = (value >> (chunk * CHUNK_BITS)) & CHUNK_MASK
+            for mask in masks:
+                bucket = table.get(key ^ mask)
+                if bucket:
+                    candidates.update(bucket)
+        matches = []
+        for position in candidates:
+            distance = hamming_distance(self._values[position], value)
+            if distance <= max_distance:
+                matches.append((distance, self._items[position]))
+        return sorted(matches, key=lambda match: match[0])
+
+
+# In-memory index of a user's stored image hashes, kept in step with the database
+class DuplicateIndex:
+    def __init__(self, username):
+        self.username = username
+        self.table = MultiIndexHash()
+        self.last_id = 0
+        self._lock = threading.Lock()
+
+    # Function to add hashes stored since the last refresh (or rebuild if some were deleted)
+    def refresh(self):
+        with self._lock:
+            rows, count = load_image_hashes(self.username, self.last_id)
+            if self.table.size + len(rows) != count:
+                self.table, self.last_id = MultiIndexHash(), 0
+                rows, count = load_image_hashes(self.username)
+            for row_id, profile_name, dhash, cache_key, file_name, created_at in rows:
+                self.table.add(dhash, {"profile": profile_name, "cache_key": cache_key,
+                                      "file_name": file_name, "created_at": created_at})
+                self.last_id = row_id
+
+    # Function to find stored images that look like the given hash
+    def search(self, dhash, max_distance=DUPLICATE_MAX_DISTANCE):
+        self.refresh()
+        with self._lock:
+            return self.table.search(dhash, max_distance)
+
+
+# Function to get a user's duplicate index
+def get_duplicate_index(username):
+    with _indexes_lock:
+        index = _indexes.get(username)
+        if index is None:
+            index = _indexes[username] = DuplicateIndex(username)
+        _indexes.move_to_end(username)
+        while len(_indexes) > INDEX_CACHE_USERS:
+            _indexes.popitem(last=False)
+    return index
+
+
+# Function to find earlier receipts that look like this image (other than this very upload in this profile)
+def find_duplicates(username, dhash, cache_key=None, profile_name=None, max_distance=DUPLICATE_MAX_DISTANCE):
+    """Return [{"distance", "profile", "cache_key", "file_name", "created_at"}], closest first."""
+    return [
+        dict(item, distance=distance)
+        for distance, item in get_duplicate_index(username).search(dhash, max_distance)
+        if (item["cache_key"], item["profile"]) != (cache_key, profile_name)
+    ]
+
+
+# Function to add a recorded receipt image to the user's index
+def remember_image(username, profile_name, dhash, cache_key, file_name=None):
+    add_image_hash(username, profile_name, dhash, cache_key, file_name)
@@ -1,83 +1,473 @@
-import openai
 import streamlit as st
-from PIL import Image
-import pytesseract
-import tiktoken
+from ocr_engine import image_to_text
 import pandas as pd
-import os
+from receipt_cache import make_cache_key, get_cached_result, store_result, is_recorded, mark_recorded
+from receipt_store import HISTORY_SORTS, append_receipt_items, fetch_page, get_profile_stores
+from batch_process import process_batch, summarize_batch
+from job_queue import enqueue_job, get_jobs, get_queue_metrics, start_workers
+from gpt_client import GPTError, chat_completion, configure as configure_gpt_client, get_client, run_sync
+from token_usage import (check_budget, configure_budgets, count_message_tokens, count_text_tokens, record_usage,
+                         warm_up_encoder)
+from preprocess import DEFAULT_PRESET, get_preset_settings
+from m_profile import get_profile_preset
+from receipt_extractor import (LOCAL_CONFIDENCE_THRESHOLD, extract_receipt, learn_store_template,
+                               load_store_templates, parse_receipt_json, receipt_to_rows)
+from perf_metrics import maybe_profile, record_duration, span
+from receipt_chunks import CHUNK_TOKENS, LONG_RECEIPT_TOKENS, merge_chunk_receipts, split_receipt_text
+from image_ingest import ImageRejectedError, open_header, open_image, prepare_image, record_decode_stats
+from duplicate_index import DUPLICATE_MAX_DISTANCE, compute_dhash, find_duplicates, hamming_distance, remember_image
+import asyncio
+import json
+import threading
+import time
 
-# Access the API key from Streamlit secrets
-openai.api_key = st.secrets["openai"]["api_key"]
+# Records shown per page of the receipt history
+HISTORY_PAGE_SIZE = 50
+
+# Model and preprocessing settings; anything that changes the OCR/GPT output must be listed here
+GPT_MODEL = "gpt-4o-mini"
+GPT_PROMPT = (
+    "Extract the store name, the purchase date, every purchased item with its price, and the total from "
+    "the receipt text below. Reply with a JSON object only, in this form: "
+    '{"store": "store name", "date": "YYYY-MM-DD or null", "items": [{"name": "item name", "price": 1.23}], '
+    '"total": 1.23 or null}. Prices are numbers without currency symbols.'
+)
+# Added to GPT_PROMPT for one part of a long receipt that is extracted in chunks
+# (GPT_PROMPT holds literal JSON braces, so only this note is formatted)
+GPT_CHUNK_PROMPT = (
+    " The text is part {part} of {parts} of a long receipt, and its first lines may repeat the end of the "
+    "previous part. Use null for the store, date or total if they are not in this part."
+)
+
+# Function to get every setting that affects a receipt's OCR/GPT output (used for the cache key)
+def get_pipeline_settings(preset):
+    return {**get_preset_settings(preset), "model": GPT_MODEL, "prompt": GPT_PROMPT,
+            "local_threshold": LOCAL_CONFIDENCE_THRESHOLD, "chunk_prompt": GPT_CHUNK_PROMPT,
+            "chunk_tokens": CHUNK_TOKENS, "long_receipt_tokens": LONG_RECEIPT_TOKENS}
+
+# Number of background workers processing queued receipts (read from secrets by configure_services)
+JOB_WORKERS = 2
+
+_services_configured = False
+_services_lock = threading.Lock()
+
+# Function to set up the GPT client, token budgets and worker count from secrets, once per process
+def configure_services():
+    """Read the service settings from Streamlit secrets on first use instead of at import.
+
+    Importing this module (on the first render after login) then stays cheap, and the
+    OpenAI client is only created when the upload path needs it.
+    """
+    global JOB_WORKERS, _services_configured
+    if _services_configured:
+        return
+    with _services_lock:
+        if _services_configured:
+            return
+        # api_base can point at a local stub server
+        configure_gpt_client(st.secrets["openai"]["api_key"], st.secrets["openai"].get("api_base"))
+        configure_budgets(**st.secrets.get("budgets", {}))
+        JOB_WORKERS = int(st.secrets.get("jobs", {}).get("workers", 2))
+        _services_configured = True
 
 # Function to get response from GPT based on the extracted text
-def get_gpt_response(extracted_text):
-    """Get a response from GPT based on the extracted text."""
-    try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",  # Adjust the model if needed
-            messages=[
-                {"role": "user", "content": "Extract Store name:, Item Purchase:  and its corresponding Price. Ensure each item is on a new line without extra punctuation or symbols."},
-                {"role": "user", "content": extracted_text},
-            ],
+def get_gpt_response(extracted_text, username, profile_name):
+    """Get a response from GPT based on the extracted text.
+
+    Returns (response_text, usage). The prompt is counted and checked against the user's
+    token budget before the call, and the tokens actually used are recorded afterwards.
+    Long receipts are extracted in chunks (see get_chunked_gpt_response).
+    Raises GPTError or BudgetExceededError, so failures are never mistaken for receipt details.
+    """
+    configure_services()
+    if count_text_tokens(extracted_text, GPT_MODEL) > LONG_RECEIPT_TOKENS:
+        return get_chunked_gpt_response(extracted_text, username, profile_name)
+
+    messages = [
+        {"role": "user", "content": GPT_PROMPT},
+        {"role": "user", "content": extracted_text},
+    ]
+    prompt_tokens = count_message_tokens(messages, GPT_MODEL)
+    max_tokens = check_budget(username, prompt_tokens)
+
+    with span("gpt"):
+        response = chat_completion(
+            messages, GPT_MODEL, max_tokens=max_tokens, estimated_tokens=prompt_tokens + max_tokens,
+            response_format={"type": "json_object"},  # Structured reply instead of free text
         )
+    content = get_response_content(response)
+
+    prompt_used, completion_used = get_response_usage(response, prompt_tokens, content)
+    record_usage(username, profile_name, GPT_MODEL, prompt_used, completion_used)
+
+    return content, {"prompt_tokens": prompt_used, "completion_tokens": completion_used,
+                     "total_tokens": prompt_used + completion_used}
+
+# Function to extract a long receipt as overlapping chunks sent to GPT concurrently
+def get_chunked_gpt_response(extracted_text, username, profile_name):
+    """Same contract as get_gpt_response, for OCR text over LONG_RECEIPT_TOKENS.
+
+    The text is split on line boundaries into chunks of about CHUNK_TOKENS tokens; all
+    chunks are requested at once, so the latency is that of the slowest chunk. The budget
+    check covers every chunk's prompt and completion. The chunk replies are merged into
+    one receipt, dropping items read twice at chunk boundaries.
+    """
+    chunks = split_receipt_text(extracted_text, GPT_MODEL)
+    conversations = [
+        [{"role": "user", "content": GPT_PROMPT + GPT_CHUNK_PROMPT.format(part=part, parts=len(chunks))},
+         {"role": "user", "content": chunk}]
+        for part, chunk in enumerate(chunks, 1)
+    ]
+    prompt_counts = [count_message_tokens(messages, GPT_MODEL) for messages in conversations]
+    max_tokens = check_budget(username, sum(prompt_counts), completions=len(chunks))  # Allowance per chunk
+
+    async def extract_chunks():
+        client = get_client()
+        # Let every chunk finish, so the tokens of the ones that succeeded are still recorded
+        return await asyncio.gather(*(
+            client.acreate(messages, GPT_MODEL, max_tokens=max_tokens, estimated_tokens=prompt_tokens + max_tokens,
+                           response_format={"type": "json_object"})
+            for messages, prompt_tokens in zip(conversations, prompt_counts)
+        ), return_exceptions=True)
+
+    with span("gpt.chunked"):
+        responses = run_sync(extract_chunks())
+
+    # Record the tokens of every chunk that came back before raising for the ones that failed
+    contents, errors, prompt_used, completion_used = [], [], 0, 0
+    for response, prompt_tokens in zip(responses, prompt_counts):
+        if isinstance(response, BaseException):
+            errors.append(response)
+            continue
+        try:
+            content = get_response_content(response)
+        except GPTError as e:
+            errors.append(e)
+            content = ""
+        chunk_prompt, chunk_completion = get_response_usage(response, prompt_tokens, content)
+        contents.append(content)
+        prompt_used += chunk_prompt
+        completion_used += chunk_completion
+    if len(errors) < len(responses):
+        record_usage(username, profile_name, GPT_MODEL, prompt_used, completion_used)
+    if errors:
+        raise errors[0]
+
+    receipts = []
+    for part, content in enumerate(contents, 1):
+        try:
+            receipts.append(parse_receipt_json(content))
+        except ValueError as e:
+            raise GPTError(f"GPT reply for part {part} of {len(contents)} does not match the receipt schema: {e}")
+
+    return json.dumps(merge_chunk_receipts(receipts)), {
+        "prompt_tokens": prompt_used, "completion_tokens": completion_used,
+        "total_tokens": prompt_used + completion_used,
+    }
+
+# Function to get the reply text of a chat completion
+def get_response_content(response):
+    try:
         return response['choices'][0]['message']['content'].strip()  # Extract and strip the GPT response
-    except Exception as e:
-        return f"Error fetching GPT response: {e}"
-
-# Function to calculate the token count accurately
-def calculate_token_count(messages):
-    enc = tiktoken.encoding_for_model("gpt-4o-mini")  # Use the appropriate model
-    token_count = 0
-    for message in messages:
-        token_count += len(enc.encode(message['content']))  # Accurate token count
-    return token_count
-
-# Function to update receipt details into an existing Excel file
-def update_receipt_in_excel(gpt_response, profile_name, username):
-    """Update the existing Excel file with the extracted receipt details."""
-    lines = gpt_response.strip().split("\n")  # Split the response into lines
-    store_name = lines[0].replace("Store name:", "").strip()  # Extract store name
-    items = []
-
-    # Loop through the remaining lines to extract items and prices
-    for i in range(1, len(lines)):  # Start from the second line
-        line = lines[i].strip()
-        if line.startswith("Item Purchase:"):
-            item_name = line.replace("Item Purchase:", "").strip()
-            # The next line should contain the price
-            if i + 1 < len(lines) and lines[i + 1].startswith("Price:"):
-                price = lines[i + 1].replace("Price:", "").strip()
-                items.append({"Store Name": store_name, "Item Purchased": item_name, "Price": price})
-                i += 1  # Skip the price line since we already processed it
-
-    # Define the path to the existing Excel file
-    excel_file_path = f'user_folders/{username}/{profile_name}.xlsx'
-
-    # Load the existing Excel file or create a new DataFrame if it doesn't exist
-    if os.path.exists(excel_file_path):
-        # Read the existing Excel file
-        df = pd.read_excel(excel_file_path, engine='openpyxl')
+    except (KeyError, IndexError, TypeError) as e:
+        raise GPTError(f"Unexpected GPT response: {e}")
+
+# Function to get the (prompt, completion) tokens a request used
+def get_response_usage(response, prompt_tokens, content):
+    # Prefer the usage reported by the API; fall back to our own count
+    usage = response.get('usage') or {}
+    return (usage.get('prompt_tokens', prompt_tokens),
+            usage.get('completion_tokens', count_text_tokens(content, GPT_MODEL)))
+
+# Function to extract the receipt details, calling GPT only when the local extractor is unsure
+def extract_receipt_details(extracted_text, username, profile_name):
+    """Return (receipt, usage) where receipt is {"store", "date", "items", "total", "confidence", "source"}."""
+    with span("extract.local"):
+        receipt = extract_receipt(extracted_text, load_store_templates())
+    if receipt["confidence"] >= LOCAL_CONFIDENCE_THRESHOLD:
+        return receipt, {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+
+    content, usage = get_gpt_response(extracted_text, username, profile_name)
+    try:
+        with span("parse"):
+            receipt = parse_receipt_json(content)
+    except ValueError as e:
+        raise GPTError(f"GPT reply does not match the receipt schema: {e}")
+
+    # Remember this store's layout and items so its next receipts can be read locally
+    learn_store_template(extracted_text, receipt)
+    return receipt, usage
+
+# Function to extract the receipt details as cacheable text (used by the batch pipeline)
+def extract_receipt_details_text(extracted_text, username, profile_name):
+    receipt, usage = extract_receipt_details(extracted_text, username, profile_name)
+    return json.dumps(receipt), usage
+
+# Function to show the extracted receipt details
+def display_receipt_details(receipt):
+    st.write(f"**Store:** {receipt['store'] or 'Unknown'}")
+    st.write(f"**Date:** {receipt['date'] or 'Unknown'}")
+    st.dataframe(pd.DataFrame(receipt["items"], columns=["name", "price"]).rename(
+        columns={"name": "Item Purchased", "price": "Price"}), hide_index=True)
+    if receipt["total"] is not None:
+        st.write(f"**Total:** {receipt['total']:.2f}")
+    source = "read locally" if receipt["source"] == "local" else "extracted by GPT"
+    st.caption(f"Details {source} (confidence {receipt['confidence']:.2f}).")
+
+# Function to record receipt details in the profile's store
+def record_receipt_items(receipt, profile_name, username):
+    """Append the extracted receipt details to the profile's receipt store."""
+    items = receipt_to_rows(receipt)
+
+    # Append the new items to the profile's store (cost grows with the receipt, not the history)
+    append_receipt_items(username, profile_name, items)
+
+    return len(items)  # Return the number of recorded items
+
+# Function to handle uploading several receipts at once
+def upload_receipt_batch(username, selected_profile):
+    uploaded_files = st.file_uploader(
+        "Upload your receipt images", type=["jpg", "jpeg", "png"], accept_multiple_files=True
+    )
+    if not uploaded_files:
+        return
+
+    # Flag receipts that look like ones already recorded (or like an earlier file in this batch)
+    preset = get_profile_preset(username, selected_profile)
+    settings = get_pipeline_settings(preset)
+    uploads, hashes, duplicate_names = [], {}, []
+    for uploaded_file in uploaded_files:
+        image_bytes = uploaded_file.getvalue()
+        try:
+            open_header(image_bytes)
+        except ImageRejectedError as e:
+            st.error(f"Skipping {uploaded_file.name}: {e}")
+            continue
+        cache_key = make_cache_key(image_bytes, settings)
+        dhash = get_image_dhash(cache_key, image_bytes)
+        is_duplicate = False
+        if dhash is not None:
+            is_duplicate = bool(find_duplicates(username, dhash, cache_key, selected_profile)) or any(
+                key != cache_key and other is not None and hamming_distance(other, dhash) <= DUPLICATE_MAX_DISTANCE
+                for key, other in hashes.items()
+            )
+        hashes[cache_key] = dhash
+        if is_duplicate:
+            duplicate_names.append(uploaded_file.name)
+        uploads.append((uploaded_file.name, image_bytes, is_duplicate))
+
+    if duplicate_names:
+        st.warning(f"{len(duplicate_names)} receipts look like ones you already uploaded. They are skipped unless you select them here.")
+        confirmed = set(st.multiselect("Process anyway", duplicate_names, key="confirmed_batch_duplicates"))
+        uploads = [upload for upload in uploads if not upload[2] or upload[0] in confirmed]
+    uploads = [(name, image_bytes) for name, image_bytes, _ in uploads]
+    if not uploads:
+        return
+
+    # Only start the batch on an explicit click so unrelated reruns don't restart it
+    if not st.button(f"Process {len(uploads)} receipts"):
+        return
+
+    started_at = time.perf_counter()
+
+    # Per-file progress: one status line per file plus an overall progress bar
+    progress_bar = st.progress(0.0)
+    status_lines = [st.empty() for _ in uploads]
+    status_labels = {"ocr": "running OCR", "gpt": "extracting details", "done": "done", "failed": "failed"}
+    finished = set()
+
+    def on_progress(index, result):
+        label = status_labels.get(result["status"], result["status"])
+        if result["cached"]:
+            label += " (cached)"
+        if result["error"]:
+            label += f" - {result['error']}"
+        status_lines[index].write(f"**{result['name']}**: {label}")
+        if result["status"] in ("done", "failed"):
+            finished.add(index)
+            progress_bar.progress(len(finished) / len(uploads))
+
+    for index, (name, _) in enumerate(uploads):
+        status_lines[index].write(f"**{name}**: queued")
+
+    def gpt_fn(extracted_text):
+        return extract_receipt_details_text(extracted_text, username, selected_profile)
+
+    with span("batch.total"):
+        results = process_batch(uploads, settings, gpt_fn, on_progress)
+
+    # Collect the rows of every new receipt and commit them to the profile in a single write
+    batch_items = []
+    recorded_keys = []
+    for result in results:
+        if result["status"] != "done" or result["cache_key"] in recorded_keys:
+            continue  # Failed, or the same image was uploaded twice in this batch
+        if is_recorded(result["cache_key"], username, selected_profile):
+            continue
+        batch_items.extend(receipt_to_rows(json.loads(result["gpt_response"])))
+        recorded_keys.append(result["cache_key"])
+
+    if batch_items:
+        append_receipt_items(username, selected_profile, batch_items)
+    for cache_key in recorded_keys:
+        mark_recorded(cache_key, username, selected_profile)
+    for result in results:
+        if result["status"] == "done" and hashes[result["cache_key"]] is not None:
+            remember_image(username, selected_profile, hashes[result["cache_key"]], result["cache_key"], result["name"])
+
+    summary = summarize_batch(results, started_at, len(batch_items))
+    st.success(
+        f"Processed {summary['processed']} of {summary['files']} receipts "
+        f"({summary['cache_hits']} from cache, {summary['failed']} failed) in "
+        f"{summary['elapsed_seconds']:.1f}s - {summary['files_per_second']:.2f} receipts/s, "
+        f"{summary['recorded_items']} items recorded, {summary['total_tokens']} tokens used."
+    )
+
+    # Display the updated records with the latest one at the top
+    display_receipt_history(username, selected_profile)
+
+# Function to display one page of a profile's records at a time
+def display_receipt_history(username, selected_profile):
+    st.subheader("Receipt History")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        sort = st.selectbox("Sort by", list(HISTORY_SORTS), key="history_sort")
+        store = st.selectbox("Store", ["All stores"] + get_profile_stores(username, selected_profile), key="history_store")
+    with col2:
+        start_date = st.date_input("From date", value=None, key="history_start")
+        end_date = st.date_input("To date", value=None, key="history_end")
+    with col3:
+        min_price = st.number_input("Minimum price", value=None, min_value=0.0, key="history_min")
+        max_price = st.number_input("Maximum price", value=None, min_value=0.0, key="history_max")
+
+    # Start from the first page whenever the profile or the filters change
+    filters = (selected_profile, sort, store, start_date, end_date, min_price, max_price)
+    if st.session_state.get('history_filters') != filters:
+        st.session_state['history_filters'] = filters
+        st.session_state['history_page'] = 1
+
+    def fetch(page):
+        return fetch_page(
+            username, selected_profile, page - 1, HISTORY_PAGE_SIZE, sort,
+            store=None if store == "All stores" else store, start_date=start_date, end_date=end_date,
+            min_price=min_price, max_price=max_price,
+        )
+
+    df, total = fetch(st.session_state['history_page'])
+    page_count = max(1, -(-total // HISTORY_PAGE_SIZE))
+    if st.session_state['history_page'] > page_count:  # The profile shrank since the page was chosen
+        st.session_state['history_page'] = page_count
+        df, total = fetch(page_count)
+
+    if total == 0:
+        st.write("No records found.")
+        return
+    st.dataframe(df, hide_index=True, use_container_width=True)
+    st.number_input(f"Page (of {page_count}, {total} records)", min_value=1, max_value=page_count, step=1, key="history_page")
+
+# Function to process one queued receipt job (runs on a background worker thread)
+def process_receipt_job(job, image_bytes):
+    """Run OCR and GPT for a job, record the items and return the result shown to the user."""
+    record_duration("job.wait", job["started_at"] - job["created_at"])
+    with maybe_profile(f"Receipt job {job['file_name'] or job['job_id']}"), span("job.total"):
+        return _process_receipt_job(job, image_bytes)
+
+def _process_receipt_job(job, image_bytes):
+    cache_key = job["image_hash"]  # The job's image hash is the receipt cache key
+    with span("cache.lookup"):
+        cached = get_cached_result(cache_key)
+
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}  # Cache hits cost no tokens
+    if cached is not None:
+        extracted_text = cached["ocr_text"]
+        receipt = json.loads(cached["gpt_response"])
     else:
-        # Create a new DataFrame if the file doesn't exist
-        df = pd.DataFrame(columns=["Store Name", "Date", "Item Purchased", "Price"])
+        # Open the uploaded image and prepare it for OCR with the profile's preset
+        preset = job["options"].get("preset", DEFAULT_PRESET)
+        image, decode_stats = open_image(image_bytes, preset)
+        with span("image.preprocess"):
+            image = prepare_image(image, preset, decode_stats)
+        record_decode_stats(decode_stats)
 
-    # Create a new DataFrame for the new items
-    new_items_df = pd.DataFrame(items)
+        # Use OCR to extract text from the image
+        with span("ocr"):
+            extracted_text = image_to_text(image)
+
+        # Extract the receipt details (locally when confident, otherwise with GPT)
+        receipt, usage = extract_receipt_details(extracted_text, job["username"], job["profile"])
+        store_result(cache_key, extracted_text, json.dumps(receipt))
+
+    # Only write the receipt once per profile, even if it is uploaded again
+    already_recorded = is_recorded(cache_key, job["username"], job["profile"])
+    recorded_items = 0
+    if not already_recorded:
+        recorded_items = record_receipt_items(receipt, job["profile"], job["username"])
+        mark_recorded(cache_key, job["username"], job["profile"])
+    if job["options"].get("dhash") is not None:
+        remember_image(job["username"], job["profile"], job["options"]["dhash"], cache_key, job["file_name"])
+
+    return {
+        "receipt": receipt,
+        "total_tokens": usage["total_tokens"],
+        "cached": cached is not None,
+        "recorded_items": recorded_items,
+        "already_recorded": already_recorded,
+    }
+
+# Function to start the background receipt workers once per server process
+@st.cache_resource
+def start_receipt_workers():
+    return start_workers(process_receipt_job, JOB_WORKERS)
 
-    # Append new items to the DataFrame
-    df = pd.concat([df, new_items_df], ignore_index=True)
+# Function to poll a receipt job until it finishes
+@st.fragment(run_every=2)
+def poll_receipt_job(job_id):
+    job = get_jobs([job_id])[0]
+    if job["status"] in ("done", "failed"):
+        st.rerun()  # Rerun the whole page once to show the result
+    metrics = get_queue_metrics()
+    st.info(f"Receipt is {job['status']} ({metrics['queued']} receipts waiting in the queue)...")
 
-    # Save the updated DataFrame back to the Excel file
-    df.to_excel(excel_file_path, index=False, engine='openpyxl')
+# Function to get the perceptual hash of an uploaded image (computed once per session, None if unreadable)
+def get_image_dhash(cache_key, image_bytes):
+    hashes = st.session_state.setdefault('image_dhashes', {})
+    if cache_key not in hashes:
+        with span("dedup.hash"):
+            try:
+                hashes[cache_key] = compute_dhash(image_bytes)
+            except (ImageRejectedError, OSError, ValueError):
+                hashes[cache_key] = None  # The job reports the decoding error
+    return hashes[cache_key]
 
-    return excel_file_path  # Return the path of the updated Excel file
+# Function to let the user skip or confirm a receipt that looks like an earlier one
+def confirm_near_duplicate(username, selected_profile, cache_key, dhash):
+    """Return True if the receipt should be processed."""
+    confirmed = st.session_state.setdefault('confirmed_duplicates', set())
+    if dhash is None or cache_key in confirmed:
+        return True
+    with span("dedup.lookup"):
+        duplicates = find_duplicates(username, dhash, cache_key, selected_profile)
+    if not duplicates:
+        return True
 
-# Function to create a new Excel file for the profile
-def create_excel_file(profile_name, username):
-    # Create a new DataFrame for the profile
-    df = pd.DataFrame(columns=["Store Name", "Date", "Item Purchased", "Price"])  # Customize the columns as needed
-    excel_file_path = f'user_folders/{username}/{profile_name}.xlsx'
-    df.to_excel(excel_file_path, index=False)  # Save the DataFrame to an Excel file
+    if cache_key in st.session_state.setdefault('skipped_duplicates', set()):
+        st.info("Skipped this receipt.")
+        return False
+
+    match = duplicates[0]
+    uploaded_on = time.strftime("%Y-%m-%d %H:%M", time.localtime(match["created_at"]))
+    st.warning(
+        f"This receipt looks like '{match['file_name'] or 'a receipt'}' recorded in profile "
+        f"'{match['profile']}' on {uploaded_on}."
+    )
+    col1, col2 = st.columns(2)
+    if col1.button("Skip this receipt"):
+        st.session_state['skipped_duplicates'].add(cache_key)
+        st.rerun()
+    if col2.button("Process anyway"):
+        confirmed.add(cache_key)
+        st.rerun()
+    return False
 
 # Main function to handle receipt upload and display
 def upload_receipt(username, selected_profile):
@@ -86,69 +476,81 @@ def upload_receipt(username, selected_profile):
         st.warning("Please select a valid profile to upload receipts.")
         return  # Exit the function early if no valid profile is selected
 
-    uploaded_file = st.file_uploader("Upload your receipt image", type=["jpg", "jpeg", "png"])
+    configure_services()
+    warm_up_encoder(GPT_MODEL)  # Load the tokenizer while the user picks a file
 
-    if uploaded_file is not None:
-        st.success(f"Receipt '{uploaded_file.name}' uploaded successfully!")
+    # Batch mode lets users digitise many receipts in one go
+    if st.checkbox("Upload several receipts at once"):
+        upload_receipt_batch(username, selected_profile)
+        return
 
-        # Open the uploaded image
-        image = Image.open(uploaded_file)
+    uploaded_file = st.file_uploader("Upload your receipt image", type=["jpg", "jpeg", "png"])
 
-        # Resize the image (you can adjust the size as needed)
-        max_size = (900, 900)  # Set maximum width and height to reduce data size
-        image.thumbnail(max_size)
-                # Convert the image to black and white (grayscale)
-        bw_image = image.convert("L")
+    if uploaded_file is not None:
+        # Hand the receipt to the background workers; re-running the script returns the same job
+        start_receipt_workers()
+        image_bytes = uploaded_file.getvalue()
+        try:
+            open_header(image_bytes)  # Reject oversized images before they reach the queue
+        except ImageRejectedError as e:
+            st.error(f"Could not process this receipt: {e}")
+            return
+        preset = get_profile_preset(username, selected_profile)
+        cache_key = make_cache_key(image_bytes, get_pipeline_settings(preset))
 
-        # You can now perform OCR on bw_image
+        # Ask before spending OCR and GPT on a receipt that looks like one already recorded
+        dhash = get_image_dhash(cache_key, image_bytes)
+        if not confirm_near_duplicate(username, selected_profile, cache_key, dhash):
+            display_receipt_history(username, selected_profile)
+            return
 
-        # Optionally, display the black and white image
-        #st.image(bw_image, caption="Black and White Receipt", use_column_width=True)
+        job_id = enqueue_job(
+            cache_key, image_bytes, username, selected_profile, uploaded_file.name,
+            options={"preset": preset, "dhash": dhash},
+        )
+        st.success(f"Receipt '{uploaded_file.name}' uploaded successfully!")
 
         # Use st.columns to create a two-column layout
         col1, col2 = st.columns([2, 2])  # Adjust width ratio as needed
 
         # Display the image in the first column
         with col1:
-            st.image(image, caption='Uploaded Image', width=250)  # Width can be adjusted
+            st.image(image_bytes, caption='Uploaded Image', width=250)  # Width can be adjusted
 
-        # Use OCR to extract text from the image
-        extracted_text = pytesseract.image_to_string(image)
+        job = get_jobs([job_id])[0]
+        if job["status"] not in ("done", "failed"):
+            with col2:
+                poll_receipt_job(job_id)
+            return
 
-        # Prepare messages for token count
-        messages = [
-            {"role": "user", "content": "Answer any questions in the following text."},
-            {"role": "user", "content": extracted_text}
-        ]
+        if job["status"] == "failed":
+            with col2:
+                st.error(f"Could not process this receipt: {job['error']}")
+                if st.button("Retry"):
+                    enqueue_job(job["image_hash"], image_bytes, username, selected_profile, uploaded_file.name,
+                                options=job["options"], retry_failed=True)
+                    st.rerun()
+            return
 
-        # Get GPT response based on the extracted text
-        gpt_response = get_gpt_response(extracted_text)
+        result = job["result"]
 
         # Display the GPT response in the second column
         with col2:
             st.subheader("Receipt Details")
-            st.write(gpt_response)
-
-        # Calculate token count
-        total_tokens = calculate_token_count(messages)
+            display_receipt_details(result["receipt"])
 
         # Display token count below the GPT response
-        st.write(f"Total tokens for this request: {total_tokens}")
+        if result.get("cached"):
+            st.write("Total tokens for this request: 0 (result reused from an earlier upload)")
+        else:
+            st.write(f"Total tokens for this request: {result['total_tokens']}")
 
-        # Call the update function after getting the GPT response
-        # Call the update function after getting the GPT response
-        if gpt_response:  # Ensure there's a response before saving
-            excel_file_path = update_receipt_in_excel(gpt_response, selected_profile, username)
+        if result["already_recorded"]:
+            st.info("This receipt has already been recorded in this profile.")
+        else:
             st.success(f"Record Updated")
-        
-            # Read the updated Excel file
-            df_updated = pd.read_excel(excel_file_path, engine='openpyxl')
-        
-            # Option 1: Sort the DataFrame by the index in reverse order (latest entry at the top)
-            df_updated = df_updated.iloc[::-1].reset_index(drop=True)
-        
-            # Option 2: If using a 'Date' column, sort by 'Date' (uncomment this if you want to use this method)
-            # df_updated = df_updated.sort_values(by='Date', ascending=False).reset_index(drop=True)
-        
-            # Display the updated records with the latest one at the top
-            st.dataframe(df_updated)
+
+        # Display the updated records with the latest one at the top
+        display_receipt_history(username, selected_profile)
+    else:
+        display_receipt_history(username, selected_profile)
@@ -0,0 +1,188 @@
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+import aiohttp
+
+# Defaults for the chat completions endpoint (the base URL can point at a local stub server)
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+MAX_CONNECTIONS = 20  # Size of the persistent HTTP connection pool
+REQUEST_TIMEOUT = 60  # Seconds allowed for a single call
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5  # First retry waits up to this many seconds, doubling each time
+BACKOFF_MAX = 20
+REQUESTS_PER_MINUTE = 500
+TOKENS_PER_MINUTE = 200000
+
+# Status codes worth retrying: timeouts, rate limits and server errors
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class GPTError(Exception):
+    """Raised when a chat completion could not be obtained."""
+
+
+# Token bucket used to stay under the requests- and tokens-per-minute limits
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    # Function to wait until `amount` tokens are available and take them
+    async def acquire(self, amount=1):
+        amount = min(amount, self.capacity)  # A single huge request must still get through eventually
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+# Async client for the chat completions endpoint
+class GPTClient:
+    def __init__(self, api_key, base_url=DEFAULT_BASE_URL, max_connections=MAX_CONNECTIONS,
+                 timeout=REQUEST_TIMEOUT, max_retries=MAX_RETRIES,
+                 requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.request_limiter = TokenBucket(requests_per_minute)
+        self.token_limiter = TokenBucket(tokens_per_minute)
+        self._session = None
+        self._inflight = {}
+
+    # Function to get the shared HTTP session (connections are kept alive between calls)
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers={"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"},
+            )
+        return self._session
+
+    # Function to request a chat completion
+    async def acreate(self, messages, model, timeout=None, estimated_tokens=None, **params):
+        """Return the completion response as a dict.
+
+        Identical requests that are already in flight share a single API call.
+        """
+        payload = {"model": model, "messages": messages, **params}
+        key = hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+        task = self._inflight.get(key)
+        if task is None:
+            if estimated_tokens is None:
+                # Rough estimate (about 4 characters per token) for the tokens-per-minute limit
+                estimated_tokens = sum(len(message["content"]) for message in messages) // 4
+                estimated_tokens += params.get("max_tokens") or 0
+            task = asyncio.ensure_future(self._request_with_retries(payload, estimated_tokens, timeout or self.timeout))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        # Shield the shared call so one caller cancelling doesn't cancel it for the others
+        return await asyncio.shield(task)
+
+    # Function to send the request, retrying with exponential backoff and jitter
+    async def _request_with_retries(self, payload, estimated_tokens, timeout):
+        session = await self._get_session()
+        url = f"{self.base_url}/chat/completions"
+        last_error = None
+
+        for attempt in range(self.max_retries + 1):
+            await self.request_limiter.acquire()
+            await self.token_limiter.acquire(max(1, estimated_tokens))
+
+            retry_after = None
+            try:
+                async with session.post(url, json=payload, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                    if response.status == 200:
+                        return await response.json()
+
+                    body = await response.text()
+                    last_error = GPTError(f"HTTP {response.status}: {body[:500]}")
+                    if response.status not in RETRYABLE_STATUS:
+                        raise last_error
+                    retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+            except asyncio.TimeoutError:
+                last_error = GPTError(f"Request timed out after {timeout}s")
+            except aiohttp.ClientError as e:
+                last_error = GPTError(f"Connection error: {e}")
+
+            if attempt < self.max_retries:
+                # Full jitter keeps many clients from retrying in lockstep
+                delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+                await asyncio.sleep(max(delay, retry_after or 0))
+
+        raise GPTError(f"Giving up after {self.max_retries + 1} attempts: {last_error}")
+
+    # Function to close the HTTP session
+    async def aclose(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+# Function to read a Retry-After header (in seconds)
+def _parse_retry_after(value):
+    try:
+        return min(float(value), BACKOFF_MAX) if value else None
+    except ValueError:
+        return None
+
+
+# The client lives on its own event loop thread so synchronous Streamlit code can use it
+_loop = None
+_client = None
+_setup_lock = threading.Lock()
+
+
+# Function to configure the shared client (replaces any previous configuration)
+def configure(api_key, base_url=None, **options):
+    global _client
+    loop = _get_loop()
+    with _setup_lock:
+        old_client = _client
+        _client = GPTClient(api_key, base_url or DEFAULT_BASE_URL, **options)
+    if old_client is not None:
+        asyncio.run_coroutine_threadsafe(old_client.aclose(), loop)
+    return _client
+
+
+# Function to get the background event loop (started on first use)
+def _get_loop():
+    global _loop
+    with _setup_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="gpt-client-loop", daemon=True).start()
+    return _loop
+
+
+# Function to run a coroutine on the client's event loop from synchronous code
+def run_sync(coro):
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
+
+
+# Function to request a chat completion from synchronous code
+def chat_completion(messages, model, **params):
+    if _client is None:
+        raise GPTError("The GPT client has not been configured")
+    return run_sync(_client.acreate(messages, model, **params))
+
+
+# Function to get the shared client for use in async code running on the client's loop
+def get_client():
+    if _client is None:
+        raise GPTError("The GPT client has not been configured")
+    return _client
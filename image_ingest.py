@@ -0,0 +1,128 @@
+import io
+import time
+from PIL import Image
+from perf_metrics import record_duration, record_memory
+from preprocess import DEFAULT_PRESET, PRESETS, RECEIPT_WIDTH_INCHES, preprocess_image
+
+# Uploads above these limits are rejected from their header, before any pixels are decoded
+MAX_UPLOAD_BYTES = 30 * 1024 * 1024
+MAX_IMAGE_PIXELS = 50_000_000  # About twice a 24 MP phone photo
+MAX_DECODED_BYTES = 256 * 1024 * 1024  # Pixel buffer after reduced-resolution decoding, and after preprocessing
+
+# Presets that crop to the receipt need headroom, since the receipt may only fill part of the photo
+CROP_HEADROOM = 2.0
+
+# PIL's own decompression bomb check uses the same limit (it raises at twice the limit)
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# EXIF orientations that swap width and height
+_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+
+class ImageRejectedError(ValueError):
+    """The upload is not an image we are willing to decode."""
+
+
+# Function to get the smallest width (in upright pixels) a preset needs from the decoder
+def get_target_width(preset=DEFAULT_PRESET):
+    settings = PRESETS.get(preset, PRESETS[DEFAULT_PRESET])
+    if "max_size" in settings:
+        return settings["max_size"][0]
+    width = RECEIPT_WIDTH_INCHES * settings["target_dpi"]
+    if settings.get("crop"):
+        width *= CROP_HEADROOM
+    return int(width)
+
+
+# Function to open an upload without decoding it, rejecting files and images over the size limits
+def open_header(image_bytes):
+    if len(image_bytes) > MAX_UPLOAD_BYTES:
+        raise ImageRejectedError(f"The file is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+
+    # BytesIO shares the bytes object instead of copying it, and Image.open only reads the header
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ImageRejectedError(f"Not a readable image: {e}")
+    width, height = image.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageRejectedError(
+            f"The image is {width}x{height} pixels; at most {MAX_IMAGE_PIXELS // 1_000_000} MP is accepted"
+        )
+    return image
+
+
+# Function to open an upload for OCR with bounded memory
+def open_image(image_bytes, preset=DEFAULT_PRESET):
+    """Decode `image_bytes` no larger than the preset needs and return (image, stats).
+
+    The header is checked against the size limits before anything is decoded. JPEGs are
+    decoded at 1/2, 1/4 or 1/8 scale by the DCT decoder (draft mode), and straight to
+    grayscale when the preset converts to grayscale anyway. Other formats are decoded and
+    then reduced. `stats` holds the decode time and the bytes of the decoded pixel buffer.
+    """
+    started = time.perf_counter()
+    image = open_header(image_bytes)
+    source_size, source_bands = image.size, len(image.getbands())
+
+    # Ask for the preset's width along the axis that is horizontal once the image is upright
+    target_width = get_target_width(preset)
+    transposed = image.getexif().get(0x0112) in _TRANSPOSED_ORIENTATIONS
+    request = (1, target_width) if transposed else (target_width, 1)
+    grayscale = "max_size" not in PRESETS.get(preset, PRESETS[DEFAULT_PRESET])
+    if image.format == "JPEG":
+        image.draft("L" if grayscale else None, request)
+
+    decoded_bytes = image.size[0] * image.size[1] * len(image.getbands())
+    if decoded_bytes > MAX_DECODED_BYTES:
+        raise ImageRejectedError("The image needs too much memory to decode")
+    try:
+        image.load()
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ImageRejectedError(f"Could not decode the image: {e}")
+
+    # Formats without reduced-resolution decoding are shrunk right after decoding
+    upright_width = image.size[1] if transposed else image.size[0]
+    factor = upright_width // target_width
+    if factor >= 2:
+        if image.mode not in ("L", "RGB", "RGBA"):
+            image = image.convert("L" if grayscale else "RGB")
+        image = image.reduce(factor)
+
+    # Keep the DPI consistent with the decoded size so DPI-aware scaling still works
+    scale = source_size[0] / image.size[0]
+    if scale != 1 and image.info.get("dpi"):
+        image.info["dpi"] = tuple(value / scale for value in image.info["dpi"])
+
+    stats = {
+        "decode_seconds": time.perf_counter() - started,
+        "source_pixels": source_size[0] * source_size[1],
+        "decoded_bytes": decoded_bytes,
+        "full_decode_bytes": source_size[0] * source_size[1] * source_bands,
+        "scale": scale,
+    }
+    return image, stats
+
+
+# Function to preprocess a decoded image for OCR, holding the result to the same memory cap
+def prepare_image(image, preset, stats):
+    """Return the preprocessed image and add its pixel buffer size to `stats`.
+
+    preprocess_image scales within its own pixel budget (preprocess.MAX_OCR_PIXELS); the
+    check here also covers steps that grow the image afterwards, such as deskewing.
+    """
+    image = preprocess_image(image, preset)
+    prepared_bytes = image.size[0] * image.size[1] * len(image.getbands())
+    if prepared_bytes > MAX_DECODED_BYTES:
+        raise ImageRejectedError("The image needs too much memory to preprocess")
+    stats["prepared_bytes"] = prepared_bytes
+    return image
+
+
+# Function to report the decode latency and memory of one image to the performance metrics
+def record_decode_stats(stats):
+    record_duration("image.decode", stats["decode_seconds"])
+    record_memory("image.decoded", stats["decoded_bytes"])
+    record_memory("image.full_decode", stats["full_decode_bytes"])
+    if "prepared_bytes" in stats:
+        record_memory("image.preprocessed", stats["prepared_bytes"])
@@ -0,0 +1,253 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# Jobs and their spooled images live with the other application-wide data
+APP_DATA_DIR = '.app_data'
+QUEUE_FILE = os.path.join(APP_DATA_DIR, 'jobs.sqlite3')
+SPOOL_DIR = os.path.join(APP_DATA_DIR, 'job_spool')
+
+# How long an idle worker sleeps before polling the queue again
+POLL_INTERVAL = 0.5
+# Finished jobs used for the latency metrics
+METRICS_WINDOW = 500
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_id TEXT PRIMARY KEY,
+        image_hash TEXT NOT NULL,
+        username TEXT NOT NULL,
+        profile TEXT NOT NULL,
+        file_name TEXT,
+        options TEXT,
+        status TEXT NOT NULL,
+        result TEXT,
+        error TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        UNIQUE (image_hash, username, profile)
+    );
+    CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+"""
+
+_wakeup = threading.Event()
+_workers_lock = threading.Lock()
+_workers = []
+
+
+# Function to open a connection to the job queue database
+def _connect():
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    conn = sqlite3.connect(QUEUE_FILE, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    # Queues created before job options existed get the column added in place
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+    if "options" not in columns:
+        conn.execute("ALTER TABLE jobs ADD COLUMN options TEXT")
+    return conn
+
+
+# Function to get the spool path where a job's image is kept until it is processed
+def _spool_path(job_id):
+    return os.path.join(SPOOL_DIR, job_id)
+
+
+# Function to add a receipt job to the queue
+def enqueue_job(image_hash, image_bytes, username, profile, file_name=None, options=None, retry_failed=False):
+    """Queue a receipt for processing and return its job ID.
+
+    `options` (e.g. the preprocessing preset) is stored with the job and handed to the worker.
+
+    Jobs are deduplicated by image hash per profile: enqueuing the same image again
+    returns the existing job. A failed job is only queued again with retry_failed=True.
+    """
+    conn = _connect()
+    try:
+        existing = conn.execute(
+            "SELECT job_id, status FROM jobs WHERE image_hash = ? AND username = ? AND profile = ?",
+            (image_hash, username, profile),
+        ).fetchone()
+        if existing is not None and (existing["status"] != "failed" or not retry_failed):
+            return existing["job_id"]
+
+        job_id = existing["job_id"] if existing is not None else uuid.uuid4().hex
+        with open(_spool_path(job_id), "wb") as f:
+            f.write(image_bytes)
+
+        if existing is not None:
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', error = NULL, options = ?, created_at = ?, started_at = NULL, "
+                "finished_at = NULL WHERE job_id = ?",
+                (json.dumps(options or {}), time.time(), job_id),
+            )
+        else:
+            conn.execute(
+                "INSERT INTO jobs (job_id, image_hash, username, profile, file_name, options, status, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, 'queued', ?)",
+                (job_id, image_hash, username, profile, file_name, json.dumps(options or {}), time.time()),
+            )
+    finally:
+        conn.close()
+
+    _wakeup.set()  # Let an idle worker pick the job up straight away
+    return job_id
+
+
+# Function to look up the status (and result, once finished) of jobs
+def get_jobs(job_ids):
+    if not job_ids:
+        return []
+    conn = _connect()
+    try:
+        placeholders = ", ".join("?" for _ in job_ids)
+        rows = conn.execute(f"SELECT * FROM jobs WHERE job_id IN ({placeholders})", list(job_ids)).fetchall()
+    finally:
+        conn.close()
+
+    jobs = {row["job_id"]: _row_to_job(row) for row in rows}
+    return [jobs[job_id] for job_id in job_ids if job_id in jobs]
+
+
+# Function to convert a database row into a job dict
+def _row_to_job(row):
+    job = dict(row)
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    job["options"] = json.loads(job["options"]) if job["options"] else {}
+    return job
+
+
+# Function to forget the jobs of a profile, or of all of a user's profiles (e.g. when they are deleted)
+def clear_jobs(username, profile=None):
+    conn = _connect()
+    try:
+        if profile is None:
+            conn.execute(
+                "DELETE FROM jobs WHERE username = ? AND status IN ('done', 'failed')",
+                (username,),
+            )
+        else:
+            conn.execute(
+                "DELETE FROM jobs WHERE username = ? AND profile = ? AND status IN ('done', 'failed')",
+                (username, profile),
+            )
+    finally:
+        conn.close()
+
+
+# Function to atomically claim the oldest queued job
+def _claim_job(conn):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        started_at = time.time()
+        conn.execute(
+            "UPDATE jobs SET status = 'running', started_at = ?, attempts = attempts + 1 WHERE job_id = ?",
+            (started_at, row["job_id"]),
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    # The row was read before the update; hand the worker the claimed state
+    return dict(_row_to_job(row), status="running", started_at=started_at, attempts=row["attempts"] + 1)
+
+
+# Function to record the outcome of a job
+def _finish_job(conn, job_id, result=None, error=None):
+    conn.execute(
+        "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE job_id = ?",
+        ("failed" if error else "done", json.dumps(result) if result is not None else None, error, time.time(), job_id),
+    )
+    if os.path.exists(_spool_path(job_id)):
+        os.remove(_spool_path(job_id))
+
+
+# Function run by each worker thread
+def _worker_loop(handler):
+    conn = _connect()
+    while True:
+        job = _claim_job(conn)
+        if job is None:
+            _wakeup.wait(POLL_INTERVAL)
+            _wakeup.clear()
+            continue
+
+        try:
+            with open(_spool_path(job["job_id"]), "rb") as f:
+                image_bytes = f.read()
+            result = handler(job, image_bytes)
+        except Exception as e:
+            _finish_job(conn, job["job_id"], error=str(e))
+        else:
+            _finish_job(conn, job["job_id"], result=result)
+
+
+# Function to start the local worker pool (once per server process)
+def start_workers(handler, worker_count):
+    """Start `worker_count` threads that call `handler(job, image_bytes)` for queued jobs.
+
+    Jobs left 'running' by a previous server process are put back in the queue first.
+    """
+    with _workers_lock:
+        if _workers:
+            return len(_workers)
+
+        conn = _connect()
+        try:
+            conn.execute("UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'")
+        finally:
+            conn.close()
+
+        for index in range(max(1, worker_count)):
+            worker = threading.Thread(target=_worker_loop, args=(handler,), name=f"receipt-worker-{index}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+        return len(_workers)
+
+
+# Function to report queue depth and latency metrics
+def get_queue_metrics():
+    conn = _connect()
+    try:
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        recent = conn.execute(
+            "SELECT created_at, started_at, finished_at FROM jobs WHERE status = 'done' "
+            "ORDER BY finished_at DESC LIMIT ?",
+            (METRICS_WINDOW,),
+        ).fetchall()
+        oldest_queued = conn.execute("SELECT MIN(created_at) FROM jobs WHERE status = 'queued'").fetchone()[0]
+    finally:
+        conn.close()
+
+    wait_times = sorted(row["started_at"] - row["created_at"] for row in recent)
+    latencies = sorted(row["finished_at"] - row["created_at"] for row in recent)
+    return {
+        "queued": counts.get("queued", 0),
+        "running": counts.get("running", 0),
+        "done": counts.get("done", 0),
+        "failed": counts.get("failed", 0),
+        "workers": len(_workers),
+        "oldest_queued_age": time.time() - oldest_queued if oldest_queued else 0.0,
+        "wait_p50": _percentile(wait_times, 0.5),
+        "latency_p50": _percentile(latencies, 0.5),
+        "latency_p95": _percentile(latencies, 0.95),
+    }
+
+
+# Function to pick a percentile from a sorted list
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
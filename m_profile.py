@@ -1,61 +1,74 @@
 import streamlit as st
 import pandas as pd
 import os
-
-# Function to save profiles to CSV using DataFrame
-def save_profiles_to_csv(profiles, username):
-    df = pd.DataFrame(profiles, columns=["Profile"])
-    os.makedirs(f'user_folders/{username}', exist_ok=True)  # Create directory if it doesn't exist
-    df.to_csv(f'user_folders/{username}/profiles.csv', index=False)
-
-# Function to load profiles from CSV
-def load_profiles_from_csv(username):
-    filename = f'user_folders/{username}/profiles.csv'
+from receipt_cache import clear_recorded
+from job_queue import clear_jobs
+from receipt_store import create_profile_store, delete_profile_records, get_profile_stores, migrate_user_folder
+from profile_export import EXPORT_FORMATS, delete_profile_exports, export_profile, get_available_formats
+from preprocess import PRESETS, DEFAULT_PRESET
+from safe_write import update_csv
+from catalog import get_catalog
+
+# Function to add a profile to the user's profiles.csv via the catalog (returns False if it already exists)
+def add_profile_to_csv(profile_name, username):
+    return get_catalog().add_profile(username, profile_name)
+
+# Function to remove a profile from the user's profiles.csv via the catalog
+def remove_profile_from_csv(profile_name, username):
+    return get_catalog().remove_profile(username, profile_name)
+
+# Function to load the OCR preprocessing preset chosen for each profile
+def load_profile_presets(username):
+    filename = f'user_folders/{username}/profile_settings.csv'
     if os.path.exists(filename):
-        df = pd.read_csv(filename)
-        return df['Profile'].tolist()  # Return profiles as a list
-    return []
-
-# Function to delete a profile and its associated Excel file
-def delete_profile(profile_name, profiles, username):
-    profiles.remove(profile_name)
-    save_profiles_to_csv(profiles, username)  # Save the updated profiles to CSV
-
-    # Define the file path for the profile's Excel file
-    excel_file_path = f'user_folders/{username}/{profile_name}.xlsx'
-
-    # Check if the Excel file exists and delete it
-    if os.path.exists(excel_file_path):
-        os.remove(excel_file_path)  # Delete the Excel file
-        st.success(f"Profile '{profile_name}' and its associated Excel file have been deleted successfully.")
-    else:
-        st.warning(f"The Excel file for profile '{profile_name}' does not exist.")
+        df = pd.read_csv(filename, dtype=str, keep_default_na=False)  # Profile names like "2024" or "NA" stay strings
+        return dict(zip(df['Profile'], df['Preprocessing']))
+    return {}
+
+# Function to save (or remove, with preset=None) the preprocessing preset of a profile
+def save_profile_preset(username, profile_name, preset):
+    def update(df):
+        df = df[df['Profile'] != profile_name]
+        if preset is not None:
+            df = pd.concat([df, pd.DataFrame({"Profile": [profile_name], "Preprocessing": [preset]})], ignore_index=True)
+        return df, None
+    update_csv(f'user_folders/{username}/profile_settings.csv', ["Profile", "Preprocessing"], update)
+
+# Function to get the preprocessing preset of a profile
+def get_profile_preset(username, profile_name):
+    preset = load_profile_presets(username).get(profile_name, DEFAULT_PRESET)
+    return preset if preset in PRESETS else DEFAULT_PRESET
+
+# Function to delete a profile and its associated records
+def delete_profile(profile_name, username):
+    remove_profile_from_csv(profile_name, username)  # Save the updated profiles to CSV
+    clear_recorded(username, profile_name)  # Allow receipts to be recorded again if the profile is recreated
+    clear_jobs(username, profile_name)
+    save_profile_preset(username, profile_name, None)
+
+    # Delete the profile's records from the receipt store
+    deleted_rows = delete_profile_records(username, profile_name)
+    delete_profile_exports(username, profile_name)  # Old exports would still show the deleted receipts
+    st.success(f"Profile '{profile_name}' and its {deleted_rows} recorded items have been deleted successfully.")
 
     st.rerun()  # Reload the page after deletion
 
-def download_profile(profile_name, username):
-    # Define the file path for the profile's Excel file
-    excel_file_path = f'user_folders/{username}/{profile_name}.xlsx'
-    return excel_file_path
-
-# Function to create a new Excel file for the profile
-def create_excel_file(profile_name, username):
-    # Create a new DataFrame for the profile
-    df = pd.DataFrame(columns=["", "", ""])  # Customize the columns as needed
-    excel_file_path = f'user_folders/{username}/{profile_name}.xlsx'
-    df.to_excel(excel_file_path, index=False)  # Save the DataFrame to an Excel file
+def download_profile(profile_name, username, fmt="xlsx", store=None, start_date=None, end_date=None):
+    # Build the export from the receipt store on demand (reused until the profile changes)
+    return export_profile(username, profile_name, fmt, store, start_date, end_date)
 
 def display_profile():
     username = st.session_state['username']  # Get the logged-in username
     st.title("Automatic Receipt Recorder")
     st.write(f"Welcome to your profile page, {username}!")
 
-    # Load existing profiles
-    profiles = load_profiles_from_csv(username)
+    # Import any legacy .xlsx profiles into the receipt store (once per session)
+    if not st.session_state.get('store_migrated'):
+        migrate_user_folder(username)
+        st.session_state['store_migrated'] = True
 
-    # Ensure profiles is always a list (even if empty)
-    if profiles is None:
-        profiles = []  # If profiles are None, initialize as empty list
+    # Load existing profiles (the catalog only re-reads profiles.csv when it has changed)
+    profiles = get_catalog().get_profiles(username)
 
     # Add "None" and "Create New Profile" options to the profiles list
     profile_options = ["None"] + profiles + ["Create New Profile"]
@@ -72,10 +85,7 @@ def display_profile():
         # Clear uploader history if a different profile is selected
         st.session_state['uploader_history'] = []  # Clear uploader history
         st.session_state['last_selected_profile'] = selected_profile  # Update last selected profile
-
-        # Refresh the session to reflect the changes
-        st.session_state['refresh'] = True  # Set a flag to indicate refresh is needed
-        st.rerun()  # Reload page to update dropdown
+        # No rerun needed: this run already renders the newly selected profile
 
     # If "Create New Profile" is selected, show the input field to create a new profile
     if selected_profile == "Create New Profile":
@@ -86,10 +96,11 @@ def display_profile():
                 if new_profile_name in profiles:
                     st.error("Profile name already exists. Please choose a different name.")
                 else:
-                    # Save new profile
-                    profiles.append(new_profile_name)  # Append new profile to list
-                    save_profiles_to_csv(profiles, username)  # Save to CSV
-                    create_excel_file(new_profile_name, username)  # Create an Excel file for the new profile
+                    # Save new profile (another session may have created it in the meantime)
+                    if not add_profile_to_csv(new_profile_name, username):
+                        st.error("Profile name already exists. Please choose a different name.")
+                        st.stop()
+                    create_profile_store(new_profile_name, username)  # Create the receipt store for the new profile
                     st.success(f"Profile '{new_profile_name}' created successfully!")
                     st.session_state['last_selected_profile'] = new_profile_name  # Update last selected profile
                     st.rerun()  # Reload page to update dropdown
@@ -99,6 +110,18 @@ def display_profile():
         # Display selected profile message
         if selected_profile != "None" and selected_profile != "Create New Profile":
             st.write(f"Profile '{selected_profile}' selected.")
+
+            # Let the user pick how receipt images are cleaned up before OCR
+            preset_names = list(PRESETS)
+            current_preset = get_profile_preset(username, selected_profile)
+            chosen_preset = st.selectbox(
+                "OCR preprocessing", preset_names, index=preset_names.index(current_preset),
+                help="'original' is the plain thumbnail, 'standard' adds orientation fix, scaling and binarisation, "
+                     "'full' also crops to the receipt and straightens it.",
+            )
+            if chosen_preset != current_preset:
+                save_profile_preset(username, selected_profile, chosen_preset)
+
             # Initialize confirm_deletion state if not present
             if 'confirm_deletion' not in st.session_state:
                 st.session_state['confirm_deletion'] = False
@@ -115,7 +138,7 @@ def display_profile():
                 # If deletion is confirmed, show confirm and cancel buttons
                 if st.session_state['confirm_deletion']:
                     if st.button("Confirm Deletion", key="confirm_deletion_button"):
-                        delete_profile(selected_profile, profiles, username)  # Call delete function
+                        delete_profile(selected_profile, username)  # Call delete function
                         st.success(f"Profile '{selected_profile}' deleted successfully!")  # Show success message
                         st.session_state['confirm_deletion'] = False  # Reset the confirmation state
                         st.rerun()  # Reload to update profiles
@@ -126,18 +149,22 @@ def display_profile():
 
             # Show the download button in the second column
             with col2:
-                if st.button("Download Profile"):
-                    excel_file_path = download_profile(selected_profile, username)  # Get the Excel file path for download
-                    if os.path.exists(excel_file_path):
-                        with open(excel_file_path, "rb") as f:
+                with st.popover("Download Profile"):
+                    fmt = st.selectbox("Format", get_available_formats(), format_func=str.upper, key="export_format")
+                    store = st.selectbox("Store", ["All stores"] + get_profile_stores(username, selected_profile), key="export_store")
+                    start_date = st.date_input("From date", value=None, key="export_start")
+                    end_date = st.date_input("To date", value=None, key="export_end")
+                    if st.button("Prepare Download"):
+                        export_path = download_profile(selected_profile, username, fmt,
+                                                       None if store == "All stores" else store, start_date, end_date)
+                        extension, mime = EXPORT_FORMATS[fmt]
+                        with open(export_path, "rb") as f:
                             st.download_button(
                                 label="Download",
                                 data=f,
-                                file_name=f"{selected_profile}.xlsx",
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                                file_name=f"{selected_profile}.{extension}",
+                                mime=mime
                             )
-                    else:
-                        st.error("The profile file does not exist.")
 
     # Display existing profiles in the sidebar
     st.sidebar.subheader("Profiles")
@@ -1,20 +1,14 @@
 import streamlit as st
-import pandas as pd
-import os
-from admin import display_admin_panel  # Import the admin panel function
-from m_profile import display_profile  # Import the profile display function
-from file_process import upload_receipt  # Import the upload function
+from catalog import get_catalog  # Shared, indexed user and profile catalog
+# The profile, upload, analytics and admin modules (and pandas, OCR and the GPT client behind
+# them) are imported where they are used, so the login page renders without loading them
 
 # Set page configuration
 st.set_page_config(page_title="Projek 10", page_icon="🔐", layout="centered")
 
-# Load user credentials from a CSV file
+# Load user credentials (the catalog only re-reads the CSV file when it has changed)
 def load_user_credentials():
-    credentials_file = 'user_credentials.csv'
-    if os.path.exists(credentials_file):
-        df = pd.read_csv(credentials_file)
-        return {row['username']: row['password'] for index, row in df.iterrows()}
-    return {}
+    return get_catalog().get_users()
 
 # Function to check login credentials
 def login(username, password, user_credentials):
@@ -90,6 +84,10 @@ else:
     display_dashboard_sidebar()
 
     if st.session_state['redirect_to_profile']:
+        from m_profile import display_profile  # Import the profile display function
+        from file_process import upload_receipt  # Import the upload function
+        from analytics import display_spending_analytics  # Spending totals across profiles
+
         selected_profile = display_profile()  # Call the profile display function and capture the selected profile
 
         # Show the receipt upload interface after profile selection
@@ -97,5 +95,10 @@ else:
         st.subheader("Upload Receipt")
         upload_receipt(username, selected_profile)  # Call the upload function with the selected profile
 
+        st.subheader("Spending Analytics")
+        display_spending_analytics(username, get_catalog().get_profiles(username))
+
     elif st.session_state['admin_access']:
+        from admin import display_admin_panel  # Import the admin panel function
+
         display_admin_panel()
@@ -0,0 +1,94 @@
+import os
+import queue
+import threading
+import pytesseract
+
+# tesserocr binds the Tesseract C++ API directly; it is optional and needs libtesseract
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+OCR_LANGUAGE = "eng"
+# Upper bound on long-lived Tesseract instances per process (each holds its own language data)
+MAX_POOL_SIZE = os.cpu_count() or 1
+
+
+# OCR engine backed by a pool of long-lived Tesseract API instances
+class TesserocrPoolEngine:
+    """Keeps initialised Tesseract instances around so language data is loaded once.
+
+    Images are handed over in memory (no temp files, no subprocess). Instances are
+    created on demand up to `pool_size`; callers beyond that wait for a free one.
+    Recognition releases the GIL, so threads sharing the pool run in parallel.
+    """
+    name = "tesserocr"
+
+    def __init__(self, pool_size=MAX_POOL_SIZE, language=OCR_LANGUAGE):
+        self.pool_size = max(1, min(pool_size, MAX_POOL_SIZE))
+        self.language = language
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    # Function to borrow a Tesseract instance, creating one if the pool isn't full yet
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.pool_size:
+                self._created += 1
+                return tesserocr.PyTessBaseAPI(lang=self.language)
+        return self._idle.get()
+
+    # Function to extract the text of a PIL image
+    def image_to_string(self, image):
+        api = self._acquire()
+        try:
+            api.SetImage(image)
+            return api.GetUTF8Text()
+        finally:
+            api.Clear()
+            self._idle.put(api)
+
+
+# OCR engine using pytesseract (one tesseract subprocess per image)
+class PytesseractEngine:
+    name = "pytesseract"
+
+    # Function to extract the text of a PIL image
+    def image_to_string(self, image):
+        return pytesseract.image_to_string(image, lang=OCR_LANGUAGE)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+# Function to get the OCR engine for this process (tesserocr pool if available, else pytesseract)
+def get_ocr_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = _create_engine()
+    return _engine
+
+
+# Function to pick the best available engine
+def _create_engine():
+    if tesserocr is not None:
+        try:
+            engine = TesserocrPoolEngine()
+            engine._idle.put(engine._acquire())  # Fail here, not mid-request, if tessdata is missing
+            return engine
+        except RuntimeError:
+            pass
+    return PytesseractEngine()
+
+
+# Function to run OCR on a PIL image with the process-wide engine
+def image_to_text(image):
+    return get_ocr_engine().image_to_string(image)
@@ -0,0 +1,192 @@
+import bisect
+import cProfile
+import io
+import pstats
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Histogram buckets grow by 25% from 1 ms, so a percentile is reported within 25% of its true value
+BUCKET_BOUNDS = [0.001 * 1.25 ** index for index in range(60)]  # Up to about 10 minutes
+# Memory buckets grow by 25% from 64 KB
+MEMORY_BUCKET_BOUNDS = [65536 * 1.25 ** index for index in range(60)]
+WINDOW_SECONDS = 60  # Each histogram covers one minute...
+MAX_WINDOWS = 60  # ...and the last hour is kept, so memory per stage is fixed
+
+_stages = {}
+_memory = {}
+_stages_lock = threading.Lock()
+_profile_requested = threading.Event()
+_last_profile = None
+
+
+# Per-stage latency (or size) histogram over a rolling set of one-minute windows
+class RollingHistogram:
+    def __init__(self, bounds=BUCKET_BOUNDS):
+        self.bounds = bounds
+        self.windows = deque(maxlen=MAX_WINDOWS)
+        self.lock = threading.Lock()
+
+    # Function to get the window for the current minute, starting a new one if needed
+    def _current_window(self, now):
+        start = now - now % WINDOW_SECONDS
+        if not self.windows or self.windows[-1]["start"] != start:
+            self.windows.append({"start": start, "counts": [0] * (len(self.bounds) + 1),
+                                 "count": 0, "errors": 0, "total": 0.0, "max": 0.0})
+        return self.windows[-1]
+
+    # Function to record one duration (or size)
+    def record(self, value, error=False):
+        with self.lock:
+            window = self._current_window(time.time())
+            window["counts"][bisect.bisect_left(self.bounds, value)] += 1
+            window["count"] += 1
+            window["total"] += value
+            window["max"] = max(window["max"], value)
+            if error:
+                window["errors"] += 1
+
+    # Function to summarise the windows of the last `horizon` seconds (in the recorded unit)
+    def snapshot(self, horizon):
+        now = time.time()
+        counts = [0] * (len(self.bounds) + 1)
+        count = errors = 0
+        total = maximum = 0.0
+        oldest = now
+        with self.lock:
+            for window in self.windows:
+                if window["start"] + WINDOW_SECONDS < now - horizon:
+                    continue
+                oldest = min(oldest, window["start"])
+                counts = [a + b for a, b in zip(counts, window["counts"])]
+                count += window["count"]
+                errors += window["errors"]
+                total += window["total"]
+                maximum = max(maximum, window["max"])
+
+        elapsed = max(now - oldest, 1.0)
+        return {
+            "count": count,
+            "errors": errors,
+            "mean": total / count if count else 0.0,
+            "p50": _percentile(self.bounds, counts, count, 0.50, maximum),
+            "p95": _percentile(self.bounds, counts, count, 0.95, maximum),
+            "p99": _percentile(self.bounds, counts, count, 0.99, maximum),
+            "max": maximum,
+            "per_minute": 60 * count / elapsed,
+        }
+
+
+# Function to read a percentile off the bucket counts (upper bound of the bucket it falls in)
+def _percentile(bounds, counts, count, fraction, maximum):
+    if not count:
+        return 0.0
+    rank = fraction * count
+    seen = 0
+    for index, bucket_count in enumerate(counts):
+        seen += bucket_count
+        if seen >= rank:
+            return min(bounds[index], maximum) if index < len(bounds) else maximum
+    return maximum
+
+
+# Function to get (or create) the histogram of a stage
+def _get_stage(stage):
+    histogram = _stages.get(stage)
+    if histogram is None:
+        with _stages_lock:
+            histogram = _stages.setdefault(stage, RollingHistogram())
+    return histogram
+
+
+# Context manager timing a pipeline stage
+@contextmanager
+def span(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        _get_stage(stage).record(time.perf_counter() - started, error=True)
+        raise
+    _get_stage(stage).record(time.perf_counter() - started)
+
+
+# Function to record a duration measured elsewhere (e.g. in a worker process)
+def record_duration(stage, seconds, error=False):
+    _get_stage(stage).record(seconds, error)
+
+
+# Function to record the memory used by one item of a stage (e.g. a decoded image)
+def record_memory(metric, nbytes):
+    histogram = _memory.get(metric)
+    if histogram is None:
+        with _stages_lock:
+            histogram = _memory.setdefault(metric, RollingHistogram(MEMORY_BUCKET_BOUNDS))
+    histogram.record(nbytes)
+
+
+# Function to get the latency summary of every stage
+def get_stage_stats(horizon=15 * 60):
+    with _stages_lock:
+        stages = dict(_stages)
+    stats = {}
+    for stage, histogram in sorted(stages.items()):
+        snapshot = histogram.snapshot(horizon)
+        stats[stage] = {
+            "count": snapshot["count"],
+            "errors": snapshot["errors"],
+            **{f"{key}_ms": 1000 * snapshot[key] for key in ("mean", "p50", "p95", "p99", "max")},
+            "per_minute": snapshot["per_minute"],
+        }
+    return stats
+
+
+# Function to get the memory summary (in MB) of every memory metric
+def get_memory_stats(horizon=15 * 60):
+    with _stages_lock:
+        metrics = dict(_memory)
+    stats = {}
+    for metric, histogram in sorted(metrics.items()):
+        snapshot = histogram.snapshot(horizon)
+        stats[metric] = {
+            "count": snapshot["count"],
+            **{f"{key}_mb": snapshot[key] / (1024 * 1024) for key in ("mean", "p50", "p95", "max")},
+        }
+    return stats
+
+
+# Function to ask for the next receipt to be processed under cProfile
+def request_profile():
+    _profile_requested.set()
+
+
+# Function to check whether a profile has been requested but not captured yet
+def is_profile_requested():
+    return _profile_requested.is_set()
+
+
+# Context manager profiling the wrapped request if a profile was requested
+@contextmanager
+def maybe_profile(label):
+    global _last_profile
+    if not _profile_requested.is_set():
+        yield
+        return
+    _profile_requested.clear()
+
+    profiler = cProfile.Profile()
+    started = time.time()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(40)
+        _last_profile = {"label": label, "captured_at": started, "report": output.getvalue()}
+
+
+# Function to get the most recent cProfile report (or None)
+def get_last_profile():
+    return _last_profile
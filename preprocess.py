@@ -0,0 +1,166 @@
+import numpy as np
+from PIL import Image, ImageOps
+
+# Preprocessing presets selectable per profile
+PRESETS = {
+    # Previous behaviour: colour thumbnail capped at 900x900
+    "original": {"max_size": (900, 900)},
+    # Orientation fix, DPI-aware scaling and adaptive binarisation
+    "standard": {"exif": True, "target_dpi": 300, "binarize": True, "window": 31, "k": 0.2},
+    # Everything in "standard" plus receipt-region cropping and deskewing
+    "full": {"exif": True, "crop": True, "deskew": True, "target_dpi": 300, "binarize": True, "window": 31, "k": 0.2},
+}
+DEFAULT_PRESET = "standard"
+
+# Width of a standard 80 mm till roll, used when the image carries no DPI information
+RECEIPT_WIDTH_INCHES = 80 / 25.4
+# Limits on the scaling factor so odd inputs can't explode the image size
+MIN_SCALE = 0.25
+MAX_SCALE = 3.0
+# DPI tags below this come from cameras and editors (72 or 96 dpi), not from scanners, and are ignored
+MIN_SOURCE_DPI = 150
+# Pixel budget of the scaled image; binarising holds several float64 copies of it
+MAX_OCR_PIXELS = 8_000_000
+
+
+# Function to get the settings of a preset (part of the receipt cache key)
+def get_preset_settings(preset):
+    return {"preset": preset, **PRESETS.get(preset, PRESETS[DEFAULT_PRESET])}
+
+
+# Function to run an image through a preprocessing preset before OCR
+def preprocess_image(image, preset=DEFAULT_PRESET):
+    settings = PRESETS.get(preset, PRESETS[DEFAULT_PRESET])
+
+    if "max_size" in settings:
+        image = image.copy()
+        image.thumbnail(settings["max_size"])
+        return image
+
+    dpi = image.info.get("dpi")
+    if settings.get("exif"):
+        image = ImageOps.exif_transpose(image)
+    image = image.convert("L")
+
+    if settings.get("crop"):
+        image = crop_receipt_region(image)
+    image = scale_for_ocr(image, settings["target_dpi"], dpi)
+    if settings.get("binarize"):
+        binary = adaptive_binarize(np.asarray(image, dtype=np.float32), settings["window"], settings["k"])
+        image = Image.fromarray(binary)
+    # Deskew after binarising: flat background is white by then and doesn't distort the profiles
+    if settings.get("deskew"):
+        image = deskew(image)
+    return image
+
+
+# Function to binarise a grayscale array with Sauvola's local threshold
+def adaptive_binarize(gray, window=31, k=0.2, dynamic_range=128.0):
+    """Return a uint8 array of 0 (ink) and 255 (paper).
+
+    Local mean and standard deviation come from integral images, so the cost is
+    independent of the window size.
+    """
+    mean, std = _local_mean_std(gray, window)
+    threshold = mean * (1.0 + k * (std / dynamic_range - 1.0))
+    return np.where(gray > threshold, 255, 0).astype(np.uint8)
+
+
+# Function to compute the mean and standard deviation over a square window around each pixel
+def _local_mean_std(gray, window):
+    half = window // 2
+    padded = np.pad(gray.astype(np.float64), half + 1, mode="edge")
+    integral = padded.cumsum(axis=0).cumsum(axis=1)
+    integral_sq = (padded ** 2).cumsum(axis=0).cumsum(axis=1)
+
+    height, width = gray.shape
+    top, left = np.s_[0:height], np.s_[0:width]
+    bottom, right = np.s_[window:window + height], np.s_[window:window + width]
+
+    def window_sum(table):
+        return table[bottom, right] - table[top, right] - table[bottom, left] + table[top, left]
+
+    area = float(window * window)
+    mean = window_sum(integral) / area
+    variance = np.maximum(window_sum(integral_sq) / area - mean ** 2, 0.0)
+    return mean, np.sqrt(variance)
+
+
+# Function to crop the image to the bright receipt paper
+def crop_receipt_region(image, margin=0.02, min_fill=0.3):
+    """Crop to the rows and columns where paper dominates; return the image unchanged if unsure."""
+    gray = np.asarray(image, dtype=np.uint8)
+    paper = gray > _otsu_threshold(gray)
+
+    rows = np.flatnonzero(paper.mean(axis=1) > min_fill)
+    cols = np.flatnonzero(paper.mean(axis=0) > min_fill)
+    if rows.size == 0 or cols.size == 0:
+        return image
+
+    height, width = gray.shape
+    pad_y, pad_x = int(height * margin), int(width * margin)
+    top, bottom = max(rows[0] - pad_y, 0), min(rows[-1] + pad_y + 1, height)
+    left, right = max(cols[0] - pad_x, 0), min(cols[-1] + pad_x + 1, width)
+
+    # A tiny region usually means the threshold picked up a highlight, not the receipt
+    if (bottom - top) * (right - left) < 0.2 * height * width:
+        return image
+    return image.crop((left, top, right, bottom))
+
+
+# Function to pick a global threshold separating paper from background (Otsu's method)
+def _otsu_threshold(gray):
+    histogram = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    weight_bg = histogram.cumsum()
+    weight_fg = weight_bg[-1] - weight_bg
+    cumulative_mean = (histogram * levels).cumsum()
+    mean_bg = cumulative_mean / np.maximum(weight_bg, 1)
+    mean_fg = (cumulative_mean[-1] - cumulative_mean) / np.maximum(weight_fg, 1)
+    between_variance = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return int(np.argmax(between_variance))
+
+
+# Function to scale the image so text lands at roughly the resolution Tesseract expects
+def scale_for_ocr(image, target_dpi=300, dpi=None, max_pixels=MAX_OCR_PIXELS):
+    if dpi and dpi[0] and dpi[0] >= MIN_SOURCE_DPI:
+        scale = target_dpi / float(dpi[0])
+    else:
+        # Assume the receipt spans the image width and is printed on a standard till roll
+        scale = (RECEIPT_WIDTH_INCHES * target_dpi) / image.width
+    scale = min(max(scale, MIN_SCALE), MAX_SCALE)
+    # Never go past the pixel budget, whatever the DPI tag or the input size
+    scale = min(scale, (max_pixels / (image.width * image.height)) ** 0.5)
+    if abs(scale - 1.0) < 0.05:
+        return image
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(size, Image.LANCZOS if scale < 1 else Image.BICUBIC)
+
+
+# Function to straighten a slightly rotated receipt
+def deskew(image, max_angle=5.0, step=0.5):
+    angle = estimate_skew(image, max_angle, step)
+    if abs(angle) < step / 2:
+        return image
+    return image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+
+
+# Function to estimate the skew angle from horizontal projection profiles
+def estimate_skew(image, max_angle=5.0, step=0.5, sample_width=400):
+    """Return the rotation (degrees) that makes text lines most horizontal.
+
+    Straight text lines give the sharpest row-sum profile, so we pick the angle whose
+    profile has the largest variance. The search runs on a small, inverted copy.
+    """
+    small = image.copy()
+    small.thumbnail((sample_width, sample_width * 4))
+    ink = ImageOps.invert(small)
+
+    best_angle, best_score = 0.0, -1.0
+    # Try the smallest rotations first so a flat profile (e.g. a blank image) stays unrotated
+    for angle in sorted(np.arange(-max_angle, max_angle + step / 2, step), key=abs):
+        rotated = np.asarray(ink.rotate(float(angle), resample=Image.NEAREST, expand=True), dtype=np.float32)
+        score = float(np.var(rotated.sum(axis=1)))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
@@ -0,0 +1,135 @@
+import csv
+import glob
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import time
+from perf_metrics import span
+from receipt_store import BASE_DIR, RECEIPT_COLUMNS, get_profile_version, iter_profile_records
+from safe_write import atomic_write, file_lock
+
+# openpyxl and pyarrow are imported by their writers, on the first export in that format
+
+# Rows fetched from the store and written per batch
+EXPORT_BATCH_ROWS = 5000
+# Cached export files kept per profile, and how long an unused one is kept
+EXPORT_CACHE_FILES = 10
+EXPORT_MAX_AGE = 24 * 60 * 60
+
+# Download file extension and MIME type of each export format
+EXPORT_FORMATS = {
+    "xlsx": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": ("csv", "text/csv"),
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+
+# Function to list the export formats usable on this server
+def get_available_formats():
+    return [fmt for fmt in EXPORT_FORMATS if fmt != "parquet" or importlib.util.find_spec("pyarrow") is not None]
+
+
+# Function to get the folder holding a profile's exports (also used as its lock)
+def _get_export_dir(username, profile_name):
+    profile_hash = hashlib.sha256(profile_name.encode()).hexdigest()[:16]  # Profile names may not be valid file names
+    return os.path.join(BASE_DIR, username, 'exports', profile_hash)
+
+
+# Function to get the path of a profile's export without the version
+def _get_export_base(username, profile_name, fmt, filters):
+    filter_hash = hashlib.sha256(json.dumps([fmt, filters], default=str).encode()).hexdigest()[:16]
+    return os.path.join(_get_export_dir(username, profile_name), filter_hash)
+
+
+# Function to export a profile's records, reusing the file until new receipts arrive
+def export_profile(username, profile_name, fmt="xlsx", store=None, start_date=None, end_date=None):
+    """Write the (filtered) records of a profile as XLSX, CSV or Parquet and return the file path.
+
+    Rows are streamed from the store in batches, so memory use doesn't grow with the profile.
+    The file is kept and reused for the same filters until the profile version changes, up
+    to EXPORT_CACHE_FILES files per profile and for EXPORT_MAX_AGE seconds after last use.
+    """
+    if fmt not in get_available_formats():
+        raise ValueError(f"Unsupported export format: {fmt}")
+    filters = {"store": store, "start_date": start_date, "end_date": end_date}
+    version = get_profile_version(username, profile_name)
+    export_dir = _get_export_dir(username, profile_name)
+    base = _get_export_base(username, profile_name, fmt, filters)
+    path = f"{base}-v{version}.{EXPORT_FORMATS[fmt][0]}"
+
+    with file_lock(export_dir):
+        if os.path.exists(path):
+            os.utime(path)  # Mark it as recently used
+        else:
+            batches = iter_profile_records(username, profile_name, EXPORT_BATCH_ROWS, store, start_date, end_date)
+            with span(f"export.{fmt}"):
+                _WRITERS[fmt](path, batches)
+        _prune_exports(export_dir, base, path)
+    return path
+
+
+# Function to remove out-of-date, expired and least recently used exports of a profile (under its lock)
+def _prune_exports(export_dir, base, keep_path):
+    # Exports of earlier versions with the same filters are out of date
+    for old_path in glob.glob(f"{base}-v*"):
+        if old_path != keep_path:
+            os.remove(old_path)
+
+    paths = [os.path.join(export_dir, name) for name in os.listdir(export_dir) if not name.endswith(".tmp")]
+    paths.sort(key=os.path.getmtime, reverse=True)
+    expired_before = time.time() - EXPORT_MAX_AGE
+    for index, old_path in enumerate(paths):
+        if old_path != keep_path and (index >= EXPORT_CACHE_FILES or os.path.getmtime(old_path) < expired_before):
+            os.remove(old_path)
+
+
+# Function to remove every export of a profile (when the profile is deleted)
+def delete_profile_exports(username, profile_name):
+    export_dir = _get_export_dir(username, profile_name)
+    with file_lock(export_dir):
+        shutil.rmtree(export_dir, ignore_errors=True)
+    if os.path.exists(export_dir + ".lock"):
+        os.remove(export_dir + ".lock")
+
+
+# Function to write batches of rows as an .xlsx workbook with openpyxl's streaming writer
+def _write_xlsx(path, batches):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(RECEIPT_COLUMNS)
+    for rows in batches:
+        for row in rows:
+            sheet.append(row)
+    atomic_write(path, workbook.save, mode="wb")
+
+
+# Function to write batches of rows as CSV
+def _write_csv(path, batches):
+    def write(f):
+        writer = csv.writer(f)
+        writer.writerow(RECEIPT_COLUMNS)
+        for rows in batches:
+            writer.writerows(rows)
+    atomic_write(path, write)
+
+
+# Function to write batches of rows as Parquet, one row group per batch
+def _write_parquet(path, batches):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(column, pa.string()) for column in RECEIPT_COLUMNS])
+
+    def write(f):
+        with pq.ParquetWriter(f, schema) as writer:
+            for rows in batches:
+                columns = list(zip(*rows))
+                writer.write_table(pa.Table.from_arrays([pa.array(column, pa.string()) for column in columns], schema=schema))
+    atomic_write(path, write, mode="wb")
+
+
+_WRITERS = {"xlsx": _write_xlsx, "csv": _write_csv, "parquet": _write_parquet}
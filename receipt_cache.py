@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Directory for application-wide data (kept apart from the per-user folders)
+APP_DATA_DIR = '.app_data'
+CACHE_FILE = os.path.join(APP_DATA_DIR, 'receipt_cache.sqlite3')
+
+# Eviction limits for the cache
+MAX_CACHE_BYTES = 50 * 1024 * 1024  # Total size of cached OCR text and GPT responses
+MAX_CACHE_AGE = 30 * 24 * 60 * 60  # Entries not used for 30 days are dropped
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+# Function to open a connection to the cache database (creating it if needed)
+def _connect():
+    global _schema_ready
+    os.makedirs(APP_DATA_DIR, exist_ok=True)
+    conn = sqlite3.connect(CACHE_FILE, timeout=10)
+    if not _schema_ready:
+        with _schema_lock:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS receipt_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    ocr_text TEXT NOT NULL,
+                    gpt_response TEXT NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_receipt_cache_access ON receipt_cache (last_access);
+                CREATE TABLE IF NOT EXISTS recorded_receipts (
+                    cache_key TEXT NOT NULL,
+                    username TEXT NOT NULL,
+                    profile TEXT NOT NULL,
+                    recorded_at REAL NOT NULL,
+                    PRIMARY KEY (cache_key, username, profile)
+                );
+                CREATE TABLE IF NOT EXISTS cache_stats (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+                INSERT OR IGNORE INTO cache_stats (name, value) VALUES ('hits', 0), ('misses', 0);
+            """)
+            _schema_ready = True
+    return conn
+
+
+# Function to build the cache key from the uploaded bytes and the preprocessing settings
+def make_cache_key(image_bytes, settings):
+    """Hash the raw upload together with every setting that affects the OCR/GPT output."""
+    digest = hashlib.sha256(image_bytes)
+    digest.update(json.dumps(settings, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+# Function to look up a cached OCR/GPT result
+def get_cached_result(cache_key):
+    """Return {'ocr_text', 'gpt_response'} for a cached receipt, or None on a miss."""
+    conn = _connect()
+    try:
+        with conn:
+            row = conn.execute(
+                "SELECT ocr_text, gpt_response, last_access FROM receipt_cache WHERE cache_key = ?",
+                (cache_key,),
+            ).fetchone()
+            now = time.time()
+            if row is not None and now - row[2] > MAX_CACHE_AGE:
+                conn.execute("DELETE FROM receipt_cache WHERE cache_key = ?", (cache_key,))
+                row = None
+
+            if row is None:
+                conn.execute("UPDATE cache_stats SET value = value + 1 WHERE name = 'misses'")
+                return None
+
+            conn.execute("UPDATE receipt_cache SET last_access = ? WHERE cache_key = ?", (now, cache_key))
+            conn.execute("UPDATE cache_stats SET value = value + 1 WHERE name = 'hits'")
+            return {"ocr_text": row[0], "gpt_response": row[1]}
+    finally:
+        conn.close()
+
+
+# Function to store a freshly computed OCR/GPT result
+def store_result(cache_key, ocr_text, gpt_response):
+    now = time.time()
+    size_bytes = len(ocr_text.encode("utf-8")) + len(gpt_response.encode("utf-8"))
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO receipt_cache "
+                "(cache_key, ocr_text, gpt_response, size_bytes, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (cache_key, ocr_text, gpt_response, size_bytes, now, now),
+            )
+            _evict(conn, now)
+    finally:
+        conn.close()
+
+
+# Function to drop expired entries and trim the cache down to its size limit
+def _evict(conn, now):
+    conn.execute("DELETE FROM receipt_cache WHERE last_access < ?", (now - MAX_CACHE_AGE,))
+    conn.execute("DELETE FROM recorded_receipts WHERE recorded_at < ?", (now - MAX_CACHE_AGE,))
+
+    total_bytes = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM receipt_cache").fetchone()[0]
+    if total_bytes <= MAX_CACHE_BYTES:
+        return
+
+    # Remove least recently used entries until we are back under the limit
+    excess = total_bytes - MAX_CACHE_BYTES
+    stale_keys = []
+    for cache_key, size_bytes in conn.execute(
+        "SELECT cache_key, size_bytes FROM receipt_cache ORDER BY last_access ASC"
+    ):
+        stale_keys.append((cache_key,))
+        excess -= size_bytes
+        if excess <= 0:
+            break
+    conn.executemany("DELETE FROM receipt_cache WHERE cache_key = ?", stale_keys)
+
+
+# Function to check whether a receipt has already been written to a profile
+def is_recorded(cache_key, username, profile):
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT 1 FROM recorded_receipts WHERE cache_key = ? AND username = ? AND profile = ?",
+            (cache_key, username, profile),
+        ).fetchone()
+        return row is not None
+    finally:
+        conn.close()
+
+
+# Function to remember that a receipt has been written to a profile
+def mark_recorded(cache_key, username, profile):
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO recorded_receipts (cache_key, username, profile, recorded_at) "
+                "VALUES (?, ?, ?, ?)",
+                (cache_key, username, profile, time.time()),
+            )
+    finally:
+        conn.close()
+
+
+# Function to forget the "already recorded" markers of a profile (e.g. when it is deleted)
+def clear_recorded(username, profile=None):
+    conn = _connect()
+    try:
+        with conn:
+            if profile is None:
+                conn.execute("DELETE FROM recorded_receipts WHERE username = ?", (username,))
+            else:
+                conn.execute(
+                    "DELETE FROM recorded_receipts WHERE username = ? AND profile = ?",
+                    (username, profile),
+                )
+    finally:
+        conn.close()
+
+
+# Function to report cache hit/miss counters and current size
+def get_cache_stats():
+    conn = _connect()
+    try:
+        counters = dict(conn.execute("SELECT name, value FROM cache_stats").fetchall())
+        entries, total_bytes = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM receipt_cache"
+        ).fetchone()
+    finally:
+        conn.close()
+
+    hits = counters.get('hits', 0)
+    misses = counters.get('misses', 0)
+    lookups = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / lookups if lookups else 0.0,
+        "entries": entries,
+        "size_bytes": total_bytes,
+    }
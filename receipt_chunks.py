@@ -0,0 +1,62 @@
+from receipt_extractor import normalize_name
+from token_usage import count_text_tokens
+
+# OCR text longer than this many tokens is extracted in chunks
+LONG_RECEIPT_TOKENS = 1500
+# Tokens of OCR text per chunk, and lines repeated at the start of the next chunk
+CHUNK_TOKENS = 800
+CHUNK_OVERLAP_LINES = 3
+
+
+# Function to split OCR text into overlapping chunks of whole lines
+def split_receipt_text(text, model, max_tokens=CHUNK_TOKENS, overlap_lines=CHUNK_OVERLAP_LINES):
+    """Return a list of chunks of at most about `max_tokens` tokens each.
+
+    Chunks end on line boundaries, and each chunk after the first starts with the last
+    `overlap_lines` lines of the previous one, so an item cut off at the end of a chunk
+    is read whole in the next.
+    """
+    lines = [line for line in text.splitlines() if line.strip()]
+    line_tokens = [count_text_tokens(line, model) + 1 for line in lines]  # +1 for the newline
+
+    chunks, start = [], 0
+    while start < len(lines):
+        end, tokens = start, 0
+        while end < len(lines) and (end == start or tokens + line_tokens[end] <= max_tokens):
+            tokens += line_tokens[end]
+            end += 1
+        chunks.append("\n".join(lines[start:end]))
+        if end == len(lines):
+            break
+        # Step back for the overlap, but always move forward
+        start = max(end - overlap_lines, start + 1)
+    return chunks
+
+
+# Function to count the items at the start of `following` that repeat the end of `previous`
+def _overlap_length(previous, following, limit):
+    previous_keys = [(normalize_name(item["name"]), item["price"]) for item in previous[-limit:]]
+    following_keys = [(normalize_name(item["name"]), item["price"]) for item in following[:limit]]
+    for length in range(min(len(previous_keys), len(following_keys)), 0, -1):
+        if previous_keys[-length:] == following_keys[:length]:
+            return length
+    return 0
+
+
+# Function to merge the receipts extracted from consecutive chunks into one
+def merge_chunk_receipts(receipts, overlap_lines=CHUNK_OVERLAP_LINES):
+    """Merge parsed chunk receipts ({"store", "date", "items", "total"}) in chunk order.
+
+    Store and date come from the first chunk that has them (the receipt header) and the
+    total from the last one (the footer). Items read twice because they sit in the lines
+    shared by two chunks are only kept once.
+    """
+    merged = {"store": None, "date": None, "items": [], "total": None}
+    for receipt in receipts:
+        merged["store"] = merged["store"] or receipt["store"]
+        merged["date"] = merged["date"] or receipt["date"]
+        if receipt["total"] is not None:
+            merged["total"] = receipt["total"]
+        skip = _overlap_length(merged["items"], receipt["items"], overlap_lines)
+        merged["items"].extend(receipt["items"][skip:])
+    return merged
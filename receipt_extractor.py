@@ -0,0 +1,285 @@
+import datetime
+import json
+import os
+import re
+import threading
+from safe_write import atomic_write, file_lock
+
+# Store templates learned from GPT results live with the other application-wide data
+APP_DATA_DIR = '.app_data'
+TEMPLATES_FILE = os.path.join(APP_DATA_DIR, 'store_templates.json')
+MAX_TEMPLATE_ITEMS = 500  # Known item names remembered per store
+HEADER_LINES = 4  # Lines at the top of a receipt used to recognise the store
+
+# Receipts whose local extraction scores at least this much skip the GPT call
+LOCAL_CONFIDENCE_THRESHOLD = 0.8
+
+# A price at the end of a line, optionally with a currency and a trailing tax code
+PRICE_PATTERN = re.compile(r"^(?P<name>.*?)[\s:]*(?:RM|\$|€|£)?\s*(?P<price>-?\d{1,6}[.,]\d{2})\s*[A-Z*]{0,2}$", re.IGNORECASE)
+# Lines with a price that are not purchased items
+SKIP_PATTERN = re.compile(
+    r"\b(sub\s*-?total|total|tax|gst|sst|vat|service\s+charge|change|cash|card|visa|master|debit|credit|"
+    r"balance|rounding|round\s+adj|tender(ed)?|paid|payment|amount\s+due|discount|savings?)\b",
+    re.IGNORECASE,
+)
+TOTAL_PATTERN = re.compile(r"\b(grand\s+total|total(\s+amount)?|amount\s+due|nett?\s+total)\b", re.IGNORECASE)
+SUBTOTAL_PATTERN = re.compile(r"\bsub\s*-?total\b", re.IGNORECASE)
+# Lines near the top that are not the store name
+NOT_STORE_PATTERN = re.compile(r"(\d{3,}|@|www\.|\.com|tel|fax|gst\s*(no|reg)|sdn\.?\s*bhd\.?\s*\(|receipt|invoice)", re.IGNORECASE)
+# Header lines printed by many stores, which say nothing about which store it is
+GENERIC_HEADER_PATTERN = re.compile(
+    r"\b(welcome|thank\s*you|tax|invoice|receipt|bill|cash\s*sales?|copy|customer|cashier|counter|table|order)\b",
+    re.IGNORECASE,
+)
+
+MONTHS = {name: index for index, name in enumerate(
+    ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"], 1)}
+DATE_PATTERNS = [
+    # 2024-01-31, 2024/01/31
+    (re.compile(r"\b(?P<y>\d{4})[-/.](?P<m>\d{1,2})[-/.](?P<d>\d{1,2})\b"), "ymd"),
+    # 31/01/2024, 31-01-24, 31.01.2024 (day first unless that is impossible)
+    (re.compile(r"\b(?P<a>\d{1,2})[-/.](?P<b>\d{1,2})[-/.](?P<y>\d{4}|\d{2})\b"), "dmy"),
+    # 31 Jan 2024, 31-JAN-24
+    (re.compile(r"\b(?P<d>\d{1,2})[\s-]*(?P<mon>[A-Za-z]{3})[A-Za-z]*[\s,-]*(?P<y>\d{4}|\d{2})\b"), "dmony"),
+]
+
+_templates = None
+_templates_mtime = None
+_templates_lock = threading.Lock()
+
+
+# Function to normalise a store name or item name for matching
+def normalize_name(text):
+    return re.sub(r"[^a-z0-9]+", " ", str(text).lower()).strip()
+
+
+# Function to turn a date found on a receipt into YYYY-MM-DD (or None)
+def normalize_date(text):
+    if not text:
+        return None
+    for pattern, kind in DATE_PATTERNS:
+        for match in pattern.finditer(str(text)):
+            parts = match.groupdict()
+            try:
+                year = int(parts["y"])
+                year += 2000 if year < 100 else 0
+                if kind == "ymd":
+                    month, day = int(parts["m"]), int(parts["d"])
+                elif kind == "dmony":
+                    month, day = MONTHS.get(parts["mon"][:3].lower()), int(parts["d"])
+                    if month is None:
+                        continue
+                else:
+                    day, month = int(parts["a"]), int(parts["b"])
+                    if month > 12 >= day:
+                        day, month = month, day  # Month-first date such as 01/31/2024
+                return datetime.date(year, month, day).isoformat()
+            except ValueError:
+                continue
+    return None
+
+
+# Function to turn a price such as "12.50", "RM 1,234.50", "3,20" or 3.5 into a float
+def parse_price(text):
+    """Raises ValueError if there is no number in `text`."""
+    text = str(text)
+    if "." in text:
+        text = text.replace(",", "")  # Thousands separators
+    elif re.search(r",\d{3}(?!\d)", text):
+        text = text.replace(",", "")  # 1,234 is a thousands separator, 3,20 a decimal comma
+    match = re.search(r"-?\d+(?:,\d+)?(?:\.\d+)?", text)
+    if match is None:
+        raise ValueError(f"No price in {text!r}")
+    return float(match.group().replace(",", "."))
+
+
+# Function to load the learned store templates (re-read only when the file changes)
+def load_store_templates():
+    global _templates, _templates_mtime
+    try:
+        mtime = os.path.getmtime(TEMPLATES_FILE)
+    except OSError:
+        return {}
+    with _templates_lock:
+        if _templates is None or mtime != _templates_mtime:
+            with open(TEMPLATES_FILE, encoding="utf-8") as f:
+                _templates = json.load(f)
+            _templates_mtime = mtime
+        return _templates
+
+
+# Function to learn a store's header and item names from a validated (GPT) extraction
+def learn_store_template(ocr_text, receipt):
+    if not receipt.get("store"):
+        return
+    key = normalize_name(receipt["store"])
+    headers = _header_lines(ocr_text.splitlines())[:HEADER_LINES]
+
+    with _templates_lock, file_lock(TEMPLATES_FILE):
+        templates = dict(_read_templates_file())
+        template = templates.get(key, {"store": receipt["store"], "headers": [], "items": [], "seen": 0})
+        template["headers"] = list(dict.fromkeys(template["headers"] + headers))[-4 * HEADER_LINES:]
+        known_items = template["items"] + [normalize_name(item["name"]) for item in receipt["items"]]
+        template["items"] = list(dict.fromkeys(known_items))[-MAX_TEMPLATE_ITEMS:]
+        template["seen"] += 1
+        templates[key] = template
+
+        atomic_write(TEMPLATES_FILE, lambda f: json.dump(templates, f))
+
+
+# Function to read the templates file without the in-memory cache
+def _read_templates_file():
+    if not os.path.exists(TEMPLATES_FILE):
+        return {}
+    with open(TEMPLATES_FILE, encoding="utf-8") as f:
+        return json.load(f)
+
+
+# Function to get the normalised lines at the top of a receipt that can tell stores apart
+def _header_lines(lines):
+    headers = []
+    for line in lines[:2 * HEADER_LINES]:
+        name = normalize_name(line)
+        # Skip addresses, phone numbers, dates and generic lines such as "TAX INVOICE" or "WELCOME"
+        if name and not NOT_STORE_PATTERN.search(line) and not GENERIC_HEADER_PATTERN.search(line) \
+                and not normalize_date(line):
+            headers.append(name)
+    return headers
+
+
+# Function to find the learned template whose header matches the top of the receipt
+def _match_template(lines, templates):
+    """Return the best template whose store name is in the header, or that shares 2+ header lines."""
+    top = set(_header_lines(lines))
+    padded_top = [f" {line} " for line in top]
+    best, best_score = None, (False, 0)
+    for template in templates.values():
+        store_key = f" {normalize_name(template['store'])} "
+        has_store = any(store_key in line for line in padded_top)
+        overlap = len(top & set(template["headers"]))
+        if not has_store and overlap < 2:
+            continue
+        if (has_store, overlap) > best_score:
+            best, best_score = template, (has_store, overlap)
+    return best
+
+
+# Function to extract store, date, items and total from OCR text using layout rules
+def extract_receipt(ocr_text, templates=None):
+    """Return {"store", "date", "items": [{"name", "price"}], "total", "confidence", "source"}.
+
+    The confidence grows with the evidence found: a recognised store, a date, item lines,
+    and above all item prices that add up to the printed total.
+    """
+    lines = [line.strip() for line in ocr_text.splitlines() if line.strip()]
+    template = _match_template(lines, templates or {})
+
+    items, total, subtotal = [], None, None
+    for line in lines:
+        match = PRICE_PATTERN.match(line)
+        if not match:
+            continue
+        price = parse_price(match.group("price"))
+        if SUBTOTAL_PATTERN.search(line):
+            subtotal = price
+        elif TOTAL_PATTERN.search(line):
+            total = price if total is None else total  # The first total is the receipt total
+        elif not SKIP_PATTERN.search(line):
+            name = match.group("name").strip(" .:-*")
+            if len(re.sub(r"[^A-Za-z]", "", name)) >= 2:
+                items.append({"name": name, "price": price})
+
+    store = template["store"] if template else None
+    if store is None:
+        for line in lines[:5]:
+            if len(re.sub(r"[^A-Za-z]", "", line)) >= 3 and not NOT_STORE_PATTERN.search(line) \
+                    and not PRICE_PATTERN.match(line) and not normalize_date(line):
+                store = line
+                break
+
+    date = None
+    for line in lines:
+        date = normalize_date(line)
+        if date:
+            break
+
+    # Score the evidence
+    confidence = 0.0
+    if store:
+        confidence += 0.15 + (0.1 if template else 0.0)
+    if date:
+        confidence += 0.15
+    if items:
+        confidence += 0.2
+        item_sum = round(sum(item["price"] for item in items), 2)
+        expected = subtotal if subtotal is not None else total
+        if expected is not None and abs(item_sum - expected) <= max(0.01, 0.005 * abs(expected)):
+            confidence += 0.4
+        if template:
+            known = set(template["items"])
+            confidence += 0.1 * sum(normalize_name(item["name"]) in known for item in items) / len(items)
+
+    return {
+        "store": store,
+        "date": date,
+        "items": items,
+        "total": total,
+        "confidence": round(min(confidence, 1.0), 3),
+        "source": "local",
+    }
+
+
+# Function to validate a GPT JSON reply against the receipt schema and normalise it
+def parse_receipt_json(content):
+    """Parse {"store": str|null, "date": str|null, "items": [{"name": str, "price": number}], "total": number|null}.
+
+    Raises ValueError if the reply does not match the schema.
+    """
+    try:
+        data = json.loads(content)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Reply is not valid JSON: {e}")
+    if not isinstance(data, dict):
+        raise ValueError("Reply is not a JSON object")
+
+    store = data.get("store")
+    if store is not None and not isinstance(store, str):
+        raise ValueError("'store' must be a string or null")
+
+    raw_items = data.get("items")
+    if not isinstance(raw_items, list):
+        raise ValueError("'items' must be a list")
+    items = []
+    for raw_item in raw_items:
+        if not isinstance(raw_item, dict) or not isinstance(raw_item.get("name"), str) or not raw_item["name"].strip():
+            raise ValueError(f"Invalid item: {raw_item!r}")
+        try:
+            price = round(parse_price(raw_item.get("price")), 2)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid price for item {raw_item['name']!r}: {raw_item.get('price')!r}")
+        items.append({"name": raw_item["name"].strip(), "price": price})
+
+    total = data.get("total")
+    if total is not None:
+        try:
+            total = round(parse_price(total), 2)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid total: {total!r}")
+
+    return {
+        "store": store.strip() if store else None,
+        "date": normalize_date(data.get("date")),
+        "items": items,
+        "total": total,
+        "confidence": 1.0,
+        "source": "gpt",
+    }
+
+
+# Function to turn an extracted receipt into rows for the receipt store
+def receipt_to_rows(receipt):
+    return [
+        {"Store Name": receipt["store"], "Date": receipt["date"], "Item Purchased": item["name"],
+         "Price": f"{item['price']:.2f}"}
+        for item in receipt["items"]
+    ]
@@ -0,0 +1,595 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import pandas as pd
+from perf_metrics import span
+from receipt_extractor import normalize_date, parse_price
+from safe_write import file_lock
+
+# Base directory to store user folders
+BASE_DIR = 'user_folders'
+
+# Columns shown to the user and written to exported workbooks
+RECEIPT_COLUMNS = ["Store Name", "Date", "Item Purchased", "Price"]
+
+# Appends arriving within this many seconds of each other share one transaction
+GROUP_COMMIT_WINDOW = 0.01
+
+# Run a compaction check after this many appends to a user's store
+COMPACT_EVERY = 200
+# Rebuild the database file once this fraction of its pages is unused
+COMPACT_FREE_RATIO = 0.25
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS receipts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        profile TEXT NOT NULL,
+        store_name TEXT,
+        purchase_date TEXT,
+        item TEXT,
+        price TEXT,
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_receipts_profile ON receipts (profile, id);
+    CREATE TABLE IF NOT EXISTS store_meta (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+    INSERT OR IGNORE INTO store_meta (name, value) VALUES ('appends_since_compact', 0);
+    INSERT OR IGNORE INTO store_meta (name, value) VALUES ('data_version', 0);
+"""
+
+# Schema changes applied in order to existing stores (PRAGMA user_version counts the applied ones)
+_MIGRATIONS = [
+    # 1: typed amount and purchase date columns, and spending totals kept up to date on every write
+    """
+    ALTER TABLE receipts ADD COLUMN amount REAL;
+    ALTER TABLE receipts ADD COLUMN purchased_on TEXT;
+    CREATE INDEX IF NOT EXISTS idx_receipts_profile_date ON receipts (profile, purchased_on);
+    CREATE TABLE IF NOT EXISTS spending_totals (
+        profile TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        key TEXT NOT NULL,
+        amount REAL NOT NULL,
+        item_count INTEGER NOT NULL,
+        PRIMARY KEY (profile, kind, key)
+    );
+    """,
+    # 2: indexes for sorting and filtering the history of a profile
+    """
+    CREATE INDEX IF NOT EXISTS idx_receipts_profile_store ON receipts (profile, store_name, id);
+    CREATE INDEX IF NOT EXISTS idx_receipts_profile_amount ON receipts (profile, amount);
+    """,
+    # 3: perceptual hashes of recorded receipt images, for duplicate detection
+    """
+    CREATE TABLE IF NOT EXISTS image_hashes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        profile TEXT NOT NULL,
+        dhash INTEGER NOT NULL,
+        cache_key TEXT NOT NULL,
+        file_name TEXT,
+        created_at REAL NOT NULL,
+        UNIQUE (profile, cache_key)
+    );
+    """,
+]
+
+# Orders offered by the history table (each one is served by an index)
+HISTORY_SORTS = {
+    "Newest first": "id DESC",
+    "Oldest first": "id ASC",
+    "Purchase date (newest)": "purchased_on DESC, id DESC",
+    "Purchase date (oldest)": "purchased_on ASC, id ASC",
+    "Price (highest)": "amount DESC, id DESC",
+    "Price (lowest)": "amount ASC, id ASC",
+}
+# History pages kept in memory per profile, and profiles with cached pages
+PAGE_CACHE_PAGES = 10
+PAGE_CACHE_PROFILES = 64
+
+# Kinds of spending totals: each row of receipts adds to one key of every kind
+TOTAL_KINDS = ("store", "month", "item")
+UNKNOWN_KEY = "Unknown"
+
+# Append requests waiting to be committed, per user
+_pending_groups = {}
+_group_lock = threading.Lock()
+
+# (username, profile) -> (profile version, OrderedDict of query -> cached page)
+_page_cache = OrderedDict()
+_page_cache_lock = threading.Lock()
+
+
+# Function to get the path of a user's receipt database
+def get_store_path(username):
+    return os.path.join(BASE_DIR, username, 'receipts.sqlite3')
+
+
+# Function to get the path of a profile's legacy Excel file
+def get_legacy_excel_path(username, profile_name):
+    return os.path.join(BASE_DIR, username, f'{profile_name}.xlsx')
+
+
+# Function to open a user's receipt database (creating it if needed)
+def _connect(username):
+    os.makedirs(os.path.join(BASE_DIR, username), exist_ok=True)
+    conn = sqlite3.connect(get_store_path(username), timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")  # Appends don't block readers
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    if conn.execute("PRAGMA user_version").fetchone()[0] < len(_MIGRATIONS):
+        _migrate(conn)
+    return conn
+
+
+# Function to bring an existing store up to the current schema
+def _migrate(conn):
+    conn.execute("BEGIN IMMEDIATE")  # Only one connection migrates; the others wait and see the new version
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for index in range(version, len(_MIGRATIONS)):
+            for statement in _MIGRATIONS[index].split(";"):
+                if statement.strip():
+                    conn.execute(statement)
+            if index == 0:
+                _backfill_typed_columns(conn)
+            conn.execute(f"PRAGMA user_version = {index + 1}")
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+# Function to fill the typed columns and spending totals of rows written before they existed
+def _backfill_typed_columns(conn):
+    rows = conn.execute("SELECT id, profile, store_name, purchase_date, item, price FROM receipts").fetchall()
+    updates, typed_rows = [], []
+    for row_id, profile_name, store, date, item, price in rows:
+        amount, purchased_on = parse_amount(price), normalize_date(date)
+        updates.append((amount, purchased_on, row_id))
+        typed_rows.append((profile_name, store, item, amount, purchased_on))
+    conn.executemany("UPDATE receipts SET amount = ?, purchased_on = ? WHERE id = ?", updates)
+    _add_to_totals(conn, typed_rows)
+
+
+# Function to turn a stored price such as "12.50", "RM 1,234.50" or "3,20" into a number (None if there is none)
+def parse_amount(price):
+    if price is None:
+        return None
+    try:
+        return parse_price(price)
+    except ValueError:
+        return None
+
+
+# Function to build the row tuple stored for one receipt item
+def _receipt_row(profile_name, store, date, item, price, created_at):
+    return (profile_name, store, date, item, price, parse_amount(price), normalize_date(date), created_at)
+
+
+# Function to insert receipt rows and add them to the spending totals (inside the caller's transaction)
+def _insert_rows(conn, rows):
+    conn.executemany(
+        "INSERT INTO receipts (profile, store_name, purchase_date, item, price, amount, purchased_on, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+    _add_to_totals(conn, [(row[0], row[1], row[3], row[5], row[6]) for row in rows])
+    _bump_versions(conn, {row[0] for row in rows})
+
+
+# Function to mark the user's data and the given profiles as changed (inside the caller's transaction)
+def _bump_versions(conn, profile_names):
+    conn.execute("UPDATE store_meta SET value = value + 1 WHERE name = 'data_version'")
+    conn.executemany(
+        "INSERT INTO store_meta (name, value) VALUES (?, 1) ON CONFLICT (name) DO UPDATE SET value = value + 1",
+        [(f"version:{profile_name}",) for profile_name in profile_names],
+    )
+
+
+# Function to add (profile, store, item, amount, purchased_on) rows to the spending totals
+def _add_to_totals(conn, typed_rows):
+    deltas = {}
+    for profile_name, store, item, amount, purchased_on in typed_rows:
+        keys = (
+            _total_key(store),
+            purchased_on[:7] if purchased_on else UNKNOWN_KEY,
+            _total_key(item),
+        )
+        for kind, key in zip(TOTAL_KINDS, keys):
+            total = deltas.setdefault((profile_name, kind, key), [0.0, 0])
+            total[0] += amount or 0.0
+            total[1] += 1
+    conn.executemany(
+        "INSERT INTO spending_totals (profile, kind, key, amount, item_count) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT (profile, kind, key) DO UPDATE SET "
+        "amount = amount + excluded.amount, item_count = item_count + excluded.item_count",
+        [(profile_name, kind, key, amount, count) for (profile_name, kind, key), (amount, count) in deltas.items()],
+    )
+
+
+# Function to get the key a store or item name is totalled under
+def _total_key(name):
+    name = " ".join(str(name).split()) if name is not None else ""
+    return name or UNKNOWN_KEY
+
+
+# Function to import a profile's existing .xlsx into the store (runs once per profile)
+def migrate_excel_profile(username, profile_name, conn=None):
+    """Move rows from user_folders/{username}/{profile}.xlsx into the store.
+
+    The workbook is renamed to .xlsx.migrated afterwards so it is only imported once.
+    """
+    excel_file_path = get_legacy_excel_path(username, profile_name)
+    if not os.path.exists(excel_file_path):
+        return 0
+
+    # Two sessions may open the same legacy profile at once; only one of them may import it
+    with file_lock(excel_file_path):
+        if not os.path.exists(excel_file_path):
+            return 0
+        return _import_excel(username, profile_name, excel_file_path, conn)
+
+
+# Function to copy the rows of a legacy workbook into the store
+def _import_excel(username, profile_name, excel_file_path, conn):
+    df = pd.read_excel(excel_file_path, engine='openpyxl')
+    df = df.reindex(columns=RECEIPT_COLUMNS)
+    df = df.dropna(how='all')
+    rows = [
+        _receipt_row(profile_name, _cell(store), _cell(date), _cell(item), _cell(price), time.time())
+        for store, date, item, price in df.itertuples(index=False, name=None)
+    ]
+
+    own_conn = conn is None
+    if own_conn:
+        conn = _connect(username)
+    try:
+        with conn:
+            _insert_rows(conn, rows)
+    finally:
+        if own_conn:
+            conn.close()
+
+    os.replace(excel_file_path, excel_file_path + '.migrated')
+    return len(rows)
+
+
+# Function to import every legacy .xlsx profile of a user
+def migrate_user_folder(username):
+    user_folder = os.path.join(BASE_DIR, username)
+    if not os.path.isdir(user_folder):
+        return 0
+    migrated = 0
+    for filename in os.listdir(user_folder):
+        if filename.endswith('.xlsx'):
+            migrated += migrate_excel_profile(username, filename[:-len('.xlsx')])
+    return migrated
+
+
+# Function to convert a spreadsheet cell into a value SQLite can store
+def _cell(value):
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return None
+    return str(value)
+
+
+# Function to make sure a profile's store exists
+def create_profile_store(profile_name, username):
+    conn = _connect(username)
+    try:
+        migrate_excel_profile(username, profile_name, conn)
+    finally:
+        conn.close()
+
+
+# Function to append receipt items to a profile
+def append_receipt_items(username, profile_name, items):
+    """Append items ({"Store Name", "Date", "Item Purchased", "Price"}) to the profile.
+
+    The cost only depends on the number of new rows, not on the size of the profile.
+    Appends to the same user's store that arrive within GROUP_COMMIT_WINDOW are written
+    together in one transaction (group commit): the first caller waits briefly, then
+    commits everyone's rows while the others wait for it.
+    """
+    now = time.time()
+    request = {
+        "profile": profile_name,
+        "rows": [
+            _receipt_row(profile_name, item.get("Store Name"), item.get("Date"), item.get("Item Purchased"), item.get("Price"), now)
+            for item in items
+        ],
+        "done": threading.Event(),
+        "error": None,
+    }
+
+    with _group_lock:
+        group = _pending_groups.setdefault(username, [])
+        group.append(request)
+        is_leader = len(group) == 1
+
+    if is_leader:
+        time.sleep(GROUP_COMMIT_WINDOW)  # Let concurrent uploads join this commit
+        with _group_lock:
+            group = _pending_groups.pop(username)
+        try:
+            _commit_group(username, group)
+        except Exception as e:
+            for member in group:
+                member["error"] = e
+        finally:
+            for member in group:
+                member["done"].set()
+    else:
+        request["done"].wait()
+
+    if request["error"] is not None:
+        raise request["error"]
+    return len(request["rows"])
+
+
+# Function to write the rows of a group of append requests in a single transaction
+def _commit_group(username, group):
+    conn = _connect(username)
+    try:
+        for profile_name in {member["profile"] for member in group}:
+            migrate_excel_profile(username, profile_name, conn)
+        with span("store.append"), conn:
+            _insert_rows(conn, [row for member in group for row in member["rows"]])
+            conn.execute(
+                "UPDATE store_meta SET value = value + 1 WHERE name = 'appends_since_compact'"
+            )
+        appends = conn.execute(
+            "SELECT value FROM store_meta WHERE name = 'appends_since_compact'"
+        ).fetchone()[0]
+        if appends >= COMPACT_EVERY:
+            _compact(conn)
+    finally:
+        conn.close()
+
+
+# Function to get one page of a profile's history, sorted and filtered in the database
+def fetch_page(username, profile_name, page=0, page_size=50, sort="Newest first", store=None,
+               start_date=None, end_date=None, min_price=None, max_price=None):
+    """Return (DataFrame of the rows on `page`, number of matching rows).
+
+    The last PAGE_CACHE_PAGES pages of each profile are kept in memory until the
+    profile changes, so paging back and forth doesn't touch the database.
+    """
+    where, params = _record_filter(profile_name, store, start_date, end_date, min_price, max_price)
+    query_key = (page, page_size, sort, tuple(params))
+
+    conn = _connect(username)
+    try:
+        migrate_excel_profile(username, profile_name, conn)
+        version = _get_profile_version(conn, profile_name)
+        cached = _get_cached_page(username, profile_name, version, query_key)
+        if cached is not None:
+            return cached
+        with span("store.fetch_page"):
+            df = pd.read_sql_query(
+                f"SELECT store_name, purchase_date, item, price FROM receipts WHERE {where} "
+                f"ORDER BY {HISTORY_SORTS[sort]} LIMIT ? OFFSET ?",
+                conn,
+                params=params + [page_size, page * page_size],
+            )
+            total = conn.execute(f"SELECT COUNT(*) FROM receipts WHERE {where}", params).fetchone()[0]
+    finally:
+        conn.close()
+    df.columns = RECEIPT_COLUMNS
+    _put_cached_page(username, profile_name, version, query_key, (df, total))
+    return df, total
+
+
+# Function to build the WHERE clause selecting a profile's records (None means no filter)
+def _record_filter(profile_name, store=None, start_date=None, end_date=None, min_price=None, max_price=None):
+    conditions, params = ["profile = ?"], [profile_name]
+    for condition, value in (("store_name = ?", store), ("purchased_on >= ?", start_date),
+                             ("purchased_on <= ?", end_date), ("amount >= ?", min_price),
+                             ("amount <= ?", max_price)):
+        if value is not None:
+            conditions.append(condition)
+            params.append(str(value) if condition.startswith("purchased_on") else value)
+    return " AND ".join(conditions), params
+
+
+# Function to stream a profile's records (oldest first) in batches of rows straight from a cursor
+def iter_profile_records(username, profile_name, batch_size=5000, store=None, start_date=None, end_date=None):
+    """Yield lists of (store name, date, item, price) tuples; memory use is bounded by batch_size."""
+    where, params = _record_filter(profile_name, store, start_date, end_date)
+    conn = _connect(username)
+    try:
+        migrate_excel_profile(username, profile_name, conn)
+        cursor = conn.execute(
+            f"SELECT store_name, purchase_date, item, price FROM receipts WHERE {where} ORDER BY id", params
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+
+# Function to get the number of times a profile has changed
+def get_profile_version(username, profile_name):
+    conn = _connect(username)
+    try:
+        return _get_profile_version(conn, profile_name)
+    finally:
+        conn.close()
+
+
+# Function to get the store names used in a profile (for the history filter)
+def get_profile_stores(username, profile_name):
+    conn = _connect(username)
+    try:
+        version = _get_profile_version(conn, profile_name)
+        cached = _get_cached_page(username, profile_name, version, "stores")
+        if cached is not None:
+            return cached
+        stores = [row[0] for row in conn.execute(
+            "SELECT DISTINCT store_name FROM receipts WHERE profile = ? AND store_name IS NOT NULL ORDER BY store_name",
+            (profile_name,),
+        )]
+    finally:
+        conn.close()
+    _put_cached_page(username, profile_name, version, "stores", stores)
+    return stores
+
+
+# Function to get the number of times a profile has changed
+def _get_profile_version(conn, profile_name):
+    row = conn.execute("SELECT value FROM store_meta WHERE name = ?", (f"version:{profile_name}",)).fetchone()
+    return row[0] if row else 0
+
+
+# Function to look up a cached page of a profile at the given version
+def _get_cached_page(username, profile_name, version, query_key):
+    with _page_cache_lock:
+        entry = _page_cache.get((username, profile_name))
+        if entry is None or entry[0] != version or query_key not in entry[1]:
+            return None
+        _page_cache.move_to_end((username, profile_name))
+        entry[1].move_to_end(query_key)
+        return entry[1][query_key]
+
+
+# Function to cache a page of a profile, dropping pages of older versions
+def _put_cached_page(username, profile_name, version, query_key, result):
+    with _page_cache_lock:
+        entry = _page_cache.get((username, profile_name))
+        if entry is None or entry[0] != version:
+            entry = _page_cache[(username, profile_name)] = (version, OrderedDict())
+        _page_cache.move_to_end((username, profile_name))
+        entry[1][query_key] = result
+        while len(entry[1]) > PAGE_CACHE_PAGES:
+            entry[1].popitem(last=False)
+        while len(_page_cache) > PAGE_CACHE_PROFILES:
+            _page_cache.popitem(last=False)
+
+
+# Function to remember the perceptual hash of a recorded receipt image
+def add_image_hash(username, profile_name, dhash, cache_key, file_name=None):
+    # SQLite integers are signed 64-bit
+    signed_hash = dhash - (1 << 64) if dhash >= (1 << 63) else dhash
+    conn = _connect(username)
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO image_hashes (profile, dhash, cache_key, file_name, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (profile_name, signed_hash, cache_key, file_name, time.time()),
+            )
+    finally:
+        conn.close()
+
+
+# Function to load the image hashes added after `after_id`, and the number of hashes stored
+def load_image_hashes(username, after_id=0):
+    """Return ([(id, profile, dhash, cache_key, file_name, created_at)], total count)."""
+    conn = _connect(username)
+    try:
+        conn.execute("BEGIN")  # Read the rows and the count from the same snapshot
+        rows = conn.execute(
+            "SELECT id, profile, dhash, cache_key, file_name, created_at FROM image_hashes WHERE id > ? ORDER BY id",
+            (after_id,),
+        ).fetchall()
+        count = conn.execute("SELECT COUNT(*) FROM image_hashes").fetchone()[0]
+    finally:
+        conn.close()
+    return [(row_id, profile_name, dhash % (1 << 64), *rest) for row_id, profile_name, dhash, *rest in rows], count
+
+
+# Function to delete every record of a profile
+def delete_profile_records(username, profile_name):
+    conn = _connect(username)
+    try:
+        with conn:
+            cursor = conn.execute("DELETE FROM receipts WHERE profile = ?", (profile_name,))
+            conn.execute("DELETE FROM spending_totals WHERE profile = ?", (profile_name,))
+            conn.execute("DELETE FROM image_hashes WHERE profile = ?", (profile_name,))
+            _bump_versions(conn, [profile_name])
+        _compact(conn)
+    finally:
+        conn.close()
+
+    # Remove any legacy workbook so it is not imported again
+    for path in (get_legacy_excel_path(username, profile_name), get_legacy_excel_path(username, profile_name) + '.migrated'):
+        if os.path.exists(path):
+            os.remove(path)
+    return cursor.rowcount
+
+
+# Function to get a number that changes whenever any of the user's receipts change
+def get_data_version(username):
+    conn = _connect(username)
+    try:
+        return conn.execute("SELECT value FROM store_meta WHERE name = 'data_version'").fetchone()[0]
+    finally:
+        conn.close()
+
+
+# Function to read the materialized spending totals of some (or all) profiles
+def get_spending_totals(username, kind, profiles=None, limit=None):
+    """Return a DataFrame of key, amount and items for one kind of total ("store", "month", "item"
+    or "profile"), summed over `profiles`. Months are sorted by date, everything else by amount.
+    """
+    column = "profile" if kind == "profile" else "key"
+    query = f"SELECT {column} AS key, SUM(amount) AS amount, SUM(item_count) AS items FROM spending_totals WHERE kind = ?"
+    params = ["store" if kind == "profile" else kind]  # Every row is in exactly one store total
+    if profiles is not None:
+        query += f" AND profile IN ({', '.join('?' * len(profiles))})"
+        params += list(profiles)
+    query += f" GROUP BY {column} ORDER BY " + ("key" if kind == "month" else "amount DESC")
+    if limit is not None:
+        query += f" LIMIT {int(limit)}"
+    conn = _connect(username)
+    try:
+        with span("store.totals"):
+            return pd.read_sql_query(query, conn, params=params)
+    finally:
+        conn.close()
+
+
+# Function to load the typed line items of some (or all) profiles for ad-hoc analysis
+def load_line_items(username, profiles=None):
+    query = "SELECT profile, store_name, purchased_on, item, amount FROM receipts"
+    params = []
+    if profiles is not None:
+        query += f" WHERE profile IN ({', '.join('?' * len(profiles))})"
+        params = list(profiles)
+    conn = _connect(username)
+    try:
+        with span("store.load_items"):
+            df = pd.read_sql_query(query, conn, params=params)
+    finally:
+        conn.close()
+    df["profile"] = df["profile"].astype("category")
+    df["store_name"] = df["store_name"].fillna(UNKNOWN_KEY).astype("category")
+    df["purchased_on"] = pd.to_datetime(df["purchased_on"], errors="coerce")
+    df["amount"] = df["amount"].astype("float64")
+    return df
+
+
+# Function to checkpoint the write-ahead log and reclaim space left by deletions
+def _compact(conn):
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if page_count and freelist_count / page_count >= COMPACT_FREE_RATIO:
+        conn.execute("VACUUM")
+    with conn:
+        conn.execute("UPDATE store_meta SET value = 0 WHERE name = 'appends_since_compact'")
+
+
+# Function to compact a user's store on demand
+def compact_store(username):
+    conn = _connect(username)
+    try:
+        _compact(conn)
+    finally:
+        conn.close()
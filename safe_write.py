@@ -0,0 +1,88 @@
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+# fcntl gives us locks that also hold across server processes; it is not available on Windows
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+# Function to get the in-process lock of a file
+def _get_thread_lock(path):
+    path = os.path.abspath(path)
+    with _thread_locks_guard:
+        return _thread_locks.setdefault(path, threading.RLock())
+
+
+# Context manager holding an exclusive lock on a file for a read-modify-write
+@contextmanager
+def file_lock(path):
+    """Lock `path` against other threads and processes (via a `path.lock` file).
+
+    Readers don't need the lock because writers only ever replace the file atomically.
+    """
+    thread_lock = _get_thread_lock(path)
+    with thread_lock:
+        if fcntl is None:
+            yield
+            return
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with open(path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+# Function to replace a file atomically with the output of `write_fn(file_object)`
+def atomic_write(path, write_fn, mode="w", encoding="utf-8"):
+    """Write to a temp file in the same directory, flush it to disk and rename it over `path`.
+
+    Readers see either the old or the new file, never a half-written one.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode, encoding=None if "b" in mode else encoding, newline="" if "b" not in mode else None) as f:
+            write_fn(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+# Function to write a DataFrame to CSV atomically
+def atomic_write_csv(df, path):
+    atomic_write(path, lambda f: df.to_csv(f, index=False))
+
+
+# Function to read a CSV, change it and write it back without losing concurrent updates
+def update_csv(path, columns, update_fn):
+    """Run `update_fn(df)` on the current contents of `path` under the file lock.
+
+    `update_fn` returns (new_df, result); new_df is written atomically unless it is None.
+    Returns `result`.
+    """
+    import pandas as pd  # Imported here so modules that only need locking stay light
+
+    with file_lock(path):
+        if os.path.exists(path):
+            df = pd.read_csv(path, dtype=str, keep_default_na=False)  # Cells stay strings, e.g. a profile named "2024"
+        else:
+            df = pd.DataFrame(columns=columns)
+        new_df, result = update_fn(df)
+        if new_df is not None:
+            atomic_write_csv(new_df, path)
+    return result
@@ -0,0 +1,208 @@
+import os
+import sqlite3
+import threading
+import time
+
+# Usage ledger lives with the other application-wide data
+APP_DATA_DIR = '.app_data'
+USAGE_FILE = os.path.join(APP_DATA_DIR, 'token_usage.sqlite3')
+
+# Budget settings (overridden from secrets with configure_budgets)
+MONTHLY_TOKENS_PER_USER = 500000  # 0 disables the monthly budget
+MAX_COMPLETION_TOKENS = 1000  # Upper bound requested for a single completion
+MIN_COMPLETION_TOKENS = 200  # Below this a down-scaled request is not worth sending
+BUDGET_MODE = "downscale"  # "downscale" shrinks max_tokens to fit, "reject" refuses the request
+
+# Chat format overhead per message and for priming the reply (see OpenAI's token counting guide)
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS usage_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at REAL NOT NULL,
+        username TEXT NOT NULL,
+        profile TEXT NOT NULL,
+        model TEXT NOT NULL,
+        prompt_tokens INTEGER NOT NULL,
+        completion_tokens INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS usage_totals (
+        username TEXT NOT NULL,
+        profile TEXT NOT NULL,
+        month TEXT NOT NULL,
+        requests INTEGER NOT NULL,
+        prompt_tokens INTEGER NOT NULL,
+        completion_tokens INTEGER NOT NULL,
+        PRIMARY KEY (username, profile, month)
+    );
+"""
+
+_encoders = {}
+_encoder_lock = threading.Lock()
+_warming = set()  # Models whose tokenizer is (or was) loaded by warm_up_encoder
+_warming_lock = threading.Lock()  # Separate from _encoder_lock, which is held while a tokenizer loads
+
+
+class BudgetExceededError(Exception):
+    """Raised when a request would exceed the user's token budget."""
+
+
+# Function to get the shared tokenizer for a model (loaded once per process)
+def get_encoder(model):
+    encoder = _encoders.get(model)
+    if encoder is None:
+        with _encoder_lock:
+            encoder = _encoders.get(model)
+            if encoder is None:
+                import tiktoken  # Imported on first use; it is slow to import and only the upload path needs it
+                encoder = tiktoken.encoding_for_model(model)
+                _encoders[model] = encoder
+    return encoder
+
+
+# Function to load a model's tokenizer in a background thread, so the first upload does not wait for it
+def warm_up_encoder(model):
+    with _warming_lock:
+        if model in _encoders or model in _warming:
+            return None
+        _warming.add(model)
+
+    def load():
+        try:
+            get_encoder(model)
+        except Exception:
+            pass  # The upload path loads it again and reports the error there
+
+    thread = threading.Thread(target=load, name=f"warm-up-{model}", daemon=True)
+    thread.start()
+    return thread
+
+
+# Function to count the prompt tokens of the exact messages sent to the API
+def count_message_tokens(messages, model):
+    encoder = get_encoder(model)
+    token_count = TOKENS_PER_REPLY
+    for message in messages:
+        token_count += TOKENS_PER_MESSAGE
+        token_count += len(encoder.encode(message['role']))
+        token_count += len(encoder.encode(message['content']))
+    return token_count
+
+
+# Function to count the tokens of a piece of text
+def count_text_tokens(text, model):
+    return len(get_encoder(model).encode(text))
+
+
+# Function to change the budget settings
+def configure_budgets(monthly_tokens=None, max_completion_tokens=None, mode=None):
+    global MONTHLY_TOKENS_PER_USER, MAX_COMPLETION_TOKENS, BUDGET_MODE
+    if monthly_tokens is not None:
+        MONTHLY_TOKENS_PER_USER = int(monthly_tokens)
+    if max_completion_tokens is not None:
+        MAX_COMPLETION_TOKENS = int(max_completion_tokens)
+    if mode is not None:
+        if mode not in ("downscale", "reject"):
+            raise ValueError(f"Unknown budget mode: {mode}")
+        BUDGET_MODE = mode
+
+
+# Function to open a connection to the usage ledger
+def _connect():
+    os.makedirs(APP_DATA_DIR, exist_ok=True)
+    conn = sqlite3.connect(USAGE_FILE, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+# Function to get the current month key used by the ledger
+def _current_month():
+    return time.strftime("%Y-%m")
+
+
+# Function to check a request against the user's budget before calling the API
+def check_budget(username, prompt_tokens, completions=1):
+    """Return the max_tokens to request per completion, or raise BudgetExceededError.
+
+    `prompt_tokens` covers all requests of the receipt and `completions` is how many
+    completions share the allowance (the chunks of a long receipt). In "downscale" mode
+    the completion allowance shrinks to what is left of the monthly budget; in "reject"
+    mode every completion must fit with the full allowance.
+    """
+    if not MONTHLY_TOKENS_PER_USER:
+        return MAX_COMPLETION_TOKENS
+
+    remaining = MONTHLY_TOKENS_PER_USER - get_monthly_usage(username)
+    available = (remaining - prompt_tokens) // completions
+    if available >= MAX_COMPLETION_TOKENS:
+        return MAX_COMPLETION_TOKENS
+    if BUDGET_MODE == "downscale" and available >= MIN_COMPLETION_TOKENS:
+        return available
+    raise BudgetExceededError(
+        f"Monthly token budget reached for '{username}' ({max(remaining, 0)} of "
+        f"{MONTHLY_TOKENS_PER_USER} tokens left, this receipt needs about "
+        f"{prompt_tokens + completions * MIN_COMPLETION_TOKENS})."
+    )
+
+
+# Function to get the tokens a user has used this month
+def get_monthly_usage(username, month=None):
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT COALESCE(SUM(prompt_tokens + completion_tokens), 0) FROM usage_totals "
+            "WHERE username = ? AND month = ?",
+            (username, month or _current_month()),
+        ).fetchone()
+    finally:
+        conn.close()
+    return row[0]
+
+
+# Function to record the tokens used by one API call
+def record_usage(username, profile, model, prompt_tokens, completion_tokens):
+    conn = _connect()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT INTO usage_log (created_at, username, profile, model, prompt_tokens, completion_tokens) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (time.time(), username, profile, model, prompt_tokens, completion_tokens),
+            )
+            # Keep the monthly totals up to date so the admin panel never scans the log
+            conn.execute(
+                "INSERT INTO usage_totals (username, profile, month, requests, prompt_tokens, completion_tokens) "
+                "VALUES (?, ?, ?, 1, ?, ?) "
+                "ON CONFLICT (username, profile, month) DO UPDATE SET "
+                "requests = requests + 1, "
+                "prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+                "completion_tokens = completion_tokens + excluded.completion_tokens",
+                (username, profile, _current_month(), prompt_tokens, completion_tokens),
+            )
+    finally:
+        conn.close()
+
+
+# Function to summarise token usage per user (and optionally per profile) for a month
+def get_usage_summary(month=None, by_profile=False):
+    group = "username, profile" if by_profile else "username"
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            f"SELECT {group}, SUM(requests), SUM(prompt_tokens), SUM(completion_tokens) "
+            f"FROM usage_totals WHERE month = ? GROUP BY {group} ORDER BY {group}",
+            (month or _current_month(),),
+        ).fetchall()
+    finally:
+        conn.close()
+
+    columns = ["username", "profile"] if by_profile else ["username"]
+    columns += ["requests", "prompt_tokens", "completion_tokens"]
+    summary = [dict(zip(columns, row)) for row in rows]
+    for entry in summary:
+        entry["total_tokens"] = entry["prompt_tokens"] + entry["completion_tokens"]
+        if MONTHLY_TOKENS_PER_USER and not by_profile:
+            entry["budget_used"] = entry["total_tokens"] / MONTHLY_TOKENS_PER_USER
+    return summary